@@ -0,0 +1,22 @@
+"""
+ASGI config for media_management_api project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "media_management_api.settings.aws")
+
+application = get_asgi_application()
+
+# Serve the async views as coroutine functions. This must happen before the first
+# request loads the URLconf.
+from media_management_api.media_service import aio  # noqa: E402
+
+aio.serve_asgi()
@@ -0,0 +1,309 @@
+"""
+Admission control for expensive endpoints.
+
+Endpoints that are expensive to serve (remote imports, zip uploads, course copies, ...)
+are grouped into admission classes configured in ADMISSION_CONTROL. For each class:
+
+- "rate" and "burst": every user (or client address, when anonymous) has a token bucket
+  that refills at "rate" requests per second and holds at most "burst" tokens.
+- "concurrency": at most this many requests of the class are served at once, across all
+  processes and hosts.
+- "statement_timeout": database statements made while serving the request are cancelled
+  after this many milliseconds (PostgreSQL only).
+
+The buckets and concurrency slots live in Redis so that they are shared by every worker.
+If Redis is unavailable requests are admitted, since refusing all expensive requests
+would be worse than serving them unthrottled.
+"""
+import contextlib
+import contextvars
+import logging
+import math
+import time
+import uuid
+
+import redis
+from django.conf import settings
+from django.db import OperationalError
+from django.db.backends.signals import connection_created
+from rest_framework import exceptions
+
+from .aio import database_sync_to_async
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "media_management_api:admission"
+
+# A concurrency slot that hasn't been released after this many seconds is assumed to
+# belong to a process that died, and is given to another request.
+SLOT_TIMEOUT = 3600
+
+# The SQLSTATE of a statement cancelled by statement_timeout
+QUERY_CANCELED = "57014"
+
+# Refills the bucket for the time elapsed since the last request, then takes a token.
+# Returns the number of seconds until a token is available, or 0 if one was taken.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call("HMGET", KEYS[1], "tokens", "timestamp")
+local tokens = tonumber(state[1]) or burst
+local timestamp = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - timestamp) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HMSET", KEYS[1], "tokens", tokens, "timestamp", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+# Takes a slot in a sorted set of slot ids scored by the time they were taken, after
+# dropping any slots that have expired. Returns 1 if a slot was taken, 0 otherwise.
+CONCURRENCY_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local timeout = tonumber(ARGV[3])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - timeout)
+if redis.call("ZCARD", KEYS[1]) >= limit then
+    return 0
+end
+redis.call("ZADD", KEYS[1], now, ARGV[4])
+redis.call("EXPIRE", KEYS[1], timeout)
+return 1
+"""
+
+_statement_timeout = contextvars.ContextVar("statement_timeout", default=None)
+
+_redis = None
+
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        # Short timeouts, so that a slow Redis doesn't hold up every expensive request
+        _redis = redis.StrictRedis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5,
+        )
+    return _redis
+
+
+def get_admission_settings(admission_class):
+    if not getattr(settings, "ADMISSION_CONTROL_ENABLED", True):
+        return {}
+    return getattr(settings, "ADMISSION_CONTROL", {}).get(admission_class, {})
+
+
+def get_client_id(request):
+    if request.user and request.user.is_authenticated:
+        return "user:%s" % request.user.pk
+    return "addr:%s" % request.META.get("REMOTE_ADDR", "")
+
+
+class TokenBucket:
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    def take(self):
+        """
+        Takes a token from the bucket. Returns 0 if a token was taken, otherwise the
+        number of seconds until one will be available.
+        """
+        script = get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+        wait = script(keys=[self.key], args=[self.rate, self.burst, time.time()])
+        return float(wait)
+
+
+class ConcurrencyLimiter:
+    def __init__(self, key, limit):
+        self.key = key
+        self.limit = limit
+
+    def acquire(self):
+        """
+        Takes a slot. Returns the slot id, or None if all slots are taken.
+        """
+        slot = uuid.uuid4().hex
+        script = get_redis().register_script(CONCURRENCY_SCRIPT)
+        if script(keys=[self.key], args=[self.limit, time.time(), SLOT_TIMEOUT, slot]):
+            return slot
+        return None
+
+    def release(self, slot):
+        get_redis().zrem(self.key, slot)
+
+
+def admit(admission_class, request):
+    """
+    Admits a request of the given class, or raises Throttled (429) if it must wait.
+
+    Returns a function that releases the request's concurrency slot, which must be
+    called once the request has been served.
+    """
+    config = get_admission_settings(admission_class)
+    client_id = get_client_id(request)
+    try:
+        if config.get("rate"):
+            bucket = TokenBucket(
+                "%s:bucket:%s:%s" % (KEY_PREFIX, admission_class, client_id),
+                config["rate"],
+                config.get("burst", 1),
+            )
+            wait = bucket.take()
+            if wait:
+                logger.info(
+                    "Rate limited %s request from %s for %.1fs"
+                    % (admission_class, client_id, wait)
+                )
+                raise exceptions.Throttled(wait=math.ceil(wait))
+
+        if config.get("concurrency"):
+            limiter = ConcurrencyLimiter(
+                "%s:slots:%s" % (KEY_PREFIX, admission_class), config["concurrency"]
+            )
+            slot = limiter.acquire()
+            if slot is None:
+                logger.info(
+                    "Too many concurrent %s requests, rejected request from %s"
+                    % (admission_class, client_id)
+                )
+                raise exceptions.Throttled(
+                    wait=config.get("retry_after", 5),
+                    detail="Too many %s requests are in progress." % admission_class,
+                )
+            return lambda: _release(limiter, slot)
+    except redis.RedisError as e:
+        logger.warning(
+            "Admission control unavailable, admitting %s request: %s"
+            % (admission_class, e)
+        )
+    return lambda: None
+
+
+def _release(limiter, slot):
+    try:
+        limiter.release(slot)
+    except redis.RedisError as e:
+        # The slot expires after SLOT_TIMEOUT
+        logger.warning("Unable to release %s: %s" % (limiter.key, e))
+
+
+def set_statement_timeout(timeout):
+    """
+    Sets the statement timeout, in milliseconds, for queries in the current context.
+    None restores the database's default.
+    """
+    _statement_timeout.set(timeout)
+
+
+def get_statement_timeout():
+    return _statement_timeout.get()
+
+
+@contextlib.contextmanager
+def statement_timeout(timeout):
+    """
+    Cancels queries in the block that run for longer than timeout milliseconds.
+    """
+    token = _statement_timeout.set(timeout)
+    try:
+        yield
+    finally:
+        _statement_timeout.reset(token)
+
+
+def statement_timeout_wrapper(execute, sql, params, many, context):
+    """
+    Database execute wrapper that applies the statement timeout of the current context
+    to the connection before running a query, if it isn't already in effect.
+    """
+    connection = context["connection"]
+    timeout = get_statement_timeout()
+    # Views set the timeout before their first query, which runs outside a transaction,
+    # so the SET normally isn't undone by a rollback.
+    if connection.current_statement_timeout != timeout:
+        # Use the DB-API cursor so the SET doesn't go through the wrappers again
+        cursor = context["cursor"].cursor
+        if timeout is None:
+            cursor.execute("SET statement_timeout TO DEFAULT")
+        else:
+            cursor.execute("SET statement_timeout = %s", [int(timeout)])
+        connection.current_statement_timeout = timeout
+    return execute(sql, params, many, context)
+
+
+def install_statement_timeout(sender, connection, **kwargs):
+    if connection.vendor != "postgresql":
+        return
+    connection.current_statement_timeout = None
+    connection.execute_wrappers.append(statement_timeout_wrapper)
+
+
+class AdmissionControlMixin:
+    """
+    Applies admission control to the requests of an API view.
+
+    Set admission_classes to a dict that maps request methods to admission classes, for
+    example {"POST": "ingest"}. Requests are admitted after authentication, so that
+    buckets are kept per user, and their concurrency slot is released when the response
+    is finalized.
+
+    Requests are admitted after the checks of the classes that follow the mixin, such as
+    IdempotencyMixin, so that requests those checks answer don't take a token or a slot.
+    Requests dispatched by AsyncAPIView.dispatch_async() are admitted in
+    initial_async(), after the checks that wait on the event loop.
+    """
+
+    admission_classes = {}
+
+    def get_admission_class(self, request):
+        return self.admission_classes.get(request.method)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if getattr(self, "dispatching_async", False):
+            # Admitted in initial_async() instead
+            return
+        self.admit_request(request)
+
+    async def initial_async(self, request, *args, **kwargs):
+        await super().initial_async(request, *args, **kwargs)
+        await database_sync_to_async(self.admit_request)(request)
+
+    def admit_request(self, request):
+        admission_class = self.get_admission_class(request)
+        if admission_class is None:
+            return
+        config = get_admission_settings(admission_class)
+        self.release_admission = admit(admission_class, request)
+        set_statement_timeout(config.get("statement_timeout"))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        release = getattr(self, "release_admission", None)
+        if release is not None:
+            self.release_admission = None
+            set_statement_timeout(None)
+            release()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        pgcode = getattr(exc.__cause__, "pgcode", None)
+        if isinstance(exc, OperationalError) and pgcode == QUERY_CANCELED:
+            logger.warning("Statement timeout in %s: %s" % (self.request.path, exc))
+            exc = exceptions.APIException(
+                "The request took too long to complete. Please try again later."
+            )
+            exc.status_code = 503
+        return super().handle_exception(exc)
+
+
+connection_created.connect(install_statement_timeout)
@@ -0,0 +1,161 @@
+"""
+Helpers for the async views served when running under ASGI.
+
+Django's ORM (and the boto S3 client) are synchronous, so async views hand that work to
+a bounded pool of threads with database_sync_to_async(). Each thread in the pool keeps
+its own database connection, which means ASYNC_DB_THREADS also bounds the number of
+connections a single process can open however many requests it is multiplexing.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync, async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.views import APIView
+
+ASYNC_DB_THREADS = settings.ASYNC_DB_THREADS
+
+# Whether views are served under ASGI (see serve_asgi())
+SERVE_ASGI = False
+
+_executor = None
+_local = threading.local()
+
+
+def _init_thread():
+    _local.in_database_pool = True
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=ASYNC_DB_THREADS,
+            thread_name_prefix="media-service-db",
+            initializer=_init_thread,
+        )
+    return _executor
+
+
+def serve_asgi():
+    """
+    Makes async views coroutine functions, for serving them under ASGI. Must be called
+    before the URLconf is loaded (see asgi.py).
+    """
+    global SERVE_ASGI
+    SERVE_ASGI = True
+
+
+def in_database_pool():
+    """
+    Returns True if called on one of the pool's threads. Database cursors opened there
+    can't be read once the call returns (see database_sync_to_async()).
+    """
+    return getattr(_local, "in_database_pool", False)
+
+
+def database_sync_to_async(func):
+    """
+    Wraps a synchronous function that uses the database so that it can be awaited.
+
+    The function runs on the bounded thread pool, and stale connections are closed
+    before and after each call like Django does at the start and end of a request, so
+    the function must not return anything that still reads from the database (such as a
+    streamed queryset). When
+    ASYNC_DB_THREADS is 0 the function runs in Django's thread sensitive mode instead,
+    sharing the request's thread (and connection).
+    """
+    if not ASYNC_DB_THREADS:
+        return sync_to_async(func, thread_sensitive=True)
+
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return SyncToAsync(inner, thread_sensitive=False, executor=get_executor())
+
+
+class AsyncAPIView(APIView):
+    """
+    An APIView whose handlers may be coroutines.
+
+    Requests to coroutine handlers are dispatched by dispatch_async(), which runs
+    authentication, permission and throttling checks, exception handling and response
+    finalization through database_sync_to_async() so they never block the event loop.
+    Under WSGI, these requests are run in an event loop of their own, and requests to
+    synchronous handlers are dispatched as in any APIView. Under ASGI, the view is a
+    coroutine function, and requests to synchronous handlers are dispatched on the
+    database pool in one go.
+    """
+
+    dispatching_async = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super(AsyncAPIView, cls).as_view(**initkwargs)
+        if not SERVE_ASGI:
+            return view
+
+        @functools.wraps(view)
+        async def async_view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            if self.has_async_handler(request):
+                return await self.dispatch_async(request, *args, **kwargs)
+            return await database_sync_to_async(self.dispatch)(request, *args, **kwargs)
+
+        return async_view
+
+    def get_handler(self, request):
+        if request.method.lower() in self.http_method_names:
+            return getattr(self, request.method.lower(), self.http_method_not_allowed)
+        return self.http_method_not_allowed
+
+    def has_async_handler(self, request):
+        return asyncio.iscoroutinefunction(self.get_handler(request))
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.has_async_handler(request):
+            return async_to_sync(self.dispatch_async)(request, *args, **kwargs)
+        return super(AsyncAPIView, self).dispatch(request, *args, **kwargs)
+
+    async def initial_async(self, request, *args, **kwargs):
+        """
+        Runs on the event loop after initial(), for checks that may have to wait.
+        """
+        pass
+
+    async def dispatch_async(self, request, *args, **kwargs):
+        self.dispatching_async = True
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await database_sync_to_async(self.initial)(request, *args, **kwargs)
+            await self.initial_async(request, *args, **kwargs)
+
+            handler = self.get_handler(request)
+            if asyncio.iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await database_sync_to_async(handler)(
+                    request, *args, **kwargs
+                )
+
+        except Exception as exc:
+            response = await database_sync_to_async(self.handle_exception)(exc)
+
+        self.response = await database_sync_to_async(self.finalize_response)(
+            request, response, *args, **kwargs
+        )
+        return self.response
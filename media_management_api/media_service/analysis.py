@@ -0,0 +1,265 @@
+"""
+Analysis of image files for the media store.
+
+Identifying, validating, measuring and hashing an image is CPU bound, so uploads of many
+images analyze them in a pool of processes (see mediastore.analyzeImages()). The
+functions here are pure and don't depend on Django's settings or database, so that the
+pool's processes only have to import this module.
+
+Pyramidal derivatives of large images (see makePyramidalImage()) are made in the same
+pool, and placeholders (see getImagePlaceholder()) are computed as part of the analysis.
+"""
+import hashlib
+import io
+import math
+import os
+
+import magic
+import PIL
+from django.core.files.images import get_image_dimensions
+from PIL import Image
+
+# Modify max image size that pillow will accept
+# Using the VisibleEarth High Resolution Map as a reference size (https://www.h-schmidt.net/map/)
+PIL.Image.MAX_IMAGE_PIXELS = 933120000  # E.g. 43200x21600
+
+VALID_IMAGE_EXT_FOR_TYPE = {
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/png": "png",
+    "image/tiff": "tif",
+}
+
+CHUNK_SIZE = 64 * 1024
+
+# Placeholders are computed from a copy of the image scaled down to fit in this many
+# pixels, with this many BlurHash components across its longer and shorter sides
+PLACEHOLDER_SIZE = 32
+PLACEHOLDER_COMPONENTS = (4, 3)
+BLURHASH_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+# Pillow modes that can be saved as JPEG2000 as they are
+JPEG2000_MODES = ("L", "LA", "RGB", "RGBA")
+
+
+def getImageExtension(file_type, file_name):
+    """
+    Returns the lowercase file extension (no dot) for a file of the given MIME type,
+    falling back to the extension of its name. Example: "jpg" or "gif"
+    """
+    file_extension = ""
+
+    # Attempt to get the file extension from its mime type
+    if file_type in VALID_IMAGE_EXT_FOR_TYPE:
+        file_extension = VALID_IMAGE_EXT_FOR_TYPE.get(file_type, "")
+
+    # Otherwise fall back to the file name
+    if not file_extension:
+        name_parts = os.path.splitext(file_name or "")
+        if len(name_parts) > 1:
+            file_extension = name_parts[1]
+            if len(file_extension) > 0 and file_extension[0] == ".":
+                file_extension = file_extension[1:]
+        file_extension = file_extension.lower()
+
+        # Set canonical file extension for JPEGs (i.e ."jpeg" -> "jpg")
+        canonical_map = {"jpeg": "jpg"}
+        if file_extension in canonical_map:
+            file_extension = canonical_map[file_extension]
+
+    return file_extension
+
+
+def encodeBase83(value, length):
+    return "".join(
+        BLURHASH_CHARACTERS[(value // 83 ** (length - n)) % 83]
+        for n in range(1, length + 1)
+    )
+
+
+def sRGBToLinear(value):
+    v = value / 255
+    if v <= 0.04045:
+        return v / 12.92
+    return ((v + 0.055) / 1.055) ** 2.4
+
+
+def linearToSRGB(value):
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def encodeBlurHash(im, x_components, y_components):
+    """
+    Returns the BlurHash (https://blurha.sh) of a small RGB image: a string of 20-30
+    characters that clients decode into a blurred preview of the image.
+    """
+    width, height = im.size
+    pixels = [tuple(sRGBToLinear(c) for c in p) for p in im.getdata()]
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == j == 0 else 2
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+            r = g = b = 0.0
+            for y in range(height):
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pixel = pixels[y * width + x]
+                    r += basis * pixel[0]
+                    g += basis * pixel[1]
+                    b += basis * pixel[2]
+            scale = normalisation / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    blurhash = encodeBase83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(c) for factor in ac for c in factor)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+        blurhash += encodeBase83(quantised_max, 1)
+    else:
+        max_value = 1
+        blurhash += encodeBase83(0, 1)
+    r, g, b = (linearToSRGB(c) for c in dc)
+    blurhash += encodeBase83((r << 16) + (g << 8) + b, 4)
+    for factor in ac:
+        r, g, b = (
+            max(0, min(18, int(math.copysign(abs(c / max_value) ** 0.5, c) * 9 + 9.5)))
+            for c in factor
+        )
+        blurhash += encodeBase83(r * 19 * 19 + g * 19 + b, 2)
+    return blurhash
+
+
+def getImagePlaceholder(im):
+    """
+    Returns a placeholder for an open Pillow image, for clients to show until the image
+    loads: its BlurHash and its dominant colour (e.g. "#1a2b3c"). Transparent areas are
+    taken to be white.
+    """
+    im.draft("RGB", (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    small = im.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    if small.mode in ("RGBA", "LA", "PA") or "transparency" in small.info:
+        small = small.convert("RGBA")
+        background = Image.new("RGB", small.size, (255, 255, 255))
+        background.paste(small, mask=small.getchannel("A"))
+        small = background
+    else:
+        small = small.convert("RGB")
+
+    x_components, y_components = PLACEHOLDER_COMPONENTS
+    if small.height > small.width:
+        x_components, y_components = y_components, x_components
+    blurhash = encodeBlurHash(small, x_components, y_components)
+
+    quantized = small.quantize(colors=8)
+    count, index = max(quantized.getcolors())
+    palette = quantized.getpalette()
+    dominant_color = "#%02x%02x%02x" % tuple(palette[index * 3 : index * 3 + 3])
+    return blurhash, dominant_color
+
+
+def analyzeImage(path=None, content=None, file_name=None):
+    """
+    Analyzes an image, given the path of its file or its content.
+
+    Returns a dict with the image's file_type (sniffed with libmagic), file_extension,
+    file_size, file_md5hash, img_width, img_height, placeholder and dominant_color (see
+    getImagePlaceholder()). Whether the image can be opened by Pillow is recorded in
+    open_error, which is None if it can.
+    """
+    f = open(path, "rb") if path is not None else io.BytesIO(content)
+    with f:
+        file_type = magic.from_buffer(f.read(1024), mime=True)
+
+        f.seek(0)
+        open_error = None
+        placeholder = dominant_color = None
+        try:
+            im = Image.open(f)
+        except Exception as e:
+            open_error = str(e)
+        else:
+            try:
+                placeholder, dominant_color = getImagePlaceholder(im)
+            except Exception:
+                # The image can be identified, but not decoded (e.g. it's truncated)
+                pass
+
+        f.seek(0)
+        width, height = get_image_dimensions(f)
+
+        f.seek(0)
+        m = hashlib.md5()
+        file_size = 0
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            m.update(chunk)
+            file_size += len(chunk)
+
+    return {
+        "file_type": file_type,
+        "file_extension": getImageExtension(file_type, file_name),
+        "file_size": file_size,
+        "file_md5hash": m.hexdigest(),
+        "img_width": width,
+        "img_height": height,
+        "placeholder": placeholder,
+        "dominant_color": dominant_color,
+        "open_error": open_error,
+    }
+
+
+def getResolutionCount(width, height, tile_size):
+    """
+    Returns the number of resolutions a pyramid needs for its smallest level to fit in a
+    single tile.
+    """
+    # OpenJPEG can't reduce a tile to less than a pixel (2 ** (levels - 1) <= tile_size)
+    max_levels = tile_size.bit_length()
+    size = max(width, height)
+    levels = 1
+    while size > tile_size and levels < max_levels:
+        size = (size + 1) // 2
+        levels += 1
+    return levels
+
+
+def makePyramidalImage(dest, tile_size, path=None, content=None, file_name=None):
+    """
+    Saves a tiled, multi-resolution (pyramidal) JPEG2000 copy of an image to dest, given
+    the path of its file or its content. Returns the number of resolutions.
+
+    The IIIF image server decodes only the tiles of the region it is asked for, at the
+    nearest resolution to the size asked for, rather than the whole image. Only the first
+    frame of an animated image is copied.
+    """
+    f = open(path, "rb") if path is not None else io.BytesIO(content)
+    with f, Image.open(f) as im:
+        if im.mode in JPEG2000_MODES:
+            pass
+        elif im.mode in ("1", "I", "F") or im.mode.startswith("I;"):
+            im = im.convert("L")
+        elif im.mode.endswith("A") or "transparency" in im.info:
+            im = im.convert("RGBA")
+        else:
+            im = im.convert("RGB")
+        levels = getResolutionCount(im.width, im.height, tile_size)
+        im.save(
+            dest,
+            format="JPEG2000",
+            tile_size=(tile_size, tile_size),
+            num_resolutions=levels,
+            # Resolution-major order, so that reduced sizes are read from the front of
+            # each tile
+            progression="RPCL",
+            irreversible=True,
+            quality_mode="rates",
+            quality_layers=[40, 10, 4],
+        )
+    return levels
@@ -0,0 +1,282 @@
+"""
+Idempotency keys for endpoints that do expensive, non-repeatable work (uploads, imports,
+course copies, ...).
+
+A client that sends an Idempotency-Key header with such a request can safely retry it,
+for example after a gateway timeout: the key is claimed by the first request, and its
+response is stored and replayed for every retry with the same key, rather than the work
+being done again. A retry that arrives while the first request is still in progress
+waits for it to complete. Async views wait on the event loop (see begin_async()), so
+that waiting retries don't hold the threads the database is queried on.
+
+Keys are scoped to the user, and a key may only be reused for the same request. Error
+responses that are worth retrying (429 and 5xx) aren't stored, so the key is released
+for another attempt.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from media_management_api.routers import use_primary
+
+from .aio import database_sync_to_async
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+
+# Seconds between checks on a key that another request is working on
+POLL_INTERVAL = 0.5
+
+
+class IdempotentReplay(Exception):
+    """
+    Raised to answer a request with the stored response of its key.
+    """
+
+    def __init__(self, record):
+        self.record = record
+
+    def get_response(self):
+        data = (
+            json.loads(self.record.response_body) if self.record.response_body else None
+        )
+        return Response(
+            data,
+            status=self.record.response_status,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+
+class IdempotencyConflict(exceptions.APIException):
+    status_code = 409
+    default_detail = (
+        "A request with the same %s is still in progress. Please try again later."
+        % HEADER
+    )
+    default_code = "conflict"
+    # Sent as Retry-After
+    wait = 5
+
+
+def get_idempotency_key(request):
+    key = request.headers.get(HEADER)
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise exceptions.ValidationError(
+            "Invalid %s header. Expected 1 to %d characters." % (HEADER, MAX_KEY_LENGTH)
+        )
+    return key
+
+
+def get_request_hash(request):
+    """
+    Returns a fingerprint of a request, to check that a key is only reused for the same
+    request. JSON bodies are hashed in full. Form fields are hashed by value, and
+    uploaded files by name, size and content, a chunk at a time. The raw body of an
+    upload isn't hashed (nor the parameters of its content type), since it includes a
+    multipart boundary that clients pick afresh for each request.
+    """
+    h = hashlib.sha256()
+    h.update(("%s %s\n" % (request.method, request.path)).encode("utf-8"))
+    media_type = request.content_type.split(";")[0].strip().lower()
+    h.update(("%s\n" % media_type).encode("utf-8"))
+    if media_type == "application/json":
+        h.update(request.body)
+        return h.hexdigest()
+
+    data = request.data
+    fields = sorted(data.lists()) if hasattr(data, "lists") else []
+    for name, values in fields:
+        for value in values:
+            if hasattr(value, "chunks"):
+                h.update(
+                    ("%s=<%s %s>" % (name, value.name, value.size)).encode("utf-8")
+                )
+                for chunk in value.chunks():
+                    h.update(chunk)
+                value.seek(0)
+                h.update(b"\n")
+            else:
+                h.update(("%s=%s\n" % (name, value)).encode("utf-8"))
+    return h.hexdigest()
+
+
+@use_primary()
+def claim(owner, key, request, request_hash):
+    """
+    Claims a key for a request. Returns (record, created), where created is true if the
+    key is now held by the request. When the key is held by another request, or is
+    completed, the existing record is returned instead. The record is None if the key
+    was released while it was being claimed, in which case claiming it can be retried.
+    """
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                owner=owner,
+                key=key,
+                request_method=request.method,
+                request_path=request.path,
+                request_hash=request_hash,
+            )
+            return record, True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(owner=owner, key=key).first()
+    if record is None:
+        return None, False
+
+    now = timezone.now()
+    if record.state == IdempotencyKey.STATE_COMPLETED:
+        expired = record.updated < now - timedelta(
+            seconds=settings.IDEMPOTENCY_KEY_EXPIRES
+        )
+    else:
+        expired = record.updated < now - timedelta(
+            seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT
+        )
+    if expired:
+        # Only delete the record that was read, in case another request got to it first
+        logger.info("Releasing expired idempotency key %r" % record)
+        IdempotencyKey.objects.filter(pk=record.pk, updated=record.updated).delete()
+        return None, False
+    return record, False
+
+
+def begin(request, key, request_hash=None, wait=None):
+    """
+    Claims a key for a request and returns its record.
+
+    Raises IdempotentReplay if the key was already completed, waiting up to wait seconds
+    (IDEMPOTENCY_WAIT by default) for the request that holds it if need be. Raises a 409
+    if that request doesn't complete in time, and a 422 if the key was used for a
+    different request.
+    """
+    owner = request.user.profile
+    if request_hash is None:
+        request_hash = get_request_hash(request)
+    if wait is None:
+        wait = settings.IDEMPOTENCY_WAIT
+    deadline = time.monotonic() + wait
+    while True:
+        record, created = claim(owner, key, request, request_hash)
+        if created:
+            return record
+        if record is not None:
+            if record.request_hash != request_hash:
+                exc = exceptions.APIException(
+                    "The %s header was already used for a different request." % HEADER
+                )
+                exc.status_code = 422
+                raise exc
+            if record.state == IdempotencyKey.STATE_COMPLETED:
+                logger.debug("Replaying response for idempotency key %r" % record)
+                raise IdempotentReplay(record)
+        if time.monotonic() >= deadline:
+            raise IdempotencyConflict()
+        time.sleep(POLL_INTERVAL)
+
+
+async def begin_async(request, key):
+    """
+    Like begin(), for async views. Each attempt to claim the key runs on the database
+    pool, but the wait between attempts is on the event loop.
+    """
+    request_hash = await database_sync_to_async(get_request_hash)(request)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+    while True:
+        try:
+            return await database_sync_to_async(begin)(
+                request, key, request_hash=request_hash, wait=0
+            )
+        except IdempotencyConflict:
+            if time.monotonic() >= deadline:
+                raise
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def finish(record, response):
+    """
+    Stores the response to the request that holds a key, or releases the key if the
+    response is an error that may be retried.
+    """
+    status_code = response.status_code
+    if status_code == 429 or status_code >= 500:
+        release(record)
+        return
+    data = getattr(response, "data", None)
+    body = "" if data is None else json.dumps(data, cls=JSONEncoder)
+    record.complete(status_code, body)
+
+
+def release(record):
+    IdempotencyKey.objects.filter(pk=record.pk).delete()
+
+
+class IdempotencyMixin:
+    """
+    Adds Idempotency-Key support to the requests of an API view that use one of the
+    idempotent_methods. The key is claimed after authentication, since keys are scoped to
+    the user, and the response is stored when it is finalized. Async views claim the key
+    in initial_async(), so that they can wait for a request in progress on the event loop.
+
+    Put the mixin after AdmissionControlMixin, so that replays, and retries that wait
+    for the request in progress, aren't throttled and don't hold a concurrency slot.
+    """
+
+    idempotent_methods = ("POST",)
+
+    def initial(self, request, *args, **kwargs):
+        self.idempotency_record = None
+        super().initial(request, *args, **kwargs)
+        if request.method not in self.idempotent_methods:
+            return
+        if getattr(self, "dispatching_async", False):
+            # Claimed in initial_async() instead
+            return
+        key = get_idempotency_key(request)
+        if key is not None:
+            self.idempotency_record = begin(request, key)
+
+    async def initial_async(self, request, *args, **kwargs):
+        await super().initial_async(request, *args, **kwargs)
+        if request.method not in self.idempotent_methods:
+            return
+        key = get_idempotency_key(request)
+        if key is not None:
+            self.idempotency_record = await begin_async(request, key)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, IdempotentReplay):
+            return exc.get_response()
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            # The response will be a 500, so let the request be retried
+            record = getattr(self, "idempotency_record", None)
+            if record is not None:
+                self.idempotency_record = None
+                release(record)
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        record = getattr(self, "idempotency_record", None)
+        if record is not None:
+            self.idempotency_record = None
+            finish(record, response)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,8 +1,11 @@
-import json
+import math
 
+import orjson
 from django.conf import settings
 from django.urls import reverse
 
+from media_management_api.media_service.analysis import getResolutionCount
+
 
 class IIIFObject(object):
     """
@@ -25,8 +28,10 @@ class IIIFObject(object):
         """Returns itself as JSON."""
         obj = self.to_dict()
         if settings.DEBUG:
-            return json.dumps(obj, sort_keys=True, indent=4, separators=(",", ": "))
-        return json.dumps(obj)
+            return orjson.dumps(
+                obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2
+            ).decode("utf-8")
+        return orjson.dumps(obj).decode("utf-8")
 
     def __unicode__(self):
         """Returns a string representation."""
@@ -98,6 +103,7 @@ class IIIFManifest(IIIFObject):
                         "format": img.get("format", None),
                         "height": img.get("height", None),
                         "width": img.get("width", None),
+                        "sizes": img.get("sizes", None),
                         "is_iiif": img.get("is_iiif", True),
                     }
                 )
@@ -248,6 +254,7 @@ class IIIFImageResource(IIIFObject):
         self.is_iiif = image.get("is_iiif", False)
         self.width = image.get("width", None)
         self.height = image.get("height", None)
+        self.sizes = image.get("sizes", None)
 
     def url(self):
         return self.manifest.build_absolute_url(
@@ -268,16 +275,23 @@ class IIIFImageResource(IIIFObject):
             if self.width is not None and self.width > max_size:
                 iiif_url_params["size"] = str(max_size) + ","
 
+            if self.width and self.height:
+                # Embed the image information, so viewers needn't fetch it
+                service = IIIFImageInfo(
+                    self.image_url, self.width, self.height, sizes=self.sizes
+                ).to_dict()
+            else:
+                service = {
+                    "@id": self.image_url,
+                    "@context": "http://iiif.io/api/image/2/context.json",
+                    "profile": "http://iiif.io/api/image/2/level1.json",
+                }
             resource = {
                 "@id": "{base_url}/{region}/{size}/{rotation}/default.jpg".format(
                     **iiif_url_params
                 ),
                 "@type": "dctypes:Image",
-                "service": {
-                    "@id": self.image_url,
-                    "@context": "http://iiif.io/api/image/2/context.json",
-                    "profile": "http://iiif.io/api/image/2/level1.json",
-                },
+                "service": service,
             }
         if self.format:
             resource["format"] = self.format
@@ -285,3 +299,75 @@ class IIIFImageResource(IIIFObject):
             resource["width"] = self.width
             resource["height"] = self.height
         return resource
+
+
+class IIIFImageInfo(IIIFObject):
+    """
+    IIIFImageInfo is the image information document (info.json) of an image on the IIIF
+    image server, which viewers read before they request any of the image.
+
+    The document is computed from the stored dimensions of the image, rather than
+    fetched from the image server, which has to open the image to report them. The
+    tiles match the pyramidal derivatives of large images (see MediaStore).
+
+    See also: http://iiif.io/api/image/2.1/#image-information
+    """
+
+    def __init__(self, base_url, width, height, tile_size=None, sizes=None):
+        self.base_url = base_url
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size or settings.IIIF_DERIVATIVE_TILE_SIZE
+        # The smaller copies offered for responsive images (see MediaStore.get_iiif_sizes())
+        self.sizes = sizes
+
+    @classmethod
+    def for_media_store(cls, media_store):
+        return cls(
+            media_store.get_iiif_base_url(),
+            media_store.img_width,
+            media_store.img_height,
+            sizes=media_store.get_iiif_sizes(),
+        )
+
+    def url(self):
+        return "%s/info.json" % self.base_url
+
+    def get_scale_factors(self):
+        levels = getResolutionCount(self.width, self.height, self.tile_size)
+        return [2**n for n in range(levels)]
+
+    def get_sizes(self):
+        """
+        Returns the sizes that viewers should prefer when they request the whole image,
+        smallest first: the copies offered for responsive images if there are any, or
+        else the levels of the pyramid. An empty list of copies is treated like None,
+        since projections stored before the copies were offered have one.
+        """
+        if self.sizes:
+            sizes = [
+                {"width": size["width"], "height": size["height"]}
+                for size in self.sizes
+            ]
+            return sizes + [{"width": self.width, "height": self.height}]
+        return [
+            {
+                "width": math.ceil(self.width / factor),
+                "height": math.ceil(self.height / factor),
+            }
+            for factor in reversed(self.get_scale_factors())
+        ]
+
+    def to_dict(self):
+        scale_factors = self.get_scale_factors()
+        info = {
+            "@context": "http://iiif.io/api/image/2/context.json",
+            "@id": self.base_url,
+            "protocol": "http://iiif.io/api/image",
+            "width": self.width,
+            "height": self.height,
+            "sizes": self.get_sizes(),
+            "tiles": [{"width": self.tile_size, "scaleFactors": scale_factors}],
+            "profile": ["http://iiif.io/api/image/2/level1.json"],
+        }
+        return info
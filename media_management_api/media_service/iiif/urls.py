@@ -8,6 +8,11 @@ urlpatterns = [
     path("", views.IiifView.as_view(), name="root"),
     path("collections", views.IiifCollectionsView.as_view(), name="collections"),
     path("collection/<int:pk>", views.IiifCollectionView.as_view(), name="collection"),
+    path(
+        "image/<int:pk>/info.json",
+        views.IiifImageInfoView.as_view(),
+        name="image-info",
+    ),
     path(
         "manifest/<int:manifest_id>", views.IiifManifestView.as_view(), name="manifest"
     ),
@@ -1,12 +1,22 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 
-from media_management_api.media_service.models import Collection, Course
+from media_management_api.media_service.admission import AdmissionControlMixin
+from media_management_api.media_service.aio import AsyncAPIView, database_sync_to_async
+from media_management_api.media_service.models import (
+    Collection,
+    CollectionResource,
+    Course,
+    ImageProjection,
+    MediaStore,
+)
 
-from .objects import IIIFManifest
+from .objects import IIIFImageInfo, IIIFManifest
 
 
 class IiifView(APIView):
@@ -20,29 +30,13 @@ class IiifView(APIView):
         )
 
 
-class IiifManifestView(APIView):
-    def get(
+class IiifManifestView(AsyncAPIView):
+    async def get(
         self, request, manifest_id=None, object_type=None, object_id=None, format=None
     ):
-        collection = get_object_or_404(Collection, pk=manifest_id)
-
-        images = []
-        for collection_resource in collection.resources.all():
-            resource = collection_resource.resource
-            data = resource.get_representation()
-            images.append(
-                {
-                    "id": resource.id,
-                    "label": resource.title,
-                    "description": resource.description,
-                    "metadata": resource.load_metadata(),
-                    "is_iiif": resource.media_store is not None,
-                    "width": data["image_width"],
-                    "height": data["image_height"],
-                    "url": data["iiif_base_url"],
-                    "format": data["image_type"],
-                }
-            )
+        collection, images = await database_sync_to_async(self.get_manifest_images)(
+            manifest_id
+        )
 
         data = None
         manifest = IIIFManifest(
@@ -61,8 +55,39 @@ class IiifManifestView(APIView):
 
         return Response(data)
 
+    def get_manifest_images(self, manifest_id):
+        collection = get_object_or_404(Collection, pk=manifest_id)
+
+        resource_ids = list(
+            CollectionResource.objects.filter(collection=collection)
+            .order_by("sort_order")
+            .values_list("resource_id", flat=True)
+        )
+        projections = ImageProjection.get_projections(resource_ids)
+
+        images = []
+        for resource_id in resource_ids:
+            projection = projections[resource_id]
+            images.append(
+                {
+                    "id": projection.id,
+                    "label": projection.title,
+                    "description": projection.description,
+                    "metadata": projection.metadata,
+                    "is_iiif": projection.media_store_id is not None,
+                    "width": projection.image_width,
+                    "height": projection.image_height,
+                    "url": projection.iiif_base_url,
+                    "format": projection.image_type,
+                    "sizes": projection.image_sizes,
+                }
+            )
+        return collection, images
+
+
+class IiifCollectionsView(AdmissionControlMixin, APIView):
+    admission_classes = {"GET": "iiif_collections"}
 
-class IiifCollectionsView(APIView):
     def get(self, request, format=None):
         if not request.user.is_superuser:
             raise PermissionDenied("You do not have permission to view all collections")
@@ -112,3 +137,33 @@ class IiifCollectionView(APIView):
                 }
             )
         return Response(data)
+
+
+class IiifImageInfoView(APIView):
+    """
+    Image information (info.json) of a stored image, for viewers of the IIIF image
+    server. The document is computed from the stored dimensions of the image and cached,
+    so the image server isn't asked to open the image to describe it.
+
+    **Endpoints:**
+
+    - `/iiif/image/:id/info.json`
+
+    **Methods:**
+
+    - `GET` image information of the media store entry
+    """
+
+    def get(self, request, pk=None, format=None):
+        key = MediaStore.get_iiif_info_cache_key(pk)
+        data = cache.get(key)
+        if data is None:
+            media_store = get_object_or_404(MediaStore, pk=pk)
+            data = IIIFImageInfo.for_media_store(media_store).to_dict()
+            cache.set(key, data, settings.IIIF_INFO_MAX_AGE)
+        return Response(
+            data,
+            headers={
+                "Cache-Control": "public, max-age=%d" % settings.IIIF_INFO_MAX_AGE
+            },
+        )
@@ -0,0 +1,282 @@
+"""
+Background ingestion of uploaded images.
+
+A large upload (a zip of hundreds of images, say) takes minutes to validate, hash and
+store, which is too long to hold a request for. Instead the request spools the files to
+the upload staging area (see staging.py) and enqueues an IngestJob, and the ingest worker
+(manage.py ingest_worker) runs them through the MediaStoreUpload pipeline and adds them
+to the course in batches. Clients poll the job for the outcome of each file. With the
+"s3" staging backend, the worker doesn't need to share a filesystem with the web hosts.
+
+Example usage:
+    job = create_job(course, request.user.profile, request.FILES.getlist("file"))
+    ...
+    job = claim_job()
+    IngestRunner(job).run()
+"""
+import collections
+import logging
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import mediastore
+from .models import (
+    Course,
+    ImageProjection,
+    IngestJob,
+    IngestJobItem,
+    MediaStore,
+    Resource,
+)
+from .staging import get_upload_staging
+
+logger = logging.getLogger(__name__)
+
+TITLE_MAX_LENGTH = Resource._meta.get_field("title").max_length
+
+
+class IngestException(Exception):
+    pass
+
+
+def iter_upload_files(filelist):
+    """
+    Yields a (name, file) pair for each file in an upload list, unzipping all zips. The
+    files of a zip are streamed, and each must be read before the next is yielded.
+    """
+    for file in filelist:
+        if zipfile.is_zipfile(file):
+            with zipfile.ZipFile(file, "r") as zip:
+                for name in mediastore.getZipFileNames(zip):
+                    with zip.open(name) as f:
+                        yield name, f
+        else:
+            file.seek(0)
+            yield file.name, file
+
+
+def delete_staged(staging, items):
+    for item in items:
+        staging.delete(item.get_staging_keyname())
+
+
+def create_job(course, owner, filelist, staging=None):
+    """
+    Spools the uploaded files to the staging area and enqueues a job to add them to the
+    course.
+
+    The job is created in the spooling state, which the worker doesn't claim, and only
+    queued once all of the files have been spooled, so that no transaction is held open
+    while they are copied.
+    """
+    staging = staging or get_upload_staging()
+    job = IngestJob.objects.create(
+        course=course, owner=owner, state=IngestJob.STATE_SPOOLING
+    )
+    items = []
+    try:
+        for index, (name, f) in enumerate(iter_upload_files(filelist)):
+            item = IngestJobItem(job=job, index=index, file_name=name)
+            items.append(item)
+            staging.put(item.get_staging_keyname(), f)
+        if not items:
+            raise IngestException("Error: no files uploaded")
+        with transaction.atomic():
+            IngestJobItem.objects.bulk_create(items)
+            job.state = IngestJob.STATE_QUEUED
+            job.save(update_fields=["state", "updated"])
+    except BaseException:
+        delete_staged(staging, items)
+        job.delete()
+        raise
+    logger.info("Queued ingest job %s with %d files" % (job.pk, len(items)))
+    return job
+
+
+def claim_job():
+    """
+    Takes the oldest queued job, or a running job whose worker has died, and marks it
+    running. Returns None if there are no jobs to run.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.INGEST_JOB_TIMEOUT)
+    queued = Q(state=IngestJob.STATE_QUEUED)
+    stalled = Q(state=IngestJob.STATE_RUNNING, updated__lt=stale)
+    with transaction.atomic():
+        # Workers skip jobs that another worker is claiming (PostgreSQL)
+        job = (
+            IngestJob.objects.select_for_update(skip_locked=True)
+            .filter(queued | stalled)
+            .order_by("created")
+            .first()
+        )
+        if job is None:
+            return None
+        if job.state == IngestJob.STATE_RUNNING:
+            logger.warning("Taking over stale ingest job %s" % job.pk)
+        job.state = IngestJob.STATE_RUNNING
+        job.started = job.started or timezone.now()
+        job.save()
+    return job
+
+
+class IngestRunner:
+    """
+    Adds the pending items of a job to its course, batch_size items at a time.
+
+    Each file is validated and saved to the media store on its own, and its error is
+    recorded if it fails. The images of a batch are then added to the course with a
+    single bulk insert, in a transaction that also records the outcome of the batch's
+    items, so that a job taken over after a crash picks up where it stopped.
+    """
+
+    def __init__(self, job, batch_size=None, staging=None):
+        self.job = job
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        self.staging = staging or get_upload_staging()
+
+    def run(self):
+        logger.info("Running ingest job %s" % self.job.pk)
+        try:
+            items = list(
+                self.job.items.filter(state=IngestJobItem.STATE_PENDING).order_by(
+                    "index"
+                )
+            )
+            for start in range(0, len(items), self.batch_size):
+                self.run_batch(items[start : start + self.batch_size])
+        except Exception as e:
+            logger.exception("Ingest job %s failed" % self.job.pk)
+            self.job.fail(str(e))
+            # Nothing will read the files of the remaining items
+            delete_staged(
+                self.staging, self.job.items.filter(state=IngestJobItem.STATE_PENDING)
+            )
+            return self.job
+        self.job.complete()
+        logger.info("Completed ingest job %s" % self.job.pk)
+        return self.job
+
+    def run_batch(self, items):
+        opened = []
+        for item in items:
+            try:
+                opened.append((item, self.open(item)))
+            except Exception as e:
+                self.set_error(item, e)
+        stored = []
+        try:
+            # Analyze the files of the batch in the process pool, then store them
+            analyses = mediastore.analyzeImages([f for item, f in opened])
+            self.touch()
+            for (item, f), analysis in zip(opened, analyses):
+                try:
+                    stored.append((item, self.store(item, f, analysis)))
+                except Exception as e:
+                    self.set_error(item, e)
+                self.touch()
+        finally:
+            for item, f in opened:
+                f.close()
+            # Even if the batch fails part way, add the images that were stored to the
+            # course, so that no media is left without a resource
+            self.save_batch(items, stored)
+
+    def save_batch(self, items, stored):
+        with transaction.atomic():
+            resources = self.create_resources(stored)
+            for (item, media_store), resource in zip(stored, resources):
+                item.state = IngestJobItem.STATE_COMPLETED
+                item.resource = resource
+            now = timezone.now()
+            for item in items:
+                item.updated = now
+            IngestJobItem.objects.bulk_update(
+                items, ["state", "error", "resource", "updated"]
+            )
+        delete_staged(
+            self.staging,
+            [item for item in items if item.state != IngestJobItem.STATE_PENDING],
+        )
+
+    def set_error(self, item, e):
+        """
+        Records the error of an item that couldn't be added, so that the rest of the job
+        carries on. Errors other than invalid images are logged.
+        """
+        if not isinstance(e, mediastore.MediaStoreException):
+            logger.exception(
+                "Error adding %s of ingest job %s" % (item.file_name, self.job.pk)
+            )
+        item.state = IngestJobItem.STATE_ERROR
+        item.error = str(e)
+
+    def open(self, item):
+        return File(self.staging.open(item.get_staging_keyname()), name=item.file_name)
+
+    def store(self, item, f, analysis):
+        """
+        Validates a spooled file and saves it to the media store. Returns the MediaStore.
+        """
+        logger.debug("Processing file upload: %s" % item.file_name)
+        media_store_upload = mediastore.MediaStoreUpload(
+            f, analysis=analysis, save_derivative=True
+        )
+        media_store_upload.raise_for_error()
+        media_store_upload.validate()
+        return media_store_upload.save()
+
+    def create_resources(self, stored):
+        """
+        Adds a batch of stored images to the course, after its current images.
+        """
+        if not stored:
+            return []
+        course = self.job.course
+        # Lock the course so that concurrent batches don't take the same sort orders
+        Course.objects.select_for_update().filter(pk=course.pk).first()
+        sort_order = Resource.next_sort_order({"course__pk": course.pk})
+        resources = []
+        for n, (item, media_store) in enumerate(stored):
+            resources.append(
+                Resource(
+                    course=course,
+                    owner=self.job.owner,
+                    media_store=media_store,
+                    title=item.file_name[:TITLE_MAX_LENGTH],
+                    original_file_name=item.file_name,
+                    is_upload=True,
+                    sort_order=sort_order + n,
+                )
+            )
+        Resource.objects.bulk_create(resources)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # The ids of the new rows aren't returned (SQLite), so look them up
+            ids = dict(
+                Resource.objects.filter(
+                    course=course, sort_order__gte=sort_order
+                ).values_list("sort_order", "pk")
+            )
+            for resource in resources:
+                resource.pk = ids[resource.sort_order]
+
+        # bulk_create() doesn't call save(), so count the references and refresh the
+        # projections here
+        references = collections.Counter(media_store.pk for item, media_store in stored)
+        for media_store_pk, n in references.items():
+            MediaStore.objects.filter(pk=media_store_pk).update(
+                reference_count=F("reference_count") + n, updated=timezone.now()
+            )
+        ImageProjection.refresh([resource.pk for resource in resources])
+        return resources
+
+    def touch(self):
+        """
+        Shows that the job is still running (see IngestJob).
+        """
+        IngestJob.objects.filter(pk=self.job.pk).update(updated=timezone.now())
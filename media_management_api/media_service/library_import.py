@@ -0,0 +1,193 @@
+import codecs
+import csv
+import json
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import ImageProjection, Resource
+from .serializers import metadata_validator
+
+logger = logging.getLogger(__name__)
+
+# Columns of the library export (see CsvExportResourceSerializer) that may be changed by
+# an import. The other columns (url, iiif_url, iiif_srcset) are read-only and ignored.
+IMPORT_FIELDS = ("title", "description", "metadata")
+TITLE_MAX_LENGTH = Resource._meta.get_field("title").max_length
+
+
+class LibraryImportException(Exception):
+    pass
+
+
+class LibraryImport:
+    """
+    Applies a CSV file in the library export format to the images of a course.
+
+    The file is read one row at a time and applied in chunks of chunk_size rows, each
+    with a single bulk_update() in its own transaction, so memory use doesn't depend on
+    the size of the file. Rows that fail validation are skipped, and the outcome of every
+    row is recorded in the report.
+
+    If a row can't be read (it isn't valid UTF-8 or CSV), the import stops there: the rows
+    before it are still applied, the row is reported as an error, and read_error is set.
+
+    Example usage:
+        report = LibraryImport(course, request.FILES["file"]).run()
+    """
+
+    def __init__(self, course, csv_file, chunk_size=1000):
+        self.course = course
+        self.csv_file = csv_file
+        self.chunk_size = chunk_size
+        self.seen_ids = set()
+        self.rows = []
+        self.counts = {"updated": 0, "unchanged": 0, "error": 0}
+        self.read_error = None
+
+    def run(self):
+        reader = csv.DictReader(codecs.iterdecode(self.csv_file, "utf-8-sig"))
+        try:
+            fieldnames = reader.fieldnames
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise LibraryImportException("Error reading CSV header: %s" % e)
+        fields = self.get_fields(fieldnames)
+        # The header is row 1, so the first row of data is row 2
+        line = 1
+        rows = enumerate(reader, start=2)
+        chunk = []
+        while True:
+            try:
+                line, row = next(rows)
+            except StopIteration:
+                break
+            except (UnicodeDecodeError, csv.Error) as e:
+                # Report the error against the row after the last one that was read
+                line += 1
+                self.read_error = "Error reading CSV row %d: %s" % (line, e)
+                break
+            chunk.append((line, row))
+            if len(chunk) == self.chunk_size:
+                self.apply_chunk(chunk, fields)
+                chunk = []
+        if chunk:
+            self.apply_chunk(chunk, fields)
+        if self.read_error:
+            self.add_row(line, None, "error", [self.read_error])
+        return self.get_report()
+
+    def get_fields(self, fieldnames):
+        if not fieldnames or "id" not in fieldnames:
+            raise LibraryImportException(
+                "Error: CSV must have a header row with an 'id' column."
+            )
+        return [field for field in IMPORT_FIELDS if field in fieldnames]
+
+    def get_report(self):
+        report = dict(self.counts)
+        report["rows"] = self.rows
+        return report
+
+    def add_row(self, line, resource_id, status, errors=None):
+        row = {"row": line, "id": resource_id, "status": status}
+        if errors:
+            row["errors"] = errors
+        self.rows.append(row)
+        self.counts[status] += 1
+
+    def parse_row(self, row, fields):
+        """
+        Returns the values of the given fields in a row, or raises a ValidationError.
+        """
+        values = {}
+        errors = []
+        for field in fields:
+            value = row[field]
+            if value is None:
+                errors.append("Missing '%s' column." % field)
+                continue
+            if field == "title":
+                if not value:
+                    errors.append("Title may not be blank.")
+                elif len(value) > TITLE_MAX_LENGTH:
+                    errors.append(
+                        "Title may not be longer than %d characters." % TITLE_MAX_LENGTH
+                    )
+            elif field == "metadata":
+                try:
+                    value = json.loads(value) if value else []
+                    metadata_validator(value)
+                except ValueError:
+                    errors.append("Metadata is not valid JSON.")
+                except serializers.ValidationError as e:
+                    errors.extend(str(detail) for detail in e.detail)
+            values[field] = value
+        if errors:
+            raise serializers.ValidationError(errors)
+        return values
+
+    def parse_id(self, row):
+        try:
+            resource_id = int(row["id"])
+        except (TypeError, ValueError):
+            raise serializers.ValidationError(["Invalid id: %s" % row["id"]])
+        if resource_id in self.seen_ids:
+            raise serializers.ValidationError(
+                ["Image %s is given more than once." % resource_id]
+            )
+        self.seen_ids.add(resource_id)
+        return resource_id
+
+    def apply_chunk(self, chunk, fields):
+        report_start = len(self.rows)
+        parsed = []
+        for line, row in chunk:
+            resource_id = row.get("id")
+            try:
+                resource_id = self.parse_id(row)
+                parsed.append((line, resource_id, self.parse_row(row, fields)))
+            except serializers.ValidationError as e:
+                self.add_row(line, resource_id, "error", [str(d) for d in e.detail])
+
+        resources = (
+            Resource.objects.filter(course=self.course)
+            .only("pk", "updated", *fields)
+            .in_bulk([resource_id for line, resource_id, values in parsed])
+        )
+
+        now = timezone.now()
+        changed = []
+        for line, resource_id, values in parsed:
+            resource = resources.get(resource_id)
+            if resource is None:
+                self.add_row(
+                    line,
+                    resource_id,
+                    "error",
+                    ["Image %s does not exist in this course." % resource_id],
+                )
+                continue
+            if all(getattr(resource, k) == v for k, v in values.items()):
+                self.add_row(line, resource_id, "unchanged")
+                continue
+            for field, value in values.items():
+                setattr(resource, field, value)
+            resource.updated = now
+            changed.append(resource)
+            self.add_row(line, resource_id, "updated")
+
+        if changed:
+            logger.debug(
+                "Importing %d images into course %s" % (len(changed), self.course.pk)
+            )
+            with transaction.atomic():
+                Resource.objects.bulk_update(changed, list(fields) + ["updated"])
+                # bulk_update() doesn't send post_save, so refresh the projections here
+                ImageProjection.refresh([resource.pk for resource in changed])
+
+        # Keep the report in the order of the rows in the file
+        self.rows[report_start:] = sorted(
+            self.rows[report_start:], key=lambda row: row["row"]
+        )
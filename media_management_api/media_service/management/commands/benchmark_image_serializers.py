@@ -0,0 +1,112 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from media_management_api.media_service.models import (
+    Course,
+    ImageProjection,
+    MediaStore,
+    Resource,
+)
+from media_management_api.media_service.serializers import (
+    ImageListSerializer,
+    ResourceSerializer,
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares ResourceSerializer with the read-only ImageListSerializer on generated "
+        "course libraries. All generated data is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            dest="sizes",
+            type=int,
+            nargs="+",
+            default=[1000, 10000],
+            help="Number of images in each generated course library.",
+        )
+        parser.add_argument(
+            "--repeat",
+            dest="repeat",
+            type=int,
+            default=3,
+            help="Number of timed runs per serializer (the best run is reported).",
+        )
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get("/api/", SERVER_NAME="localhost")
+        for size in options["sizes"]:
+            try:
+                with transaction.atomic():
+                    self.benchmark(request, size, options["repeat"])
+                    raise Rollback()
+            except Rollback:
+                pass
+
+    def benchmark(self, request, size, repeat):
+        course = Course.objects.create(title="Benchmark Course")
+        media_store = MediaStore.objects.create(
+            file_name="benchmark.jpg",
+            file_size=1024,
+            file_md5hash="0" * 32,
+            file_extension="jpg",
+            file_type="image/jpeg",
+            img_width=1600,
+            img_height=1200,
+        )
+        Resource.objects.bulk_create(
+            [
+                Resource(
+                    course=course,
+                    media_store=media_store,
+                    title="Image %d" % n,
+                    sort_order=n,
+                    metadata=[{"label": "n", "value": str(n)}],
+                )
+                for n in range(1, size + 1)
+            ]
+        )
+        ImageProjection.rebuild(course_ids=[course.pk])
+        context = {"request": request}
+
+        def drf():
+            queryset = ImageProjection.objects.filter(course=course).order_by(
+                "sort_order"
+            )
+            return ResourceSerializer(queryset, many=True, context=context).data
+
+        def compiled():
+            queryset = ImageProjection.objects.filter(course=course).order_by(
+                "sort_order"
+            )
+            return ImageListSerializer(queryset, context=context).data
+
+        renderer = JSONRenderer()
+        if renderer.render(drf()) != renderer.render(compiled()):
+            raise CommandError("Serializer outputs differ for %d rows" % size)
+
+        drf_secs = self.best_of(drf, repeat)
+        compiled_secs = self.best_of(compiled, repeat)
+        self.stdout.write(
+            "%6d rows: ResourceSerializer %.3fs, ImageListSerializer %.3fs (%.1fx)"
+            % (size, drf_secs, compiled_secs, drf_secs / compiled_secs)
+        )
+
+    def best_of(self, fn, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,67 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from media_management_api.media_service import mediastore
+from media_management_api.media_service.models import MediaStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Makes pyramidal copies of the large stored images that don't have one yet, for "
+        "the IIIF image server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            dest="limit",
+            type=int,
+            default=None,
+            help="Maximum number of images to copy.",
+        )
+        parser.add_argument(
+            "--analysis-processes",
+            dest="analysis_processes",
+            type=int,
+            default=None,
+            help="Number of processes to analyze images in (default: one per CPU).",
+        )
+
+    def handle(self, *args, **options):
+        if not mediastore.canSaveIiifDerivatives():
+            raise CommandError(
+                "Pillow can't write JPEG2000 images; install OpenJPEG and reinstall Pillow"
+            )
+        if options["analysis_processes"] is None:
+            mediastore.setAnalysisProcesses(os.cpu_count() or 1)
+        else:
+            mediastore.setAnalysisProcesses(options["analysis_processes"])
+        min_size = settings.IIIF_DERIVATIVE_MIN_SIZE
+        media_stores = (
+            MediaStore.objects.filter(derivative_file_name="")
+            .filter(Q(img_width__gt=min_size) | Q(img_height__gt=min_size))
+            .order_by("pk")
+        )
+        if options["limit"]:
+            media_stores = media_stores[: options["limit"]]
+
+        saved = failed = 0
+        for media_store in media_stores.iterator():
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, media_store.file_name)
+                try:
+                    mediastore.loadFileFromBucket(media_store.get_s3_keyname(), path)
+                except mediastore.MediaStoreException as e:
+                    self.stderr.write("Error loading %r: %s" % (media_store, e))
+                    failed += 1
+                    continue
+                args = {"path": path, "file_name": media_store.file_name}
+                if mediastore.saveIiifDerivative(media_store, args):
+                    saved += 1
+                else:
+                    failed += 1
+        self.stdout.write("Saved %d IIIF derivatives (%d failed)" % (saved, failed))
@@ -0,0 +1,120 @@
+import concurrent.futures
+import os
+import tempfile
+
+from django.core.files.base import File
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from media_management_api.media_service import mediastore
+from media_management_api.media_service.models import (
+    ImageProjection,
+    MediaStore,
+    Resource,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Computes the placeholders (BlurHash and dominant colour) of the stored images "
+        "that don't have one yet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            dest="batch_size",
+            type=int,
+            default=50,
+            help="Number of images to load and analyze at a time.",
+        )
+        parser.add_argument(
+            "--downloads",
+            dest="downloads",
+            type=int,
+            default=8,
+            help="Number of images of a batch to load from the bucket at once.",
+        )
+        parser.add_argument(
+            "--analysis-processes",
+            dest="analysis_processes",
+            type=int,
+            default=None,
+            help="Number of processes to analyze images in (default: one per CPU).",
+        )
+
+    def handle(self, *args, **options):
+        if options["analysis_processes"] is None:
+            mediastore.setAnalysisProcesses(os.cpu_count() or 1)
+        else:
+            mediastore.setAnalysisProcesses(options["analysis_processes"])
+        saved = failed = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                MediaStore.objects.filter(placeholder="", pk__gt=last_pk).order_by(
+                    "pk"
+                )[: options["batch_size"]]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            updated = self.process_batch(batch, options["downloads"])
+            saved += len(updated)
+            failed += len(batch) - len(updated)
+        self.stdout.write("Saved %d image placeholders (%d failed)" % (saved, failed))
+
+    def process_batch(self, batch, downloads):
+        """
+        Loads a batch of images from the bucket and analyzes them in the process pool
+        (see mediastore.analyzeImages()). Returns the media stores that were updated.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+
+            def load(media_store):
+                path = os.path.join(tmpdir, media_store.file_name)
+                try:
+                    mediastore.loadFileFromBucket(media_store.get_s3_keyname(), path)
+                except mediastore.MediaStoreException as e:
+                    self.stderr.write("Error loading %r: %s" % (media_store, e))
+                    return None
+                return path
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=downloads) as pool:
+                paths = list(pool.map(load, batch))
+            loaded = [
+                (media_store, path)
+                for media_store, path in zip(batch, paths)
+                if path is not None
+            ]
+            files = [
+                File(open(path, "rb"), name=media_store.file_name)
+                for media_store, path in loaded
+            ]
+            try:
+                analyses = mediastore.analyzeImages(files)
+            finally:
+                for f in files:
+                    f.close()
+
+        updated = []
+        now = timezone.now()
+        for (media_store, path), analysis in zip(loaded, analyses):
+            if not analysis["placeholder"]:
+                self.stderr.write("Error decoding %r" % media_store)
+                continue
+            media_store.placeholder = analysis["placeholder"]
+            media_store.dominant_color = analysis["dominant_color"]
+            media_store.updated = now
+            updated.append(media_store)
+        if updated:
+            MediaStore.objects.bulk_update(
+                updated, ["placeholder", "dominant_color", "updated"]
+            )
+            # bulk_update() doesn't send signals, so refresh the projections here
+            ImageProjection.refresh(
+                Resource.objects.filter(media_store__in=updated).values_list(
+                    "pk", flat=True
+                )
+            )
+        return updated
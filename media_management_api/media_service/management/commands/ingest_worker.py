@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from media_management_api.media_service import mediastore
+from media_management_api.media_service.ingest import IngestRunner, claim_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a pool of workers that add background uploads (ingest jobs) to courses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            dest="processes",
+            type=int,
+            default=1,
+            help="Number of worker processes to run.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            dest="batch_size",
+            type=int,
+            default=None,
+            help="Number of images to add to a course per batch (INGEST_BATCH_SIZE).",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            dest="poll_interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait before checking for jobs again when there are none.",
+        )
+        parser.add_argument(
+            "--once",
+            dest="once",
+            action="store_true",
+            help="Exit once there are no more jobs to run, rather than waiting for more.",
+        )
+        parser.add_argument(
+            "--analysis-processes",
+            dest="analysis_processes",
+            type=int,
+            default=None,
+            help="Number of processes to analyze images in (default: one per CPU, shared by the worker processes).",
+        )
+
+    def handle(self, *args, **options):
+        analysis_processes = options["analysis_processes"]
+        if analysis_processes is None:
+            analysis_processes = max((os.cpu_count() or 1) // options["processes"], 1)
+        # Each worker process starts its own pool when it first analyzes images
+        mediastore.setAnalysisProcesses(analysis_processes)
+
+        if options["processes"] <= 1:
+            total = self.work(options)
+            self.stdout.write("Ran %d ingest jobs" % total)
+            return
+
+        # Forked processes must not share the parent's database connections
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=self.work, args=(options,))
+            for n in range(options["processes"])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+
+    def work(self, options):
+        total = 0
+        while True:
+            close_old_connections()
+            job = claim_job()
+            if job is None:
+                if options["once"]:
+                    return total
+                time.sleep(options["poll_interval"])
+                continue
+            IngestRunner(job, batch_size=options["batch_size"]).run()
+            total += 1
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from media_management_api.media_service.models import ImageProjection
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the denormalized image projections used by the image list endpoints."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--course-id",
+            dest="course_ids",
+            type=int,
+            action="append",
+            help="Only rebuild the projections of the given course (may be repeated).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            dest="batch_size",
+            type=int,
+            default=500,
+            help="Number of resources to project per batch.",
+        )
+
+    def handle(self, *args, **options):
+        total = ImageProjection.rebuild(
+            course_ids=options["course_ids"], batch_size=options["batch_size"]
+        )
+        self.stdout.write("Rebuilt %d image projections" % total)
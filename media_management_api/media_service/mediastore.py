@@ -1,15 +1,21 @@
+import asyncio
+import concurrent.futures
 import contextlib
+import functools
 import hashlib
 import io
 import logging
+import multiprocessing
 import os
+import re
 import tempfile
+import time
 import zipfile
 from urllib.parse import urlparse
 
 import boto.exception
+import httpx
 import magic
-import PIL
 import requests
 from boto.s3.connection import S3Connection
 from boto.s3.key import Key
@@ -18,8 +24,17 @@ from django.core.files.base import File
 from django.core.files.images import get_image_dimensions
 from django.core.files.uploadedfile import UploadedFile
 from django.db import transaction
-from PIL import Image
+from PIL import Image, features
 
+from media_management_api.routers import use_primary
+
+from .analysis import (
+    VALID_IMAGE_EXT_FOR_TYPE,
+    analyzeImage,
+    getImageExtension,
+    getImagePlaceholder,
+    makePyramidalImage,
+)
 from .models import MediaStore
 
 logger = logging.getLogger(__name__)
@@ -32,17 +47,20 @@ AWS_S3_KEY_PREFIX = settings.AWS_S3_KEY_PREFIX
 
 # Configurable settings for media store
 VALID_IMAGE_EXTENSIONS = ("jpg", "gif", "png", "tif", "tiff")
-VALID_IMAGE_EXT_FOR_TYPE = {
-    "image/jpeg": "jpg",
-    "image/gif": "gif",
-    "image/png": "png",
-    "image/tiff": "tif",
-}
 VALID_IMAGE_TYPES = sorted(VALID_IMAGE_EXT_FOR_TYPE.keys())
+REMOTE_IMAGE_MAX_SIZE = 50 * pow(2, 20)  # 50 megabytes
+REMOTE_IMAGE_CHUNK_SIZE = 64 * 1024  # 64 kilobytes
+REMOTE_IMAGE_CONNECT_TIMEOUT = 5  # seconds to connect to the remote server
+REMOTE_IMAGE_READ_TIMEOUT = 15  # seconds to wait for each chunk of the response
+REMOTE_IMAGE_DEADLINE = 60  # seconds to fetch all of the images of a request
+
+IIIF_DERIVATIVE_EXTENSION = "jp2"
+IIIF_DERIVATIVE_TYPE = "image/jp2"
+
+MD5_HASH_RE = re.compile(r"^[0-9a-f]{32}$")
 
-# Modify max image size that pillow will accept
-# Using the VisibleEarth High Resolution Map as a reference size (https://www.h-schmidt.net/map/)
-PIL.Image.MAX_IMAGE_PIXELS = 933120000  # E.g. 43200x21600
+_analysis_executor = None
+_analysis_processes = None
 
 
 class MediaStoreException(Exception):
@@ -63,16 +81,8 @@ def guessImageExtensionFromUrl(url):
     return extension
 
 
-def fetchRemoteImage(url):
-    """
-    Returns a temporary file object.
-    Raises a requests.exceptions.HTTPError if there's a 4xx or 5xx response.
-    Raises a MediaStoreException if the response content type header doesn't contain "image".
-    """
-    extension = guessImageExtensionFromUrl(url)
-    suffix = "" if extension is None else "." + extension
-    max_size = 50 * pow(2, 20)  # 50 megabytes
-    request_headers = {
+def getRemoteImageRequestHeaders():
+    return {
         # Spoofing the user agent to work around image providers that reject requests from "robots" (403 forbidden response)
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/57.0.2987.133 Safari/537.36",
         # Make explicit the image types we are willing to accept
@@ -81,50 +91,179 @@ def fetchRemoteImage(url):
         ),
     }
 
+
+def checkRemoteImageResponseHeaders(headers):
+    """
+    Raises a MediaStoreException if the response headers show that the content is not an
+    image or that it is too large (or empty).
+    """
+    # Check the size before attempting to download the response content
+    if "content-length" in headers:
+        if int(headers["content-length"]) > REMOTE_IMAGE_MAX_SIZE:
+            raise MediaStoreException(
+                "Image is too large (%s > %s bytes)."
+                % (headers["content-length"], REMOTE_IMAGE_MAX_SIZE)
+            )
+        elif int(headers["content-length"]) == 0:
+            raise MediaStoreException("Image is empty (0 bytes).")
+
+    # Check to see that we got some kind of image in the response,
+    # with the intent that the image will be checked more thorougly by another method
+    if "image" not in headers.get("content-type", ""):
+        raise MediaStoreException(
+            "Invalid content type: %s. Expected an image type."
+            % headers.get("content-type")
+        )
+
+
+def writeRemoteImageChunk(f, chunk):
+    """
+    Writes a chunk of a remote image to a file, or raises a MediaStoreException if the
+    image has grown too large. Servers can leave out the content-length, or send more
+    than it says, so the size is checked as the image is downloaded.
+    """
+    if f.tell() + len(chunk) > REMOTE_IMAGE_MAX_SIZE:
+        raise MediaStoreException(
+            "Image is too large (> %s bytes)." % REMOTE_IMAGE_MAX_SIZE
+        )
+    f.write(chunk)
+
+
+def getRemoteImageDeadline():
+    """
+    Returns the time, on the time.monotonic() clock, by which all of the images of a
+    request must have been fetched.
+    """
+    return time.monotonic() + REMOTE_IMAGE_DEADLINE
+
+
+def getRemainingTime(deadline, url):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise MediaStoreException(
+            "Timed out fetching remote image %s (limit %s seconds)."
+            % (url, REMOTE_IMAGE_DEADLINE)
+        )
+    return remaining
+
+
+def fetchRemoteImage(url, deadline=None):
+    """
+    Returns a temporary file object.
+    Raises a requests.exceptions.HTTPError if there's a 4xx or 5xx response.
+    Raises a MediaStoreException if the response content type header doesn't contain "image",
+    if the image is too large, or if it can't be fetched before the deadline.
+    """
+    if deadline is None:
+        deadline = getRemoteImageDeadline()
+    extension = guessImageExtensionFromUrl(url)
+    suffix = "" if extension is None else "." + extension
+    request_headers = getRemoteImageRequestHeaders()
+
     # Fetch the requested URL (could be HTTP or HTTPS)
-    with contextlib.closing(
-        requests.get(url, headers=request_headers, stream=True, verify=False)
-    ) as res:
+    remaining = getRemainingTime(deadline, url)
+    timeout = (
+        min(REMOTE_IMAGE_CONNECT_TIMEOUT, remaining),
+        min(REMOTE_IMAGE_READ_TIMEOUT, remaining),
+    )
+    try:
+        res = requests.get(
+            url, headers=request_headers, stream=True, verify=False, timeout=timeout
+        )
+    except requests.exceptions.Timeout as e:
+        raise MediaStoreException("Timed out fetching remote image %s: %s" % (url, e))
+
+    with contextlib.closing(res):
         logger.debug(
             "Fetched remote image. Request url=%s headers=%s Response code=%s headers=%s"
             % (url, request_headers, res.status_code, res.headers)
         )
         res.raise_for_status()
+        checkRemoteImageResponseHeaders(res.headers)
 
-        # Check the size before attempting to download the response content
-        if "content-length" in res.headers:
-            if int(res.headers["content-length"]) > max_size:
-                raise MediaStoreException(
-                    "Image is too large (%s > %s bytes)."
-                    % (res.headers["content-length"], max_size)
-                )
-            elif int(res.headers["content-length"]) == 0:
-                raise MediaStoreException("Image is empty (0 bytes).")
-
-        # Check to see that we got some kind of image in the response,
-        # with the intent that the image will be checked more thorougly by another method
-        if "image" not in res.headers.get("content-type", ""):
+        # Save the image content to a temporary file. The read timeout only bounds each
+        # chunk, so the deadline is checked between chunks too.
+        f = tempfile.TemporaryFile(suffix=suffix)
+        try:
+            for chunk in res.iter_content(chunk_size=REMOTE_IMAGE_CHUNK_SIZE):
+                getRemainingTime(deadline, url)
+                writeRemoteImageChunk(f, chunk)
+        except requests.exceptions.Timeout as e:
+            f.close()
             raise MediaStoreException(
-                "Invalid content type: %s. Expected an image type."
-                % res.headers["content-type"]
+                "Timed out fetching remote image %s: %s" % (url, e)
             )
-
-        # Save the image content to a temporary file
-        f = tempfile.TemporaryFile(suffix=suffix)
-        for chunk in res.iter_content(chunk_size=1024 * 1024):
-            f.write(chunk)
+        except BaseException:
+            f.close()
+            raise
         return f
 
-    return None
+
+def getRemoteImageValidators(headers):
+    """
+    Returns the validators of a remote image response, used to revalidate it later (see
+    RemoteFetchCache).
+    """
+    content_length = headers.get("content-length")
+    return {
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+        "content_length": int(content_length) if content_length else None,
+    }
 
 
-def processRemoteImages(items):
+async def fetchRemoteImageAsync(url, client, cache_entry=None):
     """
-    process a list of remote images to import
-    returns a dict that maps image urls to image files that have been fetched and cached locally.
+    Same as fetchRemoteImage(), but fetches the image with an httpx.AsyncClient so that
+    many images can be fetched concurrently by the same process.
+    Returns a django File with the validators of the response in its cache_validators.
+    Raises a httpx.HTTPStatusError if there's a 4xx or 5xx response.
+
+    The client's timeouts bound each connection and read; the overall deadline is up to
+    the caller (see processRemoteImagesAsync()).
+
+    When the URL was fetched before (cache_entry is its RemoteFetchCache entry), the
+    request is conditional, and None is returned without downloading the image if it
+    hasn't changed since.
     """
-    logger.debug("Processing remote images: %s" % items)
-    processed = {}
+    extension = guessImageExtensionFromUrl(url)
+    suffix = "" if extension is None else "." + extension
+    request_headers = getRemoteImageRequestHeaders()
+    if cache_entry is not None:
+        request_headers.update(cache_entry.get_conditional_headers())
+
+    async with client.stream("GET", url, headers=request_headers) as res:
+        logger.debug(
+            "Fetched remote image. Request url=%s headers=%s Response code=%s headers=%s"
+            % (url, request_headers, res.status_code, res.headers)
+        )
+        validators = getRemoteImageValidators(res.headers)
+        if cache_entry is not None and cache_entry.is_unchanged(
+            res.status_code, validators
+        ):
+            logger.debug("Remote image unchanged, using %s" % cache_entry.media_store)
+            return None
+        res.raise_for_status()
+        checkRemoteImageResponseHeaders(res.headers)
+
+        f = tempfile.TemporaryFile(suffix=suffix)
+        try:
+            async for chunk in res.aiter_bytes(chunk_size=REMOTE_IMAGE_CHUNK_SIZE):
+                writeRemoteImageChunk(f, chunk)
+        except BaseException:
+            # Includes cancellation when the deadline runs out
+            f.close()
+            raise
+        image_file = File(f)
+        image_file.cache_validators = validators
+        return image_file
+
+
+def getRemoteImageItemData(items):
+    """
+    Returns a list of (url, data) pairs for a list of remote images to import.
+    """
+    item_data = []
     for index, item in enumerate(items):
         url = item.get("url", None)
         if url is None:
@@ -135,11 +274,132 @@ def processRemoteImages(items):
             "title": item.get("title", "Untitled") or "Untitled",
             "description": item.get("description", ""),
         }
-        image_file = fetchRemoteImage(url)
-        processed[url] = {"file": File(image_file), "data": data}
+        item_data.append((url, data))
+    return item_data
+
+
+def processRemoteImages(items):
+    """
+    process a list of remote images to import
+    returns a dict that maps image urls to image files that have been fetched and cached locally.
+    """
+    logger.debug("Processing remote images: %s" % items)
+    deadline = getRemoteImageDeadline()
+    processed = {}
+    try:
+        for url, data in getRemoteImageItemData(items):
+            image_file = fetchRemoteImage(url, deadline)
+            processed[url] = {"file": File(image_file), "data": data}
+    except BaseException:
+        for item in processed.values():
+            item["file"].close()
+        raise
     return processed
 
 
+async def gatherWithDeadline(aws, timeout):
+    """
+    Runs awaitables concurrently and returns their results, like asyncio.gather().
+
+    If any of them fails, or they haven't all finished after timeout seconds, the rest
+    are cancelled and awaited before the error is raised, so that no work is left
+    running once the request has been answered.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.wait_for(asyncio.gather(*tasks), timeout)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, File):
+                result.close()
+        raise
+
+
+async def processRemoteImagesAsync(items, cache=None):
+    """
+    Same as processRemoteImages(), but fetches all of the images concurrently.
+
+    The cache maps URLs to their RemoteFetchCache entries. When the image at one of those
+    URLs hasn't changed, its "file" is None and "media_store" is the media it was stored
+    as before.
+    """
+    logger.debug("Processing remote images: %s" % items)
+    cache = cache or {}
+    item_data = getRemoteImageItemData(items)
+    timeout = httpx.Timeout(
+        REMOTE_IMAGE_READ_TIMEOUT, connect=REMOTE_IMAGE_CONNECT_TIMEOUT
+    )
+    async with httpx.AsyncClient(
+        verify=False, follow_redirects=True, timeout=timeout
+    ) as client:
+        try:
+            image_files = await gatherWithDeadline(
+                [
+                    fetchRemoteImageAsync(url, client, cache.get(url))
+                    for url, data in item_data
+                ],
+                REMOTE_IMAGE_DEADLINE,
+            )
+        except asyncio.TimeoutError:
+            raise MediaStoreException(
+                "Timed out fetching remote images (limit %s seconds)."
+                % REMOTE_IMAGE_DEADLINE
+            )
+        except httpx.TimeoutException as e:
+            raise MediaStoreException("Timed out fetching remote image: %s" % e)
+    processed = {}
+    for (url, data), image_file in zip(item_data, image_files):
+        if image_file is None:
+            processed[url] = {
+                "file": None,
+                "media_store": cache[url].media_store,
+                "data": data,
+            }
+        else:
+            processed[url] = {"file": image_file, "media_store": None, "data": data}
+    return processed
+
+
+def getMediaStoresByHash(hashes):
+    """
+    Returns a dict that maps the given MD5 hashes to the MediaStore instances that hold
+    content with that hash. Hashes that aren't in the store are left out.
+    """
+    hashes = [h.lower() for h in hashes]
+    for h in hashes:
+        if not MD5_HASH_RE.match(h):
+            raise MediaStoreException("Invalid MD5 hash: %s" % h)
+    media_stores = {}
+    for media_store in MediaStore.objects.filter(file_md5hash__in=hashes).order_by(
+        "pk"
+    ):
+        # There should only be one instance per hash, but keep the oldest if not
+        media_stores.setdefault(media_store.file_md5hash, media_store)
+    return media_stores
+
+
+def getZipFileNames(zip):
+    """
+    Returns the names of the files to extract from an uploaded zip, skipping directories
+    and Mac OS X artifacts.
+    """
+    names = []
+    for f in zip.namelist():
+        logger.debug("Extracting ZipFile: %s" % f)
+
+        if f.endswith("/"):
+            logger.debug("Skipping directory entry: %s" % f)
+            continue
+        if "__MACOSX" in f or ".DS_Store" in f:
+            logger.debug("Skipping MAC OS X resource file artifact: %s" % f)
+            continue
+        names.append(f)
+    return names
+
+
 def processFileUploads(filelist):
     """
     processes a file upload list, unzipping all zips
@@ -150,16 +410,7 @@ def processFileUploads(filelist):
         if zipfile.is_zipfile(file):
             # unzip and append to the list
             zip = zipfile.ZipFile(file, "r")
-            for f in zip.namelist():
-                logger.debug("Extracting ZipFile: %s" % f)
-
-                if f.endswith("/"):
-                    logger.debug("Skipping directory entry: %s" % f)
-                    continue
-                if "__MACOSX" in f or ".DS_Store" in f:
-                    logger.debug("Skipping MAC OS X resource file artifact: %s" % f)
-                    continue
-
+            for f in getZipFileNames(zip):
                 zf = zip.open(f).read()
                 newfile = File(io.BytesIO(zf))
                 newfile.name = f
@@ -171,6 +422,194 @@ def processFileUploads(filelist):
     return processed
 
 
+def getAnalysisExecutor():
+    """
+    Returns the process pool that analyzes images, or None if images are analyzed in the
+    calling process (IMAGE_ANALYSIS_PROCESSES, or the size given to
+    setAnalysisProcesses(), is 0 or 1).
+
+    The pool's processes are spawned rather than forked, since forking a process that
+    runs threads (the async views' database threads) isn't safe.
+    """
+    global _analysis_executor
+    processes = _analysis_processes
+    if processes is None:
+        processes = settings.IMAGE_ANALYSIS_PROCESSES
+    if not processes or processes <= 1:
+        return None
+    if _analysis_executor is None:
+        _analysis_executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _analysis_executor
+
+
+def shutdownAnalysisExecutor():
+    global _analysis_executor
+    if _analysis_executor is not None:
+        _analysis_executor.shutdown()
+        _analysis_executor = None
+
+
+def setAnalysisProcesses(processes):
+    """
+    Sets the size of this process's analysis pool, overriding IMAGE_ANALYSIS_PROCESSES
+    (None goes back to the setting). Worker commands use this to analyze images on
+    every CPU without starting a pool in each web process.
+    """
+    global _analysis_processes
+    shutdownAnalysisExecutor()
+    _analysis_processes = processes
+
+
+def getAnalysisArgs(file):
+    """
+    Returns the arguments of analyzeImage() for a django File. Files on disk are given by
+    path, so that only the path is sent to the pool; others are given by content.
+    """
+    if hasattr(file, "temporary_file_path"):
+        path = file.temporary_file_path()
+    else:
+        path = getattr(file.file, "name", None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return {"path": path, "file_name": file.name}
+    file.seek(0)
+    content = file.read()
+    file.seek(0)
+    return {"content": content, "file_name": file.name}
+
+
+def analyzeImages(files):
+    """
+    Analyzes a list of django Files (see analysis.analyzeImage()) and returns their
+    analyses in the same order. The files are analyzed concurrently in the process pool
+    when there is more than one.
+    """
+    global _analysis_executor
+    args = [getAnalysisArgs(f) for f in files]
+    executor = getAnalysisExecutor() if len(args) > 1 else None
+    if executor is not None:
+        try:
+            futures = [executor.submit(analyzeImage, **kwargs) for kwargs in args]
+            return [future.result() for future in futures]
+        except concurrent.futures.process.BrokenProcessPool as e:
+            # A process of the pool died (killed for using too much memory, say), so
+            # start a new pool next time and analyze these images here
+            logger.error("Image analysis pool is broken: %s" % e)
+            _analysis_executor = None
+    return [analyzeImage(**kwargs) for kwargs in args]
+
+
+def callInAnalysisPool(fn, **kwargs):
+    """
+    Calls a function of the analysis module in the process pool, or in the calling
+    process if there is no pool, and returns its result.
+    """
+    global _analysis_executor
+    executor = getAnalysisExecutor()
+    if executor is not None:
+        try:
+            return executor.submit(fn, **kwargs).result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            logger.error("Image analysis pool is broken: %s" % e)
+            _analysis_executor = None
+    return fn(**kwargs)
+
+
+def saveFileToBucket(key_name, path, content_type):
+    """
+    Saves a file on disk to the designated S3 bucket.
+    """
+    try:
+        connection = S3Connection(AWS_ACCESS_KEY_ID, AWS_ACCESS_SECRET_KEY)
+        k = Key(connection.get_bucket(AWS_S3_BUCKET))
+        k.key = key_name
+        logger.info("Saving file to S3 bucket with key=%s" % key_name)
+        k.set_contents_from_filename(
+            path, replace=True, headers={"Content-Type": content_type}
+        )
+    except boto.exception.NoAuthHandlerFound as e:
+        raise MediaStoreException("S3 Connection Error.  Details: %s" % str(e))
+    except boto.exception.S3ResponseError as e:
+        raise MediaStoreException("S3 Response Error.  Details: %s" % str(e))
+
+
+def loadFileFromBucket(key_name, path):
+    """
+    Saves a file in the designated S3 bucket to disk.
+    """
+    try:
+        connection = S3Connection(AWS_ACCESS_KEY_ID, AWS_ACCESS_SECRET_KEY)
+        k = Key(connection.get_bucket(AWS_S3_BUCKET))
+        k.key = key_name
+        k.get_contents_to_filename(path)
+    except boto.exception.NoAuthHandlerFound as e:
+        raise MediaStoreException("S3 Connection Error.  Details: %s" % str(e))
+    except boto.exception.S3ResponseError as e:
+        raise MediaStoreException("S3 Response Error.  Details: %s" % str(e))
+
+
+@functools.lru_cache(maxsize=None)
+def canSaveIiifDerivatives():
+    """
+    Returns true if Pillow can write the JPEG2000 pyramidal copies, which it can only do
+    if it was built with OpenJPEG. Logs a warning (once) if it can't.
+    """
+    if features.check("jpg_2000"):
+        return True
+    logger.warning(
+        "Pillow was built without OpenJPEG (JPEG2000 support), so pyramidal copies of "
+        "large images are not made for the IIIF image server"
+    )
+    return False
+
+
+def needsIiifDerivative(instance):
+    """
+    Returns true if a stored image is large enough to be worth a pyramidal copy for the
+    IIIF image server, and doesn't have one yet.
+    """
+    if not settings.IIIF_DERIVATIVES or instance.derivative_file_name:
+        return False
+    if not canSaveIiifDerivatives():
+        return False
+    size = max(instance.img_width or 0, instance.img_height or 0)
+    return size > settings.IIIF_DERIVATIVE_MIN_SIZE
+
+
+def saveIiifDerivative(instance, analysis_args):
+    """
+    Makes a pyramidal copy of a stored image (see analysis.makePyramidalImage()), given
+    the arguments of analyzeImage() for its file, and saves it to the S3 bucket next to
+    the image. Once it's saved, the image's IIIF URLs point at the copy.
+
+    Returns true if the copy was saved. The image server can still serve the original,
+    so errors are logged rather than raised.
+    """
+    file_name = "%s.%s" % (instance.file_md5hash, IIIF_DERIVATIVE_EXTENSION)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, file_name)
+        try:
+            levels = callInAnalysisPool(
+                makePyramidalImage,
+                dest=path,
+                tile_size=settings.IIIF_DERIVATIVE_TILE_SIZE,
+                **analysis_args
+            )
+            saveFileToBucket(
+                instance.get_derivative_s3_keyname(file_name),
+                path,
+                IIIF_DERIVATIVE_TYPE,
+            )
+        except Exception:
+            logger.exception("Error making IIIF derivative of %r" % instance)
+            return False
+    logger.info("Saved IIIF derivative of %r with %d resolutions" % (instance, levels))
+    instance.derivative_file_name = file_name
+    instance.save(update_fields=["derivative_file_name", "updated"])
+    return True
+
+
 class MediaStoreUpload:
     """
     The MediaStoreUpload class is responsible for storing a django UploadedFile.
@@ -196,9 +635,17 @@ class MediaStoreUpload:
         media_store_upload = MediaStoreUpload(file=request.FILES['upload'])
         if media_store_upload.is_valid():
             media_store_instance = media_store_upload.save()
+
+    The type, dimensions, size and hash of the file are computed as they are needed,
+    unless its analysis (see analyzeImages()) is given.
+
+    Making the pyramidal copy of a large image is slow, so it's only made if
+    save_derivative is true, which the ingest worker sets. Images saved in a web request
+    get theirs from manage.py generate_iiif_derivatives; until then the image server
+    serves the original.
     """
 
-    def __init__(self, uploaded_file):
+    def __init__(self, uploaded_file, analysis=None, save_derivative=False):
 
         if not isinstance(uploaded_file, UploadedFile) and not isinstance(
             uploaded_file, File
@@ -209,20 +656,26 @@ class MediaStoreUpload:
 
         self.file = uploaded_file
         self.instance = None  # Holds MediaStore instance
+        self.analysis = analysis
         self._file_md5hash = None  # holds cached MD5 hash of the file
+        if analysis is not None:
+            self._file_md5hash = analysis["file_md5hash"]
         self._is_valid = True
         self._error = {}
         self._raise_for_error = False
+        self._save_derivative = save_derivative
 
     def raise_for_error(self):
         self._raise_for_error = True
 
+    @use_primary()
     @transaction.atomic
     def save(self):
         """
         Returns a MediaStore instance. If the file already exists, returns the existing
         MediaStore instance, otherwise saves a new MediaStore instance and saves the
-        file to the S3 bucket.
+        file to the S3 bucket (and a pyramidal copy of a large image, once committed, if
+        save_derivative was given).
         """
         if self.instanceExists():
             logger.debug("instance exists")
@@ -232,6 +685,8 @@ class MediaStoreUpload:
             self.instance = self.createInstance()
             self.instance.save()
             self.saveToBucket()
+            if self._save_derivative:
+                self.saveDerivative()
         return self.instance
 
     def isValid(self):
@@ -289,7 +744,11 @@ class MediaStoreUpload:
         Validates that the given image can be opened and identified by the Pillow image library.
         """
         try:
-            Image.open(self.file)
+            if self.analysis is not None:
+                if self.analysis["open_error"] is not None:
+                    raise MediaStoreException(self.analysis["open_error"])
+            else:
+                Image.open(self.file)
         except Exception as e:
             errmsg = "Image cannot be opened or identified:"
             self.error("open", e)
@@ -335,6 +794,19 @@ class MediaStoreUpload:
 
         return True
 
+    def saveDerivative(self):
+        """
+        Saves a pyramidal copy of a large image for the IIIF image server once the image
+        has been committed, so that making it doesn't hold the transaction (and the rows
+        it locks) open. Until it's saved, the image server serves the original.
+        """
+        if needsIiifDerivative(self.instance):
+            transaction.on_commit(
+                functools.partial(
+                    saveIiifDerivative, self.instance, getAnalysisArgs(self.file)
+                )
+            )
+
     def instanceExists(self):
         """
         Returns true if a MediaStore instance already exists for the file, otherwise false.
@@ -376,9 +848,12 @@ class MediaStoreUpload:
         Returns the image-specific attributes of the file.
         """
         width, height = self.getImageDimensions()
+        placeholder, dominant_color = self.getPlaceholder()
         attrs = {
             "img_width": width,
             "img_height": height,
+            "placeholder": placeholder or "",
+            "dominant_color": dominant_color or "",
         }
         return attrs
 
@@ -386,6 +861,8 @@ class MediaStoreUpload:
         """
         Returns the uploaded file's size, in bytes.
         """
+        if self.analysis is not None:
+            return self.analysis["file_size"]
         return self.file.size
 
     def getFileType(self):
@@ -395,6 +872,8 @@ class MediaStoreUpload:
         NOTE: there are *two* python libraries named "magic" so if this method is generating
         errors, it's possible that the other "magic" is installed on the system.
         """
+        if self.analysis is not None:
+            return self.analysis["file_type"]
         buf = next(self.file.chunks(1024))
         file_type = magic.from_buffer(buf, mime=True)
         return file_type
@@ -403,28 +882,7 @@ class MediaStoreUpload:
         """
         Returns the lowercase file extension (no dot). Example: "jpg" or "gif"
         """
-        file_type = self.getFileType()
-        file_extension = ""
-
-        # Attempt to get the file extension from its mime type
-        if file_type in VALID_IMAGE_EXT_FOR_TYPE:
-            file_extension = VALID_IMAGE_EXT_FOR_TYPE.get(file_type, "")
-
-        # Otherwise fall back to the file name
-        if not file_extension:
-            name_parts = os.path.splitext(self.file.name)
-            if len(name_parts) > 1:
-                file_extension = name_parts[1]
-                if len(file_extension) > 0 and file_extension[0] == ".":
-                    file_extension = file_extension[1:]
-            file_extension = file_extension.lower()
-
-            # Set canonical file extension for JPEGs (i.e ."jpeg" -> "jpg")
-            canonical_map = {"jpeg": "jpg"}
-            if file_extension in canonical_map:
-                file_extension = canonical_map[file_extension]
-
-        return file_extension
+        return getImageExtension(self.getFileType(), self.file.name)
 
     def getImageDimensions(self):
         """
@@ -433,11 +891,29 @@ class MediaStoreUpload:
         Borrows Django's django.core.files.images.get_image_dimensions
         method to get the dimensions via Pillow (python imaging module).
         """
+        if self.analysis is not None:
+            return self.analysis["img_width"], self.analysis["img_height"]
         image_dimensions = get_image_dimensions(self.file)
         width = image_dimensions[0]
         height = image_dimensions[1]
         return width, height
 
+    def getPlaceholder(self):
+        """
+        Returns the BlurHash and dominant colour of the uploaded image, or None for both
+        if the image can't be decoded.
+        """
+        if self.analysis is not None:
+            return self.analysis["placeholder"], self.analysis["dominant_color"]
+        try:
+            self.file.seek(0)
+            return getImagePlaceholder(Image.open(self.file))
+        except Exception as e:
+            logger.warning("Error computing placeholder: %s" % e)
+            return None, None
+        finally:
+            self.file.seek(0)
+
     def getFileHash(self):
         """
         Returns an MD5 hash of the file contents to use as a file signature.
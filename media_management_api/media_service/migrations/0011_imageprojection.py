@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0010_auto_20200625_1726"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageProjection",
+            fields=[
+                (
+                    "resource",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="projection",
+                        serialize=False,
+                        to="media_service.resource",
+                    ),
+                ),
+                ("sort_order", models.IntegerField(default=0)),
+                ("title", models.CharField(max_length=255)),
+                ("description", models.TextField(blank=True)),
+                ("original_file_name", models.CharField(max_length=4096, null=True)),
+                ("is_upload", models.BooleanField(default=True)),
+                ("metadata", models.JSONField(default=list)),
+                ("collection_ids", models.JSONField(default=list)),
+                ("image_type", models.CharField(max_length=512, null=True)),
+                ("image_url", models.CharField(max_length=4096, null=True)),
+                ("image_width", models.PositiveIntegerField(null=True)),
+                ("image_height", models.PositiveIntegerField(null=True)),
+                ("thumb_url", models.CharField(max_length=4096, null=True)),
+                ("thumb_width", models.PositiveIntegerField(null=True)),
+                ("thumb_height", models.PositiveIntegerField(null=True)),
+                ("iiif_base_url", models.CharField(max_length=4096, null=True)),
+                ("created", models.DateTimeField()),
+                ("updated", models.DateTimeField()),
+                (
+                    "course",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="image_projections",
+                        to="media_service.course",
+                    ),
+                ),
+                (
+                    "media_store",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="media_service.mediastore",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "image projection",
+                "verbose_name_plural": "image projections",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="imageprojection",
+            index=models.Index(
+                fields=["course", "sort_order"], name="media_servi_course__d800b2_idx"
+            ),
+        ),
+    ]
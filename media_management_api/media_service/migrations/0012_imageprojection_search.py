@@ -0,0 +1,52 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(
+    fields=["search_vector"], name="imageprojection_search_gin"
+)
+
+
+def create_search_index(apps, schema_editor):
+    # GIN indexes are PostgreSQL specific (the test suite runs on SQLite)
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.add_index(
+        apps.get_model("media_service", "ImageProjection"), SEARCH_INDEX
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.remove_index(
+        apps.get_model("media_service", "ImageProjection"), SEARCH_INDEX
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0011_imageprojection"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imageprojection",
+            name="metadata_text",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="imageprojection",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name="imageprojection", index=SEARCH_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index),
+            ],
+        ),
+    ]
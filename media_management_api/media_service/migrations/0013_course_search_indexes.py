@@ -0,0 +1,41 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Trigram indexes answer the case-insensitive "contains" matches of the course search
+# (Django compares UPPER(column::text), so the indexes are on the same expression), and
+# the pattern_ops index answers the case-sensitive SIS ID prefix matches.
+SEARCH_INDEXES = {
+    "course_title_trgm": "USING gin (UPPER(title::text) gin_trgm_ops)",
+    "course_lti_context_title_trgm": "USING gin (UPPER(lti_context_title::text) gin_trgm_ops)",
+    "course_lti_context_label_trgm": "USING gin (UPPER(lti_context_label::text) gin_trgm_ops)",
+    "course_sis_course_id_like": "(sis_course_id varchar_pattern_ops)",
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, definition in SEARCH_INDEXES.items():
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS %s ON media_service_course %s"
+            % (name, definition)
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in SEARCH_INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS %s" % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0012_imageprojection_search"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,114 @@
+import json
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+
+METADATA_INDEX = django.contrib.postgres.indexes.GinIndex(
+    fields=["metadata"],
+    name="imageprojection_metadata_gin",
+    opclasses=["jsonb_path_ops"],
+)
+
+
+def parse_metadata(text):
+    try:
+        metadata = json.loads(text)
+    except (TypeError, ValueError):
+        return []
+    return metadata if isinstance(metadata, list) else []
+
+
+def iter_batches(Resource, fields):
+    """
+    Yields resources in primary key order, BATCH_SIZE at a time, so that the table is
+    never read (or locked) all at once.
+    """
+    last_pk = 0
+    while True:
+        batch = list(
+            Resource.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", *fields)[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def copy_metadata_to_json(apps, schema_editor):
+    Resource = apps.get_model("media_service", "Resource")
+    for batch in iter_batches(Resource, ["metadata"]):
+        for resource in batch:
+            resource.metadata_json = parse_metadata(resource.metadata)
+        with transaction.atomic():
+            Resource.objects.bulk_update(batch, ["metadata_json"])
+
+
+def copy_metadata_to_text(apps, schema_editor):
+    Resource = apps.get_model("media_service", "Resource")
+    for batch in iter_batches(Resource, ["metadata_json"]):
+        for resource in batch:
+            resource.metadata = json.dumps(resource.metadata_json or [])
+        with transaction.atomic():
+            Resource.objects.bulk_update(batch, ["metadata"])
+
+
+def create_metadata_index(apps, schema_editor):
+    # GIN indexes are PostgreSQL specific (the test suite runs on SQLite)
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.add_index(
+        apps.get_model("media_service", "ImageProjection"), METADATA_INDEX
+    )
+
+
+def drop_metadata_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.remove_index(
+        apps.get_model("media_service", "ImageProjection"), METADATA_INDEX
+    )
+
+
+class Migration(migrations.Migration):
+    # Each batch of the data migration commits on its own instead of rewriting the
+    # whole table in a single transaction.
+    atomic = False
+
+    dependencies = [
+        ("media_service", "0013_course_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="resource",
+            name="metadata_json",
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(copy_metadata_to_json, copy_metadata_to_text),
+        migrations.RemoveField(
+            model_name="resource",
+            name="metadata",
+        ),
+        migrations.RenameField(
+            model_name="resource",
+            old_name="metadata_json",
+            new_name="metadata",
+        ),
+        migrations.AlterField(
+            model_name="resource",
+            name="metadata",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name="imageprojection", index=METADATA_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(create_metadata_index, drop_metadata_index),
+            ],
+        ),
+    ]
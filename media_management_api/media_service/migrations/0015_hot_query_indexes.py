@@ -0,0 +1,95 @@
+from django.db import migrations, models
+
+INDEXES = [
+    (
+        "collection",
+        models.Index(
+            fields=["course", "sort_order"], name="collection_course_sort_idx"
+        ),
+    ),
+    (
+        "collectionresource",
+        models.Index(
+            fields=["collection", "sort_order"], name="collectionres_coll_sort_idx"
+        ),
+    ),
+    (
+        "course",
+        models.Index(fields=["canvas_course_id"], name="course_canvas_course_id_idx"),
+    ),
+    (
+        "mediastore",
+        models.Index(fields=["file_md5hash"], name="mediastore_md5hash_idx"),
+    ),
+    (
+        "resource",
+        models.Index(fields=["course", "sort_order"], name="resource_course_sort_idx"),
+    ),
+]
+
+
+def create_indexes(apps, schema_editor):
+    # On PostgreSQL the indexes are built concurrently so that writes to these tables
+    # are not blocked while the migration runs.
+    concurrently = schema_editor.connection.vendor == "postgresql"
+    for model_name, index in INDEXES:
+        model = apps.get_model("media_service", model_name)
+        if concurrently:
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+
+def drop_indexes(apps, schema_editor):
+    concurrently = schema_editor.connection.vendor == "postgresql"
+    for model_name, index in INDEXES:
+        model = apps.get_model("media_service", model_name)
+        if concurrently:
+            schema_editor.remove_index(model, index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("media_service", "0014_resource_metadata_jsonb"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="collection",
+            options={
+                "ordering": ["course_id", "sort_order", "title"],
+                "verbose_name": "collection",
+                "verbose_name_plural": "collections",
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="collectionresource",
+            options={
+                "ordering": ["collection_id", "sort_order", "resource_id"],
+                "verbose_name": "collection resource",
+                "verbose_name_plural": "collection resources",
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="resource",
+            options={
+                "ordering": ["course_id", "sort_order", "title"],
+                "verbose_name": "resource",
+                "verbose_name_plural": "resources",
+            },
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name=model_name, index=index)
+                for model_name, index in INDEXES
+            ],
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0015_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="mediastore",
+            name="file_size",
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.CreateModel(
+            name="UploadSession",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("file_name", models.CharField(max_length=1024)),
+                ("file_size", models.PositiveBigIntegerField()),
+                ("file_md5hash", models.CharField(max_length=32)),
+                ("file_type", models.CharField(max_length=512)),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("completed", "Completed"),
+                            ("error", "Error"),
+                        ],
+                        default="pending",
+                        max_length=100,
+                    ),
+                ),
+                ("error", models.TextField(blank=True)),
+                (
+                    "course",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="upload_sessions",
+                        to="media_service.course",
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="media_service.userprofile",
+                    ),
+                ),
+                (
+                    "resource",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="media_service.resource",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "upload session",
+                "verbose_name_plural": "upload sessions",
+                "ordering": ["-created"],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0016_upload_session"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadsession",
+            name="chunked",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="uploadsession",
+            name="offset",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
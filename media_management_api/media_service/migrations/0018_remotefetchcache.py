@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0017_upload_session_chunked"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RemoteFetchCache",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("url", models.TextField()),
+                ("url_hash", models.CharField(max_length=64, unique=True)),
+                ("etag", models.CharField(blank=True, max_length=1024)),
+                ("last_modified", models.CharField(blank=True, max_length=64)),
+                ("content_length", models.PositiveBigIntegerField(null=True)),
+                (
+                    "media_store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="media_service.mediastore",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "remote fetch cache",
+                "verbose_name_plural": "remote fetch cache",
+            },
+        ),
+    ]
@@ -0,0 +1,125 @@
+# Generated by Django 3.2.25 on 2026-10-19 03:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0019_idempotencykey"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("error", "Error"),
+                        ],
+                        default="queued",
+                        max_length=100,
+                    ),
+                ),
+                ("error", models.TextField(blank=True)),
+                ("started", models.DateTimeField(blank=True, null=True)),
+                ("finished", models.DateTimeField(blank=True, null=True)),
+                (
+                    "course",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ingest_jobs",
+                        to="media_service.course",
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="media_service.userprofile",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "ingest job",
+                "verbose_name_plural": "ingest jobs",
+                "ordering": ["-created"],
+            },
+        ),
+        migrations.CreateModel(
+            name="IngestJobItem",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("index", models.PositiveIntegerField()),
+                ("file_name", models.CharField(max_length=1024)),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("completed", "Completed"),
+                            ("error", "Error"),
+                        ],
+                        default="pending",
+                        max_length=100,
+                    ),
+                ),
+                ("error", models.TextField(blank=True)),
+                (
+                    "job",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="items",
+                        to="media_service.ingestjob",
+                    ),
+                ),
+                (
+                    "resource",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="media_service.resource",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "ingest job item",
+                "verbose_name_plural": "ingest job items",
+                "ordering": ["job", "index"],
+                "unique_together": {("job", "index")},
+            },
+        ),
+        migrations.AddIndex(
+            model_name="ingestjob",
+            index=models.Index(fields=["state", "created"], name="ingestjob_state_idx"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0020_ingestjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mediastore",
+            name="derivative_file_name",
+            field=models.CharField(blank=True, default="", max_length=1024),
+        ),
+    ]
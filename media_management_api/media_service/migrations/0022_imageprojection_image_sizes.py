@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0021_mediastore_derivative"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imageprojection",
+            name="image_sizes",
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-19 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0022_imageprojection_image_sizes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imageprojection",
+            name="dominant_color",
+            field=models.CharField(max_length=7, null=True),
+        ),
+        migrations.AddField(
+            model_name="imageprojection",
+            name="placeholder",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="mediastore",
+            name="dominant_color",
+            field=models.CharField(blank=True, default="", max_length=7),
+        ),
+        migrations.AddField(
+            model_name="mediastore",
+            name="placeholder",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-19 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("media_service", "0023_placeholders"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="ingestjob",
+            name="state",
+            field=models.CharField(
+                choices=[
+                    ("spooling", "Spooling"),
+                    ("queued", "Queued"),
+                    ("running", "Running"),
+                    ("completed", "Completed"),
+                    ("error", "Error"),
+                ],
+                default="queued",
+                max_length=100,
+            ),
+        ),
+    ]
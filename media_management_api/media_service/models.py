@@ -1,11 +1,26 @@
+import hashlib
 import json
 import logging
+from collections import defaultdict
 from urllib.parse import quote
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import Error, models, transaction
-from django.db.models import Max
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+    TrigramSimilarity,
+)
+from django.core.cache import cache
+from django.db import Error, connection, models, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Q, Value, When, signals
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from media_management_api.routers import use_primary
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +29,9 @@ IIIF_IMAGE_SERVER_URL = settings.IIIF_IMAGE_SERVER_URL
 AWS_S3_BUCKET = settings.AWS_S3_BUCKET
 AWS_S3_KEY_PREFIX = settings.AWS_S3_KEY_PREFIX
 
+# Text search configuration used for the image search vectors
+SEARCH_CONFIG = "english"
+
 
 class BaseModel(models.Model):
     created = models.DateTimeField(auto_now_add=True)
@@ -41,17 +59,25 @@ class SortOrderModelMixin(object):
 
 class MediaStore(BaseModel):
     file_name = models.CharField(max_length=1024, null=False)
-    file_size = models.PositiveIntegerField(null=False)
+    file_size = models.PositiveBigIntegerField(null=False)
     file_md5hash = models.CharField(max_length=32, null=False)
     file_extension = models.CharField(max_length=6, null=True)
     file_type = models.CharField(max_length=512, null=True)
     img_width = models.PositiveIntegerField(null=True)
     img_height = models.PositiveIntegerField(null=True)
     reference_count = models.PositiveIntegerField(default=0)
+    # Name of the pyramidal copy that the IIIF image server reads instead of the file
+    derivative_file_name = models.CharField(max_length=1024, blank=True, default="")
+    # BlurHash and dominant colour ("#rrggbb") shown by clients until the image loads
+    placeholder = models.CharField(max_length=64, blank=True, default="")
+    dominant_color = models.CharField(max_length=7, blank=True, default="")
 
     class Meta:
         verbose_name = "media_store"
         verbose_name_plural = "media_store"
+        indexes = [
+            models.Index(fields=["file_md5hash"], name="mediastore_md5hash_idx"),
+        ]
 
     def __repr__(self):
         return "MediaStore:{0}:{1}".format(self.id, self.file_name)
@@ -60,9 +86,11 @@ class MediaStore(BaseModel):
         return self.file_name
 
     def _get_iiif_identifier(self, encode=False):
-        identifier = "{bucket}/{keyname}".format(
-            bucket=AWS_S3_BUCKET, keyname=self.get_s3_keyname()
-        )
+        if self.derivative_file_name:
+            keyname = self.get_derivative_s3_keyname()
+        else:
+            keyname = self.get_s3_keyname()
+        identifier = "{bucket}/{keyname}".format(bucket=AWS_S3_BUCKET, keyname=keyname)
         if encode:
             identifier = quote(
                 identifier, safe=""
@@ -75,6 +103,10 @@ class MediaStore(BaseModel):
             base_url=IIIF_IMAGE_SERVER_URL, identifier=identifier
         )
 
+    @classmethod
+    def get_iiif_info_cache_key(cls, pk):
+        return "iiif_info:%s" % pk
+
     def get_iiif_full_url(self, thumb=False):
         w, h = (self.img_width, self.img_height)
         size = "full"
@@ -94,6 +126,40 @@ class MediaStore(BaseModel):
         )
         return {"width": w, "height": h, "url": url}
 
+    def get_iiif_sizes(self):
+        """
+        Returns the smaller copies of the image for responsive images (srcset): one for
+        each size in IIIF_IMAGE_SIZES (a bounding box, in pixels) that is smaller than
+        the image, smallest first, with its width, height and IIIF URL.
+        """
+        w, h = (self.img_width, self.img_height)
+        if not w or not h:
+            return []
+        longest = max(w, h)
+        identifier = self._get_iiif_identifier(encode=True)
+        sizes = []
+        for box in sorted(settings.IIIF_IMAGE_SIZES):
+            if box >= longest:
+                break
+            url = MediaStore.make_iiif_image_server_url(
+                {
+                    "identifier": identifier,
+                    "region": "full",
+                    "size": "!{box},{box}".format(box=box),
+                    "rotation": 0,
+                    "quality": "default",
+                    "format": "jpg",
+                }
+            )
+            sizes.append(
+                {
+                    "width": max(w * box // longest, 1),
+                    "height": max(h * box // longest, 1),
+                    "url": url,
+                }
+            )
+        return sizes
+
     def calc_thumb_size(self, max_height=200):
         w, h = (self.img_width, self.img_height)
         if h > max_height:
@@ -109,6 +175,13 @@ class MediaStore(BaseModel):
             prefix=AWS_S3_KEY_PREFIX, pk=self.pk, file_name=self.file_name
         )
 
+    def get_derivative_s3_keyname(self, file_name=None):
+        return "{prefix}/images/{pk}/derivatives/{file_name}".format(
+            prefix=AWS_S3_KEY_PREFIX,
+            pk=self.pk,
+            file_name=file_name or self.derivative_file_name,
+        )
+
     def get_s3_url(self):
         """Returns an absolute URL to the given item in the S3 bucket."""
         return "http://s3.amazonaws.com/%s/%s" % (AWS_S3_BUCKET, self.get_s3_keyname())
@@ -191,7 +264,48 @@ class Course(BaseModel):
         verbose_name_plural = "courses"
         ordering = ["title"]
         unique_together = ["lti_context_id", "lti_tool_consumer_instance_guid"]
+        indexes = [
+            models.Index(
+                fields=["canvas_course_id"], name="course_canvas_course_id_idx"
+            ),
+        ]
 
+    @classmethod
+    def search(cls, text, queryset=None):
+        """
+        Returns the courses matching the search text, best matches first.
+
+        Courses match when the text is contained in the title or LTI context title/label, or
+        when the SIS course ID starts with it. Title and SIS ID prefix matches rank first. On
+        PostgreSQL the remaining results are ranked by trigram similarity, and the matching
+        is answered by the trigram and pattern indexes (see migration 0013).
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        matches = Q(title__icontains=text)
+        matches |= Q(lti_context_title__icontains=text)
+        matches |= Q(lti_context_label__icontains=text)
+        matches |= Q(sis_course_id__startswith=text)
+        prefix_match = Case(
+            When(
+                Q(title__istartswith=text) | Q(sis_course_id__startswith=text), then=1
+            ),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        queryset = queryset.filter(matches).annotate(prefix_match=prefix_match)
+        if connection.vendor != "postgresql":
+            return queryset.order_by("-prefix_match", "title", "pk")
+        similarity = Greatest(
+            TrigramSimilarity("title", text),
+            TrigramSimilarity("lti_context_title", text),
+            TrigramSimilarity("lti_context_label", text),
+        )
+        return queryset.annotate(similarity=similarity).order_by(
+            "-prefix_match", "-similarity", "title", "pk"
+        )
+
+    @use_primary()
     def copy(self, dest_course):
         """
         Copies all of the collections and resources from this course to a destination course.
@@ -332,6 +446,7 @@ class CourseUser(BaseModel):
 
 
 def metadata_default():
+    # Default of the old text column, still referenced by historical migrations
     return json.dumps([])
 
 
@@ -358,40 +473,40 @@ class Resource(BaseModel, SortOrderModelMixin):
     thumb_height = models.PositiveIntegerField(null=True, blank=True)
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
-    metadata = models.TextField(blank=True, default=metadata_default)
+    metadata = models.JSONField(blank=True, default=list)
     sort_order = models.IntegerField(default=0)
 
     class Meta:
         verbose_name = "resource"
         verbose_name_plural = "resources"
-        ordering = ["course", "sort_order", "title"]
+        # Ordering by "course_id" rather than "course" avoids joining the course table to
+        # apply its default ordering.
+        ordering = ["course_id", "sort_order", "title"]
+        indexes = [
+            models.Index(
+                fields=["course", "sort_order"], name="resource_course_sort_idx"
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if self.course and not self.sort_order:
             self.sort_order = self.next_sort_order({"course__pk": self.course.pk})
 
-        # This code is to ensure we only ever have a JSON "list" saved in the metadata field.
-        # Note that rigorous validation of the data structure happens in the serializer. A better
-        # solution would be to implement a true "JSONField" with rigorous validation on the model.
-        try:
-            self.metadata = (
-                self.metadata
-                if isinstance(json.loads(self.metadata), list)
-                else metadata_default()
-            )
-        except (TypeError, ValueError):
-            self.metadata = metadata_default()
+        # Ensure we only ever have a JSON "list" saved in the metadata field.
+        # Note that rigorous validation of the data structure happens in the serializer.
+        if not isinstance(self.metadata, list):
+            self.metadata = []
 
         if self.media_store:
             self.media_store.reference_count += 1
-            self.media_store.save()
+            self.media_store.save(update_fields=["reference_count", "updated"])
 
         super(Resource, self).save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
         if self.media_store:
             self.media_store.reference_count -= 1
-            self.media_store.save()
+            self.media_store.save(update_fields=["reference_count", "updated"])
         super(Resource, self).delete(*args, **kwargs)
 
     def copy_to(self, course_pk):
@@ -414,6 +529,9 @@ class Resource(BaseModel, SortOrderModelMixin):
             thumb_width = self.thumb_width
             thumb_height = self.thumb_height
             iiif_base_url = None
+            image_sizes = []
+            placeholder = None
+            dominant_color = None
         else:
             thumb = self.media_store.get_iiif_full_url(thumb=True)
             full = self.media_store.get_iiif_full_url(thumb=False)
@@ -425,6 +543,9 @@ class Resource(BaseModel, SortOrderModelMixin):
             thumb_url = thumb["url"]
             thumb_width = thumb["width"]
             thumb_height = thumb["height"]
+            image_sizes = self.media_store.get_iiif_sizes()
+            placeholder = self.media_store.placeholder or None
+            dominant_color = self.media_store.dominant_color or None
         data = {
             "image_type": image_type,
             "image_width": image_width,
@@ -434,14 +555,14 @@ class Resource(BaseModel, SortOrderModelMixin):
             "thumb_height": thumb_height,
             "thumb_url": thumb_url,
             "iiif_base_url": iiif_base_url,
+            "image_sizes": image_sizes,
+            "placeholder": placeholder,
+            "dominant_color": dominant_color,
         }
         return data
 
     def load_metadata(self):
-        if self.metadata:
-            return json.loads(self.metadata)
-        else:
-            return []
+        return self.metadata or []
 
     def __repr__(self):
         return "Resource:{0}:{1}".format(self.id, self.title)
@@ -480,7 +601,12 @@ class Collection(BaseModel, SortOrderModelMixin):
     class Meta:
         verbose_name = "collection"
         verbose_name_plural = "collections"
-        ordering = ["course", "sort_order", "title"]
+        ordering = ["course_id", "sort_order", "title"]
+        indexes = [
+            models.Index(
+                fields=["course", "sort_order"], name="collection_course_sort_idx"
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.sort_order:
@@ -524,7 +650,14 @@ class CollectionResource(BaseModel, SortOrderModelMixin):
     class Meta:
         verbose_name = "collection resource"
         verbose_name_plural = "collection resources"
-        ordering = ["collection", "sort_order", "resource"]
+        # Ordering by "collection" and "resource" would join both tables (and, through
+        # their default orderings, the course table) just to sort.
+        ordering = ["collection_id", "sort_order", "resource_id"]
+        indexes = [
+            models.Index(
+                fields=["collection", "sort_order"], name="collectionres_coll_sort_idx"
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.sort_order:
@@ -621,3 +754,643 @@ class CourseCopy(BaseModel):
 
     def __unicode__(self):
         return str(self.pk)
+
+
+class RemoteFetchCache(BaseModel):
+    """
+    Remembers the media that a remote image URL was stored as, along with the validators
+    (ETag, Last-Modified) of the response it was fetched from. When the URL is imported
+    again, a conditional request tells whether the image is unchanged, in which case the
+    stored media is used without downloading the image again.
+    """
+
+    url = models.TextField()
+    url_hash = models.CharField(max_length=64, unique=True)
+    etag = models.CharField(max_length=1024, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    content_length = models.PositiveBigIntegerField(null=True)
+    media_store = models.ForeignKey(MediaStore, on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = "remote fetch cache"
+        verbose_name_plural = "remote fetch cache"
+
+    @classmethod
+    def hash_url(cls, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get_for_urls(cls, urls):
+        """
+        Returns a dict that maps the given URLs to their cache entries, if any.
+        """
+        hashes = {cls.hash_url(url): url for url in urls}
+        entries = cls.objects.select_related("media_store").filter(
+            url_hash__in=list(hashes)
+        )
+        return {hashes[entry.url_hash]: entry for entry in entries}
+
+    @classmethod
+    def record(cls, url, validators, media_store):
+        """
+        Saves the validators of the response that a URL was fetched from. Nothing is saved
+        when the response had no validators, since it couldn't be revalidated.
+        """
+        if not validators.get("etag") and not validators.get("last_modified"):
+            return None
+        entry, created = cls.objects.update_or_create(
+            url_hash=cls.hash_url(url),
+            defaults={
+                "url": url,
+                "etag": validators.get("etag") or "",
+                "last_modified": validators.get("last_modified") or "",
+                "content_length": validators.get("content_length"),
+                "media_store": media_store,
+            },
+        )
+        return entry
+
+    def get_conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def is_unchanged(self, status_code, validators):
+        """
+        Returns true if a response shows that the remote image hasn't changed, either with
+        a 304 or, for servers that ignore conditional requests, matching validators.
+        """
+        if status_code == 304:
+            return True
+        if status_code != 200:
+            return False
+        if self.etag and validators.get("etag"):
+            return self.etag == validators["etag"]
+        if not self.last_modified or self.content_length is None:
+            return False
+        return (self.last_modified, self.content_length) == (
+            validators.get("last_modified"),
+            validators.get("content_length"),
+        )
+
+    def __repr__(self):
+        return "RemoteFetchCache:%s:%s" % (self.pk, self.url)
+
+
+class UploadSession(BaseModel):
+    """
+    An image that a client uploads straight to the staging area of the storage with a
+    presigned URL (see staging.py), rather than through the API. Finalizing the session
+    checks the staged object and adds it to the media store and the course.
+
+    Chunked sessions are instead uploaded to the API in chunks (see ChunkedUpload), and
+    offset is the number of bytes received so far, so that an interrupted upload can be
+    resumed from where it stopped.
+    """
+
+    STATE_PENDING = "pending"
+    STATE_COMPLETED = "completed"
+    STATE_ERROR = "error"
+    STATE_CHOICES = (
+        (STATE_PENDING, "Pending"),
+        (STATE_COMPLETED, "Completed"),
+        (STATE_ERROR, "Error"),
+    )
+    course = models.ForeignKey(
+        Course, on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    owner = models.ForeignKey(UserProfile, null=True, on_delete=models.SET_NULL)
+    file_name = models.CharField(max_length=1024)
+    file_size = models.PositiveBigIntegerField()
+    file_md5hash = models.CharField(max_length=32)
+    file_type = models.CharField(max_length=512)
+    state = models.CharField(
+        max_length=100, choices=STATE_CHOICES, default=STATE_PENDING
+    )
+    error = models.TextField(blank=True)
+    resource = models.ForeignKey(
+        Resource, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    chunked = models.BooleanField(default=False)
+    offset = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "upload session"
+        verbose_name_plural = "upload sessions"
+        ordering = ["-created"]
+
+    def get_staging_keyname(self):
+        return "{prefix}/staging/{pk}/{md5}".format(
+            prefix=AWS_S3_KEY_PREFIX, pk=self.pk, md5=self.file_md5hash
+        )
+
+    def complete(self, resource):
+        self.state = self.STATE_COMPLETED
+        self.resource = resource
+        self.error = ""
+        self.save()
+        return self
+
+    def fail(self, error_msg):
+        self.state = self.STATE_ERROR
+        self.error = error_msg
+        self.save()
+        return self
+
+    def __repr__(self):
+        return "UploadSession:%s" % (self.pk)
+
+    def __str__(self):
+        return str(self.pk)
+
+
+class IngestJob(BaseModel):
+    """
+    A batch of uploaded images that the ingest worker adds to a course in the background
+    (see ingest.py), so that a large upload doesn't hold up the request. The files are
+    spooled when the job is created, with one item per image, and each item records the
+    outcome for its image. The job is only queued for the worker once all of its files
+    have been spooled.
+
+    A running job is touched after every item, so a job that hasn't been updated for
+    INGEST_JOB_TIMEOUT seconds belongs to a worker that died, and is taken over.
+    """
+
+    STATE_SPOOLING = "spooling"
+    STATE_QUEUED = "queued"
+    STATE_RUNNING = "running"
+    STATE_COMPLETED = "completed"
+    STATE_ERROR = "error"
+    STATE_CHOICES = (
+        (STATE_SPOOLING, "Spooling"),
+        (STATE_QUEUED, "Queued"),
+        (STATE_RUNNING, "Running"),
+        (STATE_COMPLETED, "Completed"),
+        (STATE_ERROR, "Error"),
+    )
+    course = models.ForeignKey(
+        Course, on_delete=models.CASCADE, related_name="ingest_jobs"
+    )
+    owner = models.ForeignKey(UserProfile, null=True, on_delete=models.SET_NULL)
+    state = models.CharField(
+        max_length=100, choices=STATE_CHOICES, default=STATE_QUEUED
+    )
+    error = models.TextField(blank=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "ingest job"
+        verbose_name_plural = "ingest jobs"
+        ordering = ["-created"]
+        indexes = [
+            models.Index(fields=["state", "created"], name="ingestjob_state_idx"),
+        ]
+
+    def complete(self):
+        self.state = self.STATE_COMPLETED
+        self.finished = timezone.now()
+        self.save()
+        return self
+
+    def fail(self, error_msg):
+        self.state = self.STATE_ERROR
+        self.error = error_msg
+        self.finished = timezone.now()
+        self.save()
+        return self
+
+    def get_counts(self):
+        """
+        Returns the number of items of the job in each state, and in total.
+        """
+        counts = {state: 0 for state, label in IngestJobItem.STATE_CHOICES}
+        rows = self.items.order_by().values_list("state").annotate(n=Count("pk"))
+        for state, n in rows:
+            counts[state] = n
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def __repr__(self):
+        return "IngestJob:%s" % (self.pk)
+
+    def __str__(self):
+        return str(self.pk)
+
+
+class IngestJobItem(BaseModel):
+    STATE_PENDING = "pending"
+    STATE_COMPLETED = "completed"
+    STATE_ERROR = "error"
+    STATE_CHOICES = (
+        (STATE_PENDING, "Pending"),
+        (STATE_COMPLETED, "Completed"),
+        (STATE_ERROR, "Error"),
+    )
+    job = models.ForeignKey(IngestJob, on_delete=models.CASCADE, related_name="items")
+    index = models.PositiveIntegerField()
+    file_name = models.CharField(max_length=1024)
+    state = models.CharField(
+        max_length=100, choices=STATE_CHOICES, default=STATE_PENDING
+    )
+    error = models.TextField(blank=True)
+    resource = models.ForeignKey(
+        Resource, null=True, blank=True, on_delete=models.SET_NULL
+    )
+
+    class Meta:
+        verbose_name = "ingest job item"
+        verbose_name_plural = "ingest job items"
+        ordering = ["job", "index"]
+        unique_together = ("job", "index")
+
+    def get_staging_keyname(self):
+        return "{prefix}/staging/ingest/{job_pk}/{index}".format(
+            prefix=AWS_S3_KEY_PREFIX, job_pk=self.job_id, index=self.index
+        )
+
+    def __repr__(self):
+        return "IngestJobItem:%s:%s" % (self.pk, self.file_name)
+
+    def __str__(self):
+        return self.file_name
+
+
+class IdempotencyKey(BaseModel):
+    """
+    The response to a request that was made with an Idempotency-Key header, which is
+    replayed when the client retries the request with the same key instead of doing the
+    work again (see idempotency.py). The key is pending while the first request is in
+    progress, and retries wait for it to complete.
+    """
+
+    STATE_PENDING = "pending"
+    STATE_COMPLETED = "completed"
+    STATE_CHOICES = (
+        (STATE_PENDING, "Pending"),
+        (STATE_COMPLETED, "Completed"),
+    )
+    owner = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    request_method = models.CharField(max_length=10)
+    request_path = models.CharField(max_length=1024)
+    request_hash = models.CharField(max_length=64)
+    state = models.CharField(
+        max_length=100, choices=STATE_CHOICES, default=STATE_PENDING
+    )
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = "idempotency key"
+        verbose_name_plural = "idempotency keys"
+        unique_together = ("owner", "key")
+
+    def complete(self, status_code, body):
+        self.state = self.STATE_COMPLETED
+        self.response_status = status_code
+        self.response_body = body
+        self.save()
+        return self
+
+    def __repr__(self):
+        return "IdempotencyKey:%s:%s" % (self.pk, self.key)
+
+    def __str__(self):
+        return self.key
+
+
+class ImageProjection(models.Model):
+    """
+    Denormalized, read-only projection of a course image (Resource).
+
+    Each row holds the precomputed representation of one resource (IIIF URLs, thumbnail
+    dimensions, parsed metadata and the IDs of the collections it belongs to), so that
+    image listings can be served from a single indexed scan of this table instead of joining
+    Resource, MediaStore and Course and recomputing the representation row by row.
+
+    Rows are kept current by the signal handlers below and by the bulk code paths that call
+    refresh() directly. The whole table can be rebuilt with:
+
+        python manage.py rebuild_image_projections
+    """
+
+    resource = models.OneToOneField(
+        Resource,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="projection",
+    )
+    course = models.ForeignKey(
+        Course, on_delete=models.CASCADE, related_name="image_projections"
+    )
+    media_store = models.ForeignKey(
+        MediaStore, null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    sort_order = models.IntegerField(default=0)
+    title = models.CharField(max_length=255)
+    description = models.TextField(blank=True)
+    original_file_name = models.CharField(max_length=4096, null=True)
+    is_upload = models.BooleanField(default=True)
+    metadata = models.JSONField(default=list)
+    collection_ids = models.JSONField(default=list)
+    metadata_text = models.TextField(blank=True, default="")
+    search_vector = SearchVectorField(null=True)
+    image_type = models.CharField(max_length=512, null=True)
+    image_url = models.CharField(max_length=4096, null=True)
+    image_width = models.PositiveIntegerField(null=True)
+    image_height = models.PositiveIntegerField(null=True)
+    thumb_url = models.CharField(max_length=4096, null=True)
+    thumb_width = models.PositiveIntegerField(null=True)
+    thumb_height = models.PositiveIntegerField(null=True)
+    iiif_base_url = models.CharField(max_length=4096, null=True)
+    image_sizes = models.JSONField(default=list)
+    placeholder = models.CharField(max_length=64, null=True)
+    dominant_color = models.CharField(max_length=7, null=True)
+    created = models.DateTimeField()
+    updated = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "image projection"
+        verbose_name_plural = "image projections"
+        indexes = [
+            models.Index(fields=["course", "sort_order"]),
+            GinIndex(fields=["search_vector"], name="imageprojection_search_gin"),
+            GinIndex(
+                fields=["metadata"],
+                name="imageprojection_metadata_gin",
+                opclasses=["jsonb_path_ops"],
+            ),
+        ]
+
+    @property
+    def id(self):
+        return self.resource_id
+
+    def get_representation(self):
+        return {
+            "image_type": self.image_type,
+            "image_width": self.image_width,
+            "image_height": self.image_height,
+            "image_url": self.image_url,
+            "thumb_width": self.thumb_width,
+            "thumb_height": self.thumb_height,
+            "thumb_url": self.thumb_url,
+            "iiif_base_url": self.iiif_base_url,
+            "image_sizes": self.image_sizes,
+            "placeholder": self.placeholder,
+            "dominant_color": self.dominant_color,
+        }
+
+    def load_metadata(self):
+        return self.metadata
+
+    @classmethod
+    def from_resource(cls, resource, collection_ids=None):
+        """
+        Returns a new (unsaved) projection for the given resource.
+        """
+        metadata = resource.load_metadata()
+        projection = cls(
+            resource_id=resource.pk,
+            course_id=resource.course_id,
+            media_store_id=resource.media_store_id,
+            sort_order=resource.sort_order,
+            title=resource.title,
+            description=resource.description,
+            original_file_name=resource.original_file_name,
+            is_upload=resource.is_upload,
+            metadata=metadata,
+            metadata_text=" ".join(
+                "%s %s" % (pair.get("label", ""), pair.get("value", ""))
+                for pair in metadata
+                if isinstance(pair, dict)
+            ),
+            collection_ids=collection_ids or [],
+            created=resource.created,
+            updated=resource.updated,
+        )
+        for k, v in resource.get_representation().items():
+            setattr(projection, k, v)
+        return projection
+
+    @classmethod
+    def refresh(cls, resource_ids):
+        """
+        Recomputes the projections of the given resources. Resources that no longer exist
+        have their projections removed.
+        """
+        resource_ids = list(resource_ids)
+        if not resource_ids:
+            return []
+        resources = Resource.objects.filter(pk__in=resource_ids).select_related(
+            "media_store"
+        )
+        collection_ids = defaultdict(list)
+        collection_resources = (
+            CollectionResource.objects.filter(resource_id__in=resource_ids)
+            .order_by("collection_id")
+            .values_list("resource_id", "collection_id")
+        )
+        for resource_id, collection_id in collection_resources:
+            if collection_id not in collection_ids[resource_id]:
+                collection_ids[resource_id].append(collection_id)
+
+        projections = [
+            cls.from_resource(resource, collection_ids[resource.pk])
+            for resource in resources
+        ]
+        with transaction.atomic():
+            cls.objects.filter(resource_id__in=resource_ids).delete()
+            cls.objects.bulk_create(projections)
+            cls.update_search_vectors(resource_ids)
+        return projections
+
+    @classmethod
+    def update_search_vectors(cls, resource_ids):
+        """
+        Recomputes the full-text search vectors of the given projections in one statement.
+        Search vectors are only maintained on PostgreSQL (see search()).
+        """
+        if connection.vendor != "postgresql":
+            return
+        search_vector = SearchVector("title", weight="A", config=SEARCH_CONFIG)
+        search_vector += SearchVector("description", weight="B", config=SEARCH_CONFIG)
+        search_vector += SearchVector("metadata_text", weight="C", config=SEARCH_CONFIG)
+        cls.objects.filter(resource_id__in=resource_ids).update(
+            search_vector=search_vector
+        )
+
+    @classmethod
+    def search(cls, text, queryset=None):
+        """
+        Returns the projections matching the search text, best matches first.
+
+        On PostgreSQL this is a ranked full-text search answered by the GIN index on the
+        search vectors. Other databases (e.g. SQLite in the test suite) fall back to
+        case-insensitive substring matching ordered by sort order.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        if connection.vendor != "postgresql":
+            matches = Q(title__icontains=text)
+            matches |= Q(description__icontains=text)
+            matches |= Q(metadata_text__icontains=text)
+            return queryset.filter(matches).order_by("course_id", "sort_order")
+        query = SearchQuery(text, search_type="websearch", config=SEARCH_CONFIG)
+        return (
+            queryset.filter(search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "course_id", "sort_order")
+        )
+
+    @classmethod
+    def filter_metadata(cls, label, value, queryset=None):
+        """
+        Returns the projections having a metadata pair with exactly this label and value.
+
+        On PostgreSQL this is a jsonb containment query answered by the GIN index on the
+        metadata. Other databases (e.g. SQLite in the test suite) use the JSON1 functions.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        if connection.vendor == "postgresql":
+            return queryset.filter(
+                metadata__contains=[{"label": label, "value": value}]
+            )
+        where = (
+            "EXISTS (SELECT 1 FROM json_each(%s.metadata) AS pair"
+            " WHERE json_extract(pair.value, '$.label') = %%s"
+            " AND json_extract(pair.value, '$.value') = %%s)" % cls._meta.db_table
+        )
+        return queryset.extra(where=[where], params=[label, value])
+
+    @classmethod
+    def get_projections(cls, resource_ids):
+        """
+        Returns a dict mapping resource IDs to projections. Any projections that are missing
+        (e.g. not yet built by the rebuild command) are computed on the fly.
+        """
+        resource_ids = list(resource_ids)
+        projections = cls.objects.in_bulk(resource_ids)
+        missing = set(resource_ids) - set(projections)
+        if missing:
+            logger.warning("Image projections missing for resources: %s" % missing)
+            for projection in cls.refresh(missing):
+                projections[projection.resource_id] = projection
+        return projections
+
+    @classmethod
+    def refresh_collection_ids(cls, resource_id):
+        """
+        Updates only the collection IDs of an existing projection.
+        """
+        collection_ids = list(
+            CollectionResource.objects.filter(resource_id=resource_id)
+            .order_by("collection_id")
+            .values_list("collection_id", flat=True)
+            .distinct()
+        )
+        cls.objects.filter(resource_id=resource_id).update(
+            collection_ids=collection_ids
+        )
+
+    @classmethod
+    def rebuild(cls, course_ids=None, batch_size=500):
+        """
+        Rebuilds the projections of all resources (optionally limited to a set of courses)
+        in batches. Returns the number of projections written.
+        """
+        resources = Resource.objects.all()
+        if course_ids is not None:
+            resources = resources.filter(course_id__in=course_ids)
+            cls.objects.filter(course_id__in=course_ids).exclude(
+                resource_id__in=resources.values("pk")
+            ).delete()
+        else:
+            cls.objects.exclude(resource_id__in=resources.values("pk")).delete()
+
+        resource_ids = list(resources.order_by("pk").values_list("pk", flat=True))
+        total = 0
+        for start in range(0, len(resource_ids), batch_size):
+            total += len(cls.refresh(resource_ids[start : start + batch_size]))
+        return total
+
+    def __repr__(self):
+        return "ImageProjection:%s" % (self.resource_id)
+
+    def __str__(self):
+        return self.__unicode__()
+
+    def __unicode__(self):
+        return str(self.resource_id)
+
+
+def resource_saved(sender, instance, **kwargs):
+    """
+    Refreshes the image projection of a resource (called via post_save signal).
+    """
+    ImageProjection.refresh([instance.pk])
+
+
+def resource_deleted(sender, instance, **kwargs):
+    """
+    Removes the image projection of a resource (called via post_delete signal).
+    """
+    ImageProjection.objects.filter(resource_id=instance.pk).delete()
+
+
+def collection_resource_changed(sender, instance, **kwargs):
+    """
+    Updates the collection IDs of a resource's image projection (called via post_save
+    and post_delete signals).
+    """
+    ImageProjection.refresh_collection_ids(instance.resource_id)
+
+
+def media_store_saved(sender, instance, update_fields=None, **kwargs):
+    """
+    Refreshes the image projections (and cached image information) that reference a media
+    store (called via post_save signal). Saves that only touch the reference count don't
+    affect the representation and are ignored.
+    """
+    if update_fields is not None and set(update_fields) <= {
+        "reference_count",
+        "updated",
+    }:
+        return
+    cache.delete(MediaStore.get_iiif_info_cache_key(instance.pk))
+    ImageProjection.refresh(
+        Resource.objects.filter(media_store=instance).values_list("pk", flat=True)
+    )
+
+
+def media_store_deleting(sender, instance, **kwargs):
+    """
+    Remembers which resources reference a media store before it's deleted (called via
+    pre_delete signal), since the references are nulled without sending any signals.
+    """
+    instance._projection_resource_ids = list(
+        Resource.objects.filter(media_store=instance).values_list("pk", flat=True)
+    )
+
+
+def media_store_deleted(sender, instance, **kwargs):
+    """
+    Refreshes the image projections that referenced a deleted media store (called via
+    post_delete signal).
+    """
+    cache.delete(MediaStore.get_iiif_info_cache_key(instance.pk))
+    ImageProjection.refresh(getattr(instance, "_projection_resource_ids", []))
+
+
+signals.post_save.connect(resource_saved, sender=Resource)
+signals.post_delete.connect(resource_deleted, sender=Resource)
+signals.post_save.connect(collection_resource_changed, sender=CollectionResource)
+signals.post_delete.connect(collection_resource_changed, sender=CollectionResource)
+signals.post_save.connect(media_store_saved, sender=MediaStore)
+signals.pre_delete.connect(media_store_deleting, sender=MediaStore)
+signals.post_delete.connect(media_store_deleted, sender=MediaStore)
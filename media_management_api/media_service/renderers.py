@@ -0,0 +1,80 @@
+import itertools
+
+import msgpack
+import orjson
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+_encoder = encoders.JSONEncoder()
+
+
+def default_encoder(obj):
+    """
+    Encodes the types that orjson and msgpack don't handle natively (dates, decimals,
+    lazy strings, querysets, etc) the same way as DRF's JSONEncoder.
+    """
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(renderers.BaseRenderer):
+    """
+    Renders JSON with orjson.
+
+    Datetimes are passed through to DRF's encoder so that the output matches the stock
+    JSONRenderer. An indent may be requested via the media type (e.g. "application/json;
+    indent=4"), but orjson only supports indenting by two spaces.
+    """
+
+    media_type = "application/json"
+    format = "json"
+    charset = None
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def get_options(self, accepted_media_type, renderer_context):
+        indent = renderers.JSONRenderer.get_indent(
+            self, accepted_media_type, renderer_context or {}
+        )
+        if indent:
+            return self.options | orjson.OPT_INDENT_2
+        return self.options
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        options = self.get_options(accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=default_encoder, option=options)
+
+    def render_iter(self, items, chunk_size=500):
+        """
+        Renders an iterable of items as a JSON array, yielding the output in chunks of
+        (at most) chunk_size items so that the whole array is never held in memory.
+        """
+        items = iter(items)
+        yield b"["
+        separator = b""
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+            if not chunk:
+                break
+            yield separator + b",".join(
+                orjson.dumps(item, default=default_encoder, option=self.options)
+                for item in chunk
+            )
+            separator = b","
+        yield b"]"
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    Renders MessagePack for internal clients that send "Accept: application/msgpack".
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=default_encoder, use_bin_type=True)
@@ -1,11 +1,43 @@
+import abc
 import json
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import exceptions, serializers
 from rest_framework.reverse import reverse
 
 from . import mediastore
-from .models import Collection, CollectionResource, Course, CourseCopy, Resource
+from .models import (
+    Collection,
+    CollectionResource,
+    Course,
+    CourseCopy,
+    ImageProjection,
+    IngestJob,
+    IngestJobItem,
+    MediaStore,
+    RemoteFetchCache,
+    Resource,
+    UploadSession,
+)
+
+# Primary key used to resolve a URL once per request. The real primary key is substituted
+# for it when building each row (see ValuesListSerializer.url_for()).
+URL_PK_PLACEHOLDER = 2147483647
+
+REPRESENTATION_FIELDS = (
+    "image_type",
+    "image_width",
+    "image_height",
+    "image_url",
+    "thumb_width",
+    "thumb_height",
+    "thumb_url",
+    "iiif_base_url",
+    "image_sizes",
+    "placeholder",
+    "dominant_color",
+)
 
 
 def resource_to_representation(resource):
@@ -261,22 +293,41 @@ class CsvExportResourceSerializer(serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(
         view_name="api:image-detail", lookup_field="pk"
     )
-    metadata = serializers.JSONField(
-        binary=False, required=False, allow_null=True, validators=[metadata_validator]
-    )
+    metadata = serializers.SerializerMethodField()
     iiif_url = (
         serializers.SerializerMethodField()
     )  # implicitly refers to get_iiif_url :(
+    iiif_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Resource
-        fields = ("url", "id", "title", "description", "iiif_url", "metadata")
+        fields = (
+            "url",
+            "id",
+            "title",
+            "description",
+            "iiif_url",
+            "iiif_srcset",
+            "metadata",
+        )
+
+    def get_metadata(self, resource):
+        # Exported as a single JSON column rather than flattened by the CSV renderer
+        return json.dumps(resource.load_metadata())
 
     def get_iiif_url(self, resource):
         if resource.media_store:
             return resource.media_store.get_iiif_full_url(thumb=False)
         return None
 
+    def get_iiif_srcset(self, resource):
+        if resource.media_store:
+            return ", ".join(
+                "%s %dw" % (size["url"], size["width"])
+                for size in resource.media_store.get_iiif_sizes()
+            )
+        return None
+
 
 class ResourceSerializer(serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(
@@ -308,7 +359,9 @@ class ResourceSerializer(serializers.HyperlinkedModelSerializer):
     def __init__(self, *args, **kwargs):
         self.is_upload = kwargs.pop("is_upload", None)
         self.file_object = kwargs.pop("file_object", None)
+        self.file_analysis = kwargs.pop("file_analysis", None)
         self.file_url = kwargs.pop("file_url", None)
+        self.media_store = kwargs.pop("media_store", None)
         super(ResourceSerializer, self).__init__(*args, **kwargs)
 
     def create(self, validated_data):
@@ -318,12 +371,19 @@ class ResourceSerializer(serializers.HyperlinkedModelSerializer):
         description = validated_data.get("description", "")
         metadata = validated_data.get("metadata", None)
 
-        media_store_instance = None
+        media_store_instance = self.media_store
         if self.file_object:
             media_store_instance = self.handle_file_object()
+            if self.file_url:
+                # Remember the stored media so the URL can be revalidated next time
+                RemoteFetchCache.record(
+                    self.file_url,
+                    getattr(self.file_object, "cache_validators", {}),
+                    media_store_instance,
+                )
 
-        original_file_name = ""
-        if self.is_upload:
+        original_file_name = validated_data.get("original_file_name", "")
+        if self.is_upload and self.file_object:
             title = original_file_name = self.file_object.name
         elif self.file_url:
             original_file_name = self.file_url
@@ -340,7 +400,7 @@ class ResourceSerializer(serializers.HyperlinkedModelSerializer):
 
         # Metadata cannot be null, so only include if it's non-null
         if metadata is not None:
-            resource_attrs["metadata"] = json.dumps(metadata)
+            resource_attrs["metadata"] = metadata
 
         resource = Resource(**resource_attrs)
         resource.save()
@@ -351,14 +411,16 @@ class ResourceSerializer(serializers.HyperlinkedModelSerializer):
         instance.description = validated_data.get("description", instance.description)
         instance.sort_order = validated_data.get("sort_order", instance.sort_order)
         if "metadata" in validated_data:
-            instance.metadata = json.dumps(validated_data["metadata"])
+            instance.metadata = validated_data["metadata"]
         instance.save()
         return instance
 
     def handle_file_object(self):
         """Uploads file object to the media store."""
         try:
-            media_store_upload = mediastore.MediaStoreUpload(self.file_object)
+            media_store_upload = mediastore.MediaStoreUpload(
+                self.file_object, analysis=self.file_analysis
+            )
             media_store_upload.raise_for_error()
             media_store_upload.validate()
         except mediastore.MediaStoreException as e:
@@ -379,6 +441,121 @@ class ResourceSerializer(serializers.HyperlinkedModelSerializer):
         return data
 
 
+class ResourceBulkUpdateSerializer(serializers.Serializer):
+    """
+    Validates one item of a bulk update of a course's images. Only the fields that are
+    given are updated.
+    """
+
+    id = serializers.IntegerField()
+    title = serializers.CharField(max_length=255, required=False)
+    description = serializers.CharField(
+        max_length=None, required=False, allow_blank=True
+    )
+    metadata = serializers.JSONField(
+        binary=False, required=False, allow_null=True, validators=[metadata_validator]
+    )
+    sort_order = serializers.IntegerField(required=False)
+
+
+class MediaStoreSerializer(serializers.ModelSerializer):
+    md5 = serializers.CharField(source="file_md5hash")
+
+    class Meta:
+        model = MediaStore
+        fields = (
+            "md5",
+            "file_size",
+            "file_type",
+            "file_extension",
+            "img_width",
+            "img_height",
+        )
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    course_id = serializers.PrimaryKeyRelatedField(read_only=True)
+    resource_id = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = (
+            "id",
+            "course_id",
+            "file_name",
+            "file_size",
+            "file_md5hash",
+            "file_type",
+            "state",
+            "error",
+            "resource_id",
+            "chunked",
+            "offset",
+            "created",
+            "updated",
+        )
+        read_only_fields = ("state", "error", "offset", "created", "updated")
+
+    def validate_file_size(self, value):
+        if value == 0:
+            raise serializers.ValidationError("Image is empty (0 bytes).")
+        elif value > settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                "Image is too large (%s > %s bytes)."
+                % (value, settings.UPLOAD_MAX_SIZE)
+            )
+        return value
+
+    def validate_file_md5hash(self, value):
+        value = value.lower()
+        if not mediastore.MD5_HASH_RE.match(value):
+            raise serializers.ValidationError("Invalid MD5 hash: %s" % value)
+        return value
+
+    def validate_file_type(self, value):
+        if value not in mediastore.VALID_IMAGE_TYPES:
+            raise serializers.ValidationError(
+                "Image type '%s' is not supported. Please ensure the image is one of the supported image types."
+                % value
+            )
+        return value
+
+
+class IngestJobItemSerializer(serializers.ModelSerializer):
+    resource_id = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = IngestJobItem
+        fields = ("index", "file_name", "state", "error", "resource_id")
+
+
+class IngestJobSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(
+        view_name="api:ingest-job-detail", lookup_field="pk"
+    )
+    course_id = serializers.PrimaryKeyRelatedField(read_only=True)
+    items = IngestJobItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = IngestJob
+        fields = (
+            "url",
+            "id",
+            "course_id",
+            "state",
+            "error",
+            "items",
+            "created",
+            "started",
+            "finished",
+        )
+
+    def to_representation(self, instance):
+        data = super(IngestJobSerializer, self).to_representation(instance)
+        data["counts"] = instance.get_counts()
+        return data
+
+
 class CourseSerializer(serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(
         view_name="api:course-detail", lookup_field="pk"
@@ -449,3 +626,172 @@ class CourseCopySerializer(serializers.ModelSerializer):
         data["type"] = "coursecopy"
         data["data"] = instance.loadData()
         return data
+
+
+class ValuesListSerializer(abc.ABC):
+    """
+    Read-only serializer for large lists that bypasses the DRF field machinery.
+
+    Rows are fetched with values() and turned into dicts directly. Hyperlinks are resolved
+    once per view name and request (with a placeholder primary key) and then completed for
+    each row by string substitution, rather than calling reverse() for every object.
+
+    The output must be identical to the regular serializer it stands in for, so subclasses
+    should be kept in sync with the corresponding ModelSerializer.
+    """
+
+    def __init__(self, queryset, context=None):
+        self.queryset = queryset
+        self.context = context or {}
+        self._url_templates = {}
+        self._datetime_field = serializers.DateTimeField()
+
+    def url_for(self, view_name, pk):
+        if view_name not in self._url_templates:
+            url = reverse(
+                view_name,
+                kwargs={"pk": URL_PK_PLACEHOLDER},
+                request=self.context.get("request"),
+            )
+            self._url_templates[view_name] = url.rsplit(str(URL_PK_PLACEHOLDER), 1)
+        prefix, suffix = self._url_templates[view_name]
+        return "%s%s%s" % (prefix, pk, suffix)
+
+    def format_datetime(self, value):
+        return self._datetime_field.to_representation(value)
+
+    values = ()
+
+    def get_rows(self):
+        # Rows may also be given already fetched, e.g. a page of values() rows
+        if isinstance(self.queryset, list):
+            return self.queryset
+        return self.queryset.values(*self.values).iterator(chunk_size=2000)
+
+    @abc.abstractmethod
+    def row_to_representation(self, row):
+        """
+        Returns the representation of a values() row.
+        """
+
+    def iter_data(self):
+        for row in self.get_rows():
+            yield self.row_to_representation(row)
+
+    @property
+    def data(self):
+        return list(self.iter_data())
+
+
+class ImageListSerializer(ValuesListSerializer):
+    """
+    Read-only equivalent of ResourceSerializer for a queryset of image projections.
+    """
+
+    values = (
+        "resource_id",
+        "course_id",
+        "title",
+        "description",
+        "metadata",
+        "sort_order",
+        "original_file_name",
+        "created",
+        "updated",
+        "is_upload",
+    ) + REPRESENTATION_FIELDS
+
+    def row_to_representation(self, row):
+        data = {
+            "url": self.url_for("api:image-detail", row["resource_id"]),
+            "id": row["resource_id"],
+            "course_id": row["course_id"],
+            "title": row["title"],
+            "description": row["description"],
+            "metadata": row["metadata"],
+            "sort_order": row["sort_order"],
+            "original_file_name": row["original_file_name"],
+            "created": self.format_datetime(row["created"]),
+            "updated": self.format_datetime(row["updated"]),
+            "type": "images",
+            "is_upload": row["is_upload"],
+        }
+        for field in REPRESENTATION_FIELDS:
+            data[field] = row[field]
+        return data
+
+
+class CollectionImageListSerializer(ValuesListSerializer):
+    """
+    Read-only equivalent of CollectionResourceSerializer for a queryset of collection
+    resources. The image details are read from the image projections.
+    """
+
+    values = ("id", "collection_id", "resource_id", "sort_order", "created", "updated")
+    projection_values = (
+        "resource_id",
+        "title",
+        "description",
+        "original_file_name",
+        "is_upload",
+    ) + REPRESENTATION_FIELDS
+
+    def get_rows(self):
+        rows = list(self.queryset.values(*self.values))
+        resource_ids = [row["resource_id"] for row in rows]
+        projections = {
+            projection["resource_id"]: projection
+            for projection in ImageProjection.objects.filter(
+                resource_id__in=resource_ids
+            ).values(*self.projection_values)
+        }
+        missing = set(resource_ids) - set(projections)
+        if missing:
+            for projection in ImageProjection.get_projections(missing).values():
+                projections[projection.resource_id] = {
+                    k: getattr(projection, k) for k in self.projection_values
+                }
+        for row in rows:
+            row["projection"] = projections[row["resource_id"]]
+        return rows
+
+    def row_to_representation(self, row):
+        projection = row["projection"]
+        data = {
+            "id": row["id"],
+            "url": self.url_for("api:collectionimages-detail", row["id"]),
+            # Note: "collection_url" is not included because CollectionResourceSerializer
+            # skips it (CollectionResource has no such attribute to look up).
+            "collection_id": row["collection_id"],
+            "course_image_id": row["resource_id"],
+            "sort_order": row["sort_order"],
+            "created": self.format_datetime(row["created"]),
+            "updated": self.format_datetime(row["updated"]),
+            "type": "collectionimages",
+            "title": projection["title"],
+            "description": projection["description"],
+            "original_file_name": projection["original_file_name"],
+            "is_upload": projection["is_upload"],
+        }
+        for field in REPRESENTATION_FIELDS:
+            data[field] = projection[field]
+        return data
+
+
+class CourseSearchResultSerializer(ValuesListSerializer):
+    """
+    Lightweight, read-only course representation for search (typeahead) results.
+    """
+
+    values = (
+        "id",
+        "title",
+        "sis_course_id",
+        "lti_context_title",
+        "lti_context_label",
+    )
+
+    def row_to_representation(self, row):
+        data = {field: row[field] for field in self.values}
+        data["url"] = self.url_for("api:course-detail", row["id"])
+        return data
@@ -0,0 +1,257 @@
+"""
+Contact sheets (sprites) of course images.
+
+The course library shows a grid of thumbnails, which takes hundreds of requests to the
+IIIF image server for a large course. A sprite combines the thumbnails of a page of a
+course's images (in sort order) into one JPEG, with a map of where each image is on it.
+The thumbnails are fetched from the image server, which reads them from the pyramidal
+derivatives of large images.
+
+Sprites are cached by a hash of their members (the images of the page and their
+thumbnail URLs), so adding, removing, reordering or replacing images gives the page a
+new sprite. A complete sprite never changes once it's made; one that is missing
+thumbnails is made again once its short timeout is up. A sprite that has been evicted
+from the cache is made again from its page, if the page's images are still the same.
+
+Example usage:
+    members = get_members(course.pk, page=1, page_size=100)
+    sprite = await get_sprite(course.pk, members)
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import math
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image
+
+from .aio import database_sync_to_async
+from .mediastore import (
+    REMOTE_IMAGE_CONNECT_TIMEOUT,
+    REMOTE_IMAGE_DEADLINE,
+    REMOTE_IMAGE_READ_TIMEOUT,
+    gatherWithDeadline,
+)
+from .models import ImageProjection
+
+logger = logging.getLogger(__name__)
+
+SPRITE_QUALITY = 80
+# Background of images whose thumbnail couldn't be fetched, if they have no dominant colour
+SPRITE_MISSING_COLOR = "#cccccc"
+# Seconds to cache a sprite that is missing thumbnails, before trying again
+SPRITE_INCOMPLETE_TIMEOUT = 60
+
+
+class SpriteException(Exception):
+    pass
+
+
+def get_members(course_pk, page, page_size):
+    """
+    Returns the images of a page of a course's images, in sort order.
+    """
+    start = (page - 1) * page_size
+    projections = (
+        ImageProjection.objects.filter(course_id=course_pk)
+        .order_by("sort_order", "resource_id")
+        .values(
+            "resource_id",
+            "iiif_base_url",
+            "image_width",
+            "image_height",
+            "dominant_color",
+        )
+    )
+    return list(projections[start : start + page_size])
+
+
+def get_thumbnail_url(member, cell_size):
+    if not member["iiif_base_url"]:
+        return None
+    return "{base_url}/full/!{size},{size}/0/default.jpg".format(
+        base_url=member["iiif_base_url"], size=cell_size
+    )
+
+
+def get_sprite_key(course_pk, members, cell_size):
+    """
+    Returns the hash that identifies the sprite of a list of members.
+    """
+    content = [
+        course_pk,
+        cell_size,
+        [
+            [member["resource_id"], get_thumbnail_url(member, cell_size)]
+            for member in members
+        ],
+    ]
+    return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+def get_cache_key(key):
+    return "sprite:%s" % key
+
+
+def is_complete(sprite):
+    """
+    Returns true if every thumbnail of a sprite was drawn.
+    """
+    return all(image["loaded"] for image in sprite["map"]["images"])
+
+
+def fit_size(width, height, cell_size):
+    """
+    Returns the size of an image scaled down to fit in a cell.
+    """
+    if not width or not height:
+        return cell_size, cell_size
+    scale = min(cell_size / width, cell_size / height, 1)
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+async def fetch_thumbnail(client, url, semaphore):
+    """
+    Returns the content of a thumbnail, or None if it couldn't be fetched.
+    """
+    if url is None:
+        return None
+    async with semaphore:
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning("Error fetching thumbnail %s: %s" % (url, e))
+            return None
+    return response.content
+
+
+async def fetch_thumbnails(urls):
+    """
+    Fetches thumbnails concurrently, at most SPRITE_FETCH_CONCURRENCY at a time.
+    """
+    semaphore = asyncio.Semaphore(settings.SPRITE_FETCH_CONCURRENCY)
+    timeout = httpx.Timeout(
+        REMOTE_IMAGE_READ_TIMEOUT, connect=REMOTE_IMAGE_CONNECT_TIMEOUT
+    )
+    async with httpx.AsyncClient(follow_redirects=True, timeout=timeout) as client:
+        try:
+            return await gatherWithDeadline(
+                [fetch_thumbnail(client, url, semaphore) for url in urls],
+                REMOTE_IMAGE_DEADLINE,
+            )
+        except asyncio.TimeoutError:
+            raise SpriteException(
+                "Timed out fetching thumbnails (limit %s seconds)."
+                % REMOTE_IMAGE_DEADLINE
+            )
+
+
+def make_sprite(members, thumbnails, cell_size):
+    """
+    Lays out the thumbnails of the members in a grid of cells, left to right and top to
+    bottom. Returns the JPEG content of the sprite and its map.
+
+    An image whose thumbnail is missing is drawn as a box of its dominant colour, and
+    marked as not loaded in the map.
+    """
+    columns = max(math.ceil(math.sqrt(len(members))), 1)
+    rows = max(math.ceil(len(members) / columns), 1)
+    sheet = Image.new("RGB", (columns * cell_size, rows * cell_size), "white")
+    images = []
+    for n, (member, content) in enumerate(zip(members, thumbnails)):
+        x, y = (n % columns) * cell_size, (n // columns) * cell_size
+        im = None
+        if content is not None:
+            try:
+                im = Image.open(io.BytesIO(content))
+                im.draft("RGB", (cell_size, cell_size))
+                im = im.convert("RGB")
+                im.thumbnail((cell_size, cell_size))
+            except Exception as e:
+                logger.warning(
+                    "Error reading thumbnail of image %s: %s"
+                    % (member["resource_id"], e)
+                )
+                im = None
+        loaded = im is not None
+        if not loaded:
+            size = fit_size(member["image_width"], member["image_height"], cell_size)
+            im = Image.new(
+                "RGB", size, member["dominant_color"] or SPRITE_MISSING_COLOR
+            )
+        sheet.paste(im, (x, y))
+        images.append(
+            {
+                "id": member["resource_id"],
+                "x": x,
+                "y": y,
+                "width": im.width,
+                "height": im.height,
+                "loaded": loaded,
+            }
+        )
+
+    out = io.BytesIO()
+    sheet.save(out, "JPEG", quality=SPRITE_QUALITY, optimize=True, progressive=True)
+    sprite_map = {
+        "width": sheet.width,
+        "height": sheet.height,
+        "cell_size": cell_size,
+        "images": images,
+    }
+    return out.getvalue(), sprite_map
+
+
+async def get_sprite(course_pk, members, cell_size=None):
+    """
+    Returns the cached sprite of a list of members, making it if need be, as a dict with
+    its key, course_pk, content (the JPEG) and map.
+    """
+    cell_size = cell_size or settings.SPRITE_CELL_SIZE
+    key = get_sprite_key(course_pk, members, cell_size)
+    sprite = await sync_to_async(cache.get)(get_cache_key(key))
+    if sprite is not None:
+        return sprite
+
+    logger.debug("Making sprite %s of %d images" % (key, len(members)))
+    thumbnails = await fetch_thumbnails(
+        [get_thumbnail_url(member, cell_size) for member in members]
+    )
+    content, sprite_map = await sync_to_async(make_sprite, thread_sensitive=False)(
+        members, thumbnails, cell_size
+    )
+    sprite = {
+        "key": key,
+        "course_pk": course_pk,
+        "content": content,
+        "map": sprite_map,
+    }
+    if is_complete(sprite):
+        timeout = settings.SPRITE_CACHE_TIMEOUT
+    else:
+        timeout = SPRITE_INCOMPLETE_TIMEOUT
+    await sync_to_async(cache.set)(get_cache_key(key), sprite, timeout)
+    return sprite
+
+
+async def get_cached_sprite(course_pk, key, page=None, page_size=None):
+    """
+    Returns the sprite of a course with the given key, or None. If it isn't cached, it's
+    made again from the given page of the course's images, provided that they still
+    have the key.
+    """
+    sprite = await sync_to_async(cache.get)(get_cache_key(key))
+    if sprite is not None:
+        return sprite if sprite["course_pk"] == course_pk else None
+    if page is None or page_size is None:
+        return None
+    members = await database_sync_to_async(get_members)(course_pk, page, page_size)
+    if get_sprite_key(course_pk, members, settings.SPRITE_CELL_SIZE) != key:
+        return None
+    return await get_sprite(course_pk, members)
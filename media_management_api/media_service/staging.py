@@ -0,0 +1,538 @@
+"""
+Staging area for direct uploads.
+
+Rather than sending images through the API, clients can PUT them straight to a staging
+area with presigned URLs, and then finalize the upload session (see UploadSession). Only
+the metadata of the staged object and the first HEADER_SIZE bytes are needed to check
+it, and the object is then moved into the media store by the storage itself, so web
+workers never handle the contents of the file.
+
+Two backends are available, selected by UPLOAD_STAGING_BACKEND:
+    - "s3": objects are staged in the media store's S3 bucket, and promoted with a
+      server-side copy.
+    - "local": objects are staged in UPLOAD_STAGING_ROOT and uploaded through
+      StagingUploadView. This stands in for S3 in development and tests.
+
+Chunked uploads (see ChunkedUpload) are the alternative for clients that can't reach the
+storage directly or need to resume interrupted uploads. Those are sent through the API
+and assembled in UPLOAD_STAGING_ROOT whatever the backend.
+
+Background uploads (see ingest.py) are spooled to the staging area too, so that the
+ingest worker can read them on any host.
+"""
+import abc
+import base64
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+
+import boto.exception
+import magic
+from boto.s3.connection import S3Connection
+from boto.s3.key import Key
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import File
+from django.core.files.images import get_image_dimensions
+from django.db import transaction
+from django.urls import reverse
+
+from media_management_api.routers import use_primary
+
+from .mediastore import (
+    VALID_IMAGE_EXT_FOR_TYPE,
+    VALID_IMAGE_TYPES,
+    MediaStoreException,
+    getMediaStoresByHash,
+)
+from .models import MediaStore
+
+logger = logging.getLogger(__name__)
+
+AWS_ACCESS_KEY_ID = settings.AWS_ACCESS_KEY_ID
+AWS_ACCESS_SECRET_KEY = settings.AWS_ACCESS_SECRET_KEY
+AWS_S3_BUCKET = settings.AWS_S3_BUCKET
+
+# Enough to identify the type of an image and, for most images, its dimensions
+HEADER_SIZE = 64 * 1024
+
+SIGNING_SALT = "media_management_api.media_service.staging"
+
+
+class ChunkOffsetException(MediaStoreException):
+    def __init__(self, offset):
+        super().__init__("Chunk must start at offset %d." % offset)
+        self.offset = offset
+
+
+class ChunkChecksumException(MediaStoreException):
+    pass
+
+
+def md5_to_base64(md5hash):
+    """
+    Returns an MD5 hex digest in the base64 form used by the Content-MD5 header.
+    """
+    return base64.b64encode(bytes.fromhex(md5hash)).decode("ascii")
+
+
+class UploadStaging(abc.ABC):
+    """
+    Base class of the staging backends. Objects are identified by their key name (see
+    UploadSession.get_staging_keyname()).
+    """
+
+    @abc.abstractmethod
+    def get_upload(self, request, session):
+        """
+        Returns a dict with the url, method and headers of the request that uploads the
+        file of the given session.
+        """
+
+    @abc.abstractmethod
+    def put(self, key_name, f):
+        """
+        Stages the contents of a file-like object under the given key.
+        """
+
+    @abc.abstractmethod
+    def get_size(self, key_name):
+        """
+        Returns the size of the staged object, or None if it doesn't exist.
+        """
+
+    @abc.abstractmethod
+    def get_md5hash(self, key_name):
+        """
+        Returns the MD5 hash of the staged object, or None if the storage doesn't know it.
+        """
+
+    @abc.abstractmethod
+    def read(self, key_name, length):
+        """
+        Returns the first length bytes of the staged object.
+        """
+
+    @abc.abstractmethod
+    def open(self, key_name):
+        """
+        Returns a temporary file with the contents of the staged object.
+        """
+
+    @abc.abstractmethod
+    def promote(self, key_name, dest_key_name, content_type):
+        """
+        Moves the staged object to the given key in the media store's bucket.
+        """
+
+    @abc.abstractmethod
+    def delete(self, key_name):
+        """
+        Deletes the staged object, if it exists.
+        """
+
+
+class S3UploadStaging(UploadStaging):
+    def __init__(self):
+        self.connection = S3Connection(AWS_ACCESS_KEY_ID, AWS_ACCESS_SECRET_KEY)
+        self.bucket = self.connection.get_bucket(AWS_S3_BUCKET)
+
+    def get_upload(self, request, session):
+        # Both headers are signed, so S3 only accepts the file it was told about
+        headers = {
+            "Content-Type": session.file_type,
+            "Content-MD5": md5_to_base64(session.file_md5hash),
+        }
+        url = self.connection.generate_url(
+            settings.UPLOAD_URL_EXPIRES,
+            "PUT",
+            bucket=AWS_S3_BUCKET,
+            key=session.get_staging_keyname(),
+            headers=headers,
+        )
+        return {"url": url, "method": "PUT", "headers": headers}
+
+    def put(self, key_name, f):
+        try:
+            Key(self.bucket, key_name).set_contents_from_file(f, rewind=True)
+        except boto.exception.S3ResponseError as e:
+            raise MediaStoreException("S3 Response Error.  Details: %s" % str(e))
+
+    def get_key(self, key_name):
+        try:
+            return self.bucket.get_key(key_name)
+        except boto.exception.S3ResponseError as e:
+            raise MediaStoreException("S3 Response Error.  Details: %s" % str(e))
+
+    def get_size(self, key_name):
+        key = self.get_key(key_name)
+        return None if key is None else key.size
+
+    def get_md5hash(self, key_name):
+        key = self.get_key(key_name)
+        etag = key.etag.strip('"') if key is not None and key.etag else ""
+        # The ETag of an object uploaded in multiple parts isn't its MD5 hash
+        if not etag or "-" in etag:
+            return None
+        return etag
+
+    def read(self, key_name, length):
+        key = Key(self.bucket, key_name)
+        return key.get_contents_as_string(
+            headers={"Range": "bytes=0-%d" % (length - 1)}
+        )
+
+    def open(self, key_name):
+        f = tempfile.TemporaryFile()
+        Key(self.bucket, key_name).get_contents_to_file(f)
+        f.seek(0)
+        return f
+
+    def promote(self, key_name, dest_key_name, content_type):
+        logger.info("Copying staged file %s to %s" % (key_name, dest_key_name))
+        try:
+            self.bucket.copy_key(dest_key_name, AWS_S3_BUCKET, key_name)
+        except boto.exception.S3ResponseError as e:
+            raise MediaStoreException("S3 Response Error.  Details: %s" % str(e))
+        self.delete(key_name)
+
+    def delete(self, key_name):
+        self.bucket.delete_key(key_name)
+
+
+class LocalUploadStaging(UploadStaging):
+    def __init__(self, root=None):
+        self.root = root or settings.UPLOAD_STAGING_ROOT
+
+    def get_path(self, key_name):
+        return os.path.join(self.root, *key_name.split("/"))
+
+    def get_upload(self, request, session):
+        token = signing.dumps(
+            {
+                "key": session.get_staging_keyname(),
+                "md5": session.file_md5hash,
+                "size": session.file_size,
+            },
+            salt=SIGNING_SALT,
+        )
+        url = request.build_absolute_uri(
+            reverse("api:upload-staging", kwargs={"token": token})
+        )
+        headers = {"Content-Type": session.file_type}
+        return {"url": url, "method": "PUT", "headers": headers}
+
+    def load_token(self, token):
+        """
+        Returns the upload described by a token from get_upload(), or raises a
+        MediaStoreException if it is invalid or has expired.
+        """
+        try:
+            return signing.loads(
+                token, salt=SIGNING_SALT, max_age=settings.UPLOAD_URL_EXPIRES
+            )
+        except signing.BadSignature:
+            raise MediaStoreException("Invalid or expired upload URL.")
+
+    def save(self, token, stream, chunk_size=1024 * 1024):
+        """
+        Saves the upload read from a stream, checking it against the size and MD5 hash
+        it was signed for, like S3 does with Content-MD5.
+        """
+        upload = self.load_token(token)
+        path = self.get_path(upload["key"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        m = hashlib.md5()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            try:
+                for chunk in iter(lambda: stream.read(chunk_size), b""):
+                    size += len(chunk)
+                    if size > upload["size"]:
+                        raise MediaStoreException(
+                            "File is larger than %d bytes." % upload["size"]
+                        )
+                    m.update(chunk)
+                    f.write(chunk)
+                if m.hexdigest() != upload["md5"]:
+                    raise MediaStoreException(
+                        "The MD5 hash of the file does not match %s." % upload["md5"]
+                    )
+            except Exception:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+        return m.hexdigest()
+
+    def put(self, key_name, f):
+        path = self.get_path(key_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as dest:
+            shutil.copyfileobj(f, dest)
+
+    def get_size(self, key_name):
+        try:
+            return os.path.getsize(self.get_path(key_name))
+        except FileNotFoundError:
+            return None
+
+    def get_md5hash(self, key_name):
+        # Checked by save()
+        return None
+
+    def read(self, key_name, length):
+        with open(self.get_path(key_name), "rb") as f:
+            return f.read(length)
+
+    def open(self, key_name):
+        return open(self.get_path(key_name), "rb")
+
+    def promote(self, key_name, dest_key_name, content_type):
+        logger.info("Uploading staged file %s to %s" % (key_name, dest_key_name))
+        try:
+            connection = S3Connection(AWS_ACCESS_KEY_ID, AWS_ACCESS_SECRET_KEY)
+            k = Key(connection.get_bucket(AWS_S3_BUCKET))
+            k.key = dest_key_name
+            k.set_contents_from_filename(
+                self.get_path(key_name), headers={"Content-Type": content_type}
+            )
+        except boto.exception.NoAuthHandlerFound as e:
+            raise MediaStoreException("S3 Connection Error.  Details: %s" % str(e))
+        except boto.exception.S3ResponseError as e:
+            raise MediaStoreException("S3 Response Error.  Details: %s" % str(e))
+        self.delete(key_name)
+
+    def delete(self, key_name):
+        try:
+            os.unlink(self.get_path(key_name))
+        except FileNotFoundError:
+            pass
+
+
+UPLOAD_STAGING_BACKENDS = {
+    "s3": S3UploadStaging,
+    "local": LocalUploadStaging,
+}
+
+
+def get_upload_staging():
+    return UPLOAD_STAGING_BACKENDS[settings.UPLOAD_STAGING_BACKEND]()
+
+
+class StagedUpload:
+    """
+    Checks the staged file of an upload session and adds it to the media store.
+
+    The size and hash are checked against what the storage reports, and the type and
+    dimensions of the image are read from the start of the file. Only images that keep
+    their dimensions further into the file (e.g. some TIFFs) are read in full. If the
+    media store already holds the same content, the staged file is simply discarded.
+
+    Example usage:
+        media_store_instance = StagedUpload(session).finalize()
+    """
+
+    def __init__(self, session, staging=None):
+        self.session = session
+        self.staging = staging or get_upload_staging()
+        self.key_name = session.get_staging_keyname()
+
+    @use_primary()
+    def finalize(self):
+        """
+        Returns the MediaStore instance for the staged file, or raises a
+        MediaStoreException if the file is missing or invalid.
+        """
+        file_md5hash = self.validate()
+        existing = getMediaStoresByHash([file_md5hash]).get(file_md5hash)
+        if existing is not None:
+            logger.debug("instance exists")
+            self.staging.delete(self.key_name)
+            return existing
+
+        header = self.staging.read(self.key_name, HEADER_SIZE)
+        file_type = magic.from_buffer(header[:1024], mime=True)
+        if file_type not in VALID_IMAGE_TYPES:
+            raise MediaStoreException(
+                "Image type '%s' is not supported. Please ensure the image is one of the supported image types."
+                % file_type
+            )
+        width, height = self.get_image_dimensions(header)
+
+        with transaction.atomic():
+            instance = MediaStore(
+                file_name="%s.%s" % (file_md5hash, VALID_IMAGE_EXT_FOR_TYPE[file_type]),
+                file_size=self.session.file_size,
+                file_md5hash=file_md5hash,
+                file_type=file_type,
+                file_extension=VALID_IMAGE_EXT_FOR_TYPE[file_type],
+                img_width=width,
+                img_height=height,
+            )
+            instance.save()
+            self.staging.promote(self.key_name, instance.get_s3_keyname(), file_type)
+        return instance
+
+    def validate(self):
+        """
+        Checks the size and hash of the staged file, and returns its hash.
+        """
+        size = self.staging.get_size(self.key_name)
+        if size is None:
+            raise MediaStoreException("The file has not been uploaded.")
+        if size != self.session.file_size:
+            raise MediaStoreException(
+                "File size %d does not match the expected size %d."
+                % (size, self.session.file_size)
+            )
+        md5hash = self.staging.get_md5hash(self.key_name)
+        if md5hash is not None and md5hash != self.session.file_md5hash:
+            raise MediaStoreException(
+                "File hash %s does not match the expected hash %s."
+                % (md5hash, self.session.file_md5hash)
+            )
+        return self.session.file_md5hash
+
+    def get_image_dimensions(self, header):
+        width, height = get_image_dimensions(io.BytesIO(header))
+        if width is None and len(header) == HEADER_SIZE:
+            logger.debug("Reading %s in full for its dimensions" % self.key_name)
+            f = self.staging.open(self.key_name)
+            try:
+                width, height = get_image_dimensions(f)
+            finally:
+                f.close()
+        if width is None:
+            raise MediaStoreException("Image cannot be opened or identified.")
+        return width, height
+
+
+class ChunkedUpload:
+    """
+    Assembles the file of a chunked upload session from chunks sent in order, like the
+    tus protocol: each chunk is sent with the offset it starts at, and may carry a
+    checksum. Chunks are appended to a file in UPLOAD_STAGING_ROOT, which must be shared
+    by all of the hosts that serve the API. The session's offset is only advanced once a
+    chunk has been written in full, so a chunk that is cut off can simply be sent again.
+
+    Example usage:
+        offset = ChunkedUpload(session).append(offset, request, checksum)
+    """
+
+    CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256")
+
+    def __init__(self, session):
+        self.session = session
+
+    def get_path(self):
+        return os.path.join(
+            settings.UPLOAD_STAGING_ROOT, "chunks", str(self.session.pk)
+        )
+
+    def parse_checksum(self, checksum):
+        """
+        Returns the algorithm and digest of an "Upload-Checksum: <algorithm> <base64>"
+        header, or None if there is no checksum.
+        """
+        if not checksum:
+            return None
+        try:
+            algorithm, digest = checksum.split(" ", 1)
+            digest = base64.b64decode(digest, validate=True)
+        except ValueError:
+            raise MediaStoreException("Invalid checksum: %s" % checksum)
+        if algorithm not in self.CHECKSUM_ALGORITHMS:
+            raise MediaStoreException(
+                "Checksum algorithm '%s' is not supported." % algorithm
+            )
+        return algorithm, digest
+
+    def append(self, offset, stream, checksum=None, chunk_size=1024 * 1024):
+        """
+        Appends the chunk read from stream at the given offset, and returns the new
+        offset. Raises a ChunkOffsetException if the offset isn't where the upload left
+        off, or a ChunkChecksumException if the chunk doesn't match its checksum.
+        """
+        checksum = self.parse_checksum(checksum)
+        path = self.get_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if offset != self.session.offset:
+            raise ChunkOffsetException(self.session.offset)
+
+        # Receive the chunk before taking the lock, since it may take a while
+        h = hashlib.new(checksum[0]) if checksum else None
+        size = 0
+        with tempfile.TemporaryFile(dir=os.path.dirname(path)) as chunk:
+            for data in iter(lambda: stream.read(chunk_size), b""):
+                size += len(data)
+                if size > settings.UPLOAD_CHUNK_MAX_SIZE:
+                    raise MediaStoreException(
+                        "Chunk is larger than %d bytes."
+                        % settings.UPLOAD_CHUNK_MAX_SIZE
+                    )
+                if offset + size > self.session.file_size:
+                    raise MediaStoreException(
+                        "Chunk extends past the end of the file (%d bytes)."
+                        % self.session.file_size
+                    )
+                if h:
+                    h.update(data)
+                chunk.write(data)
+            if checksum and h.digest() != checksum[1]:
+                raise ChunkChecksumException(
+                    "Chunk does not match its %s checksum." % checksum[0]
+                )
+
+            with transaction.atomic():
+                session = (
+                    type(self.session)
+                    .objects.select_for_update()
+                    .get(pk=self.session.pk)
+                )
+                if offset != session.offset:
+                    raise ChunkOffsetException(session.offset)
+                chunk.seek(0)
+                with open(path, "ab") as f:
+                    # Drop anything left over from a chunk that was cut off
+                    f.truncate(offset)
+                    for data in iter(lambda: chunk.read(chunk_size), b""):
+                        f.write(data)
+                session.offset = offset + size
+                session.save(update_fields=["offset", "updated"])
+        self.session.offset = session.offset
+        return session.offset
+
+    def is_complete(self):
+        return self.session.offset == self.session.file_size
+
+    def open(self):
+        """
+        Returns the assembled file, checked against the session's MD5 hash.
+        """
+        if not self.is_complete():
+            raise MediaStoreException(
+                "The file has not been uploaded (%d of %d bytes)."
+                % (self.session.offset, self.session.file_size)
+            )
+        f = open(self.get_path(), "rb")
+        m = hashlib.md5()
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            m.update(data)
+        if m.hexdigest() != self.session.file_md5hash:
+            f.close()
+            raise MediaStoreException(
+                "The MD5 hash of the file does not match %s."
+                % self.session.file_md5hash
+            )
+        f.seek(0)
+        return File(f, name=self.session.file_name)
+
+    def delete(self):
+        try:
+            os.unlink(self.get_path())
+        except FileNotFoundError:
+            pass
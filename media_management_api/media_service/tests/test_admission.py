@@ -0,0 +1,95 @@
+import mock
+import redis
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from .. import admission
+from .test_views import BaseApiTestCase
+
+ADMISSION_CONTROL = {
+    "iiif_collections": {
+        "rate": 1,
+        "burst": 1,
+        "concurrency": 1,
+        "statement_timeout": 1000,
+    },
+}
+
+
+@override_settings(ADMISSION_CONTROL_ENABLED=True, ADMISSION_CONTROL=ADMISSION_CONTROL)
+class TestAdmissionControl(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.client.force_authenticate(self._create_test_superuser())
+        self.url = reverse("api:iiif:collections")
+
+    @mock.patch.object(admission.TokenBucket, "take", return_value=2.5)
+    def test_rate_limited(self, take):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertIsNone(admission.get_statement_timeout())
+
+    @mock.patch.object(admission.ConcurrencyLimiter, "acquire", return_value=None)
+    @mock.patch.object(admission.TokenBucket, "take", return_value=0)
+    def test_concurrency_limited(self, take, acquire):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", response)
+
+    @mock.patch.object(admission.ConcurrencyLimiter, "release")
+    @mock.patch.object(admission.ConcurrencyLimiter, "acquire", return_value="slot")
+    @mock.patch.object(admission.TokenBucket, "take", return_value=0)
+    def test_admitted(self, take, acquire, release):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        release.assert_called_once_with("slot")
+        self.assertIsNone(admission.get_statement_timeout())
+
+    @mock.patch.object(
+        admission, "get_redis", side_effect=redis.ConnectionError("Connection refused")
+    )
+    def test_admitted_without_redis(self, get_redis):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(ADMISSION_CONTROL_ENABLED=False)
+    @mock.patch.object(admission.TokenBucket, "take")
+    def test_disabled(self, take):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        take.assert_not_called()
+
+
+class TestStatementTimeout(SimpleTestCase):
+    def setUp(self):
+        self.connection = mock.Mock(current_statement_timeout=None)
+        self.cursor = mock.Mock()
+        self.context = {"connection": self.connection, "cursor": self.cursor}
+        self.execute = mock.Mock()
+
+    def run_query(self):
+        admission.statement_timeout_wrapper(
+            self.execute, "SELECT 1", None, False, self.context
+        )
+        self.execute.assert_called_with("SELECT 1", None, False, self.context)
+
+    def test_timeout_set_once(self):
+        with admission.statement_timeout(1000):
+            self.run_query()
+            self.run_query()
+        self.cursor.cursor.execute.assert_called_once_with(
+            "SET statement_timeout = %s", [1000]
+        )
+
+        self.cursor.cursor.execute.reset_mock()
+        self.run_query()
+        self.cursor.cursor.execute.assert_called_once_with(
+            "SET statement_timeout TO DEFAULT"
+        )
+
+    def test_no_timeout(self):
+        self.run_query()
+        self.cursor.cursor.execute.assert_not_called()
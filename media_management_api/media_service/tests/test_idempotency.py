@@ -0,0 +1,153 @@
+import io
+
+import mock
+from asgiref.sync import sync_to_async
+from django.core.files.base import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.test.client import encode_multipart
+from django.urls import reverse
+from rest_framework import status
+
+from .. import admission, idempotency, mediastore
+from ..models import IdempotencyKey, Resource
+from .test_mediastore import TEST_FILES
+from .test_views import BaseApiTestCase
+
+
+class TestIdempotencyKeys(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.superuser = self._create_test_superuser()
+        self.client.force_authenticate(self.superuser)
+        self.url = reverse("api:course-images", kwargs={"pk": 1})
+        self.items = [{"url": "http://example.com/test.png", "title": "Remote"}]
+        self.fetched = []
+
+        async def fetch(url, client, cache_entry=None):
+            self.fetched.append(url)
+            return File(io.BytesIO(TEST_FILES["test.png"]["content"]), name="test.png")
+
+        patchers = [
+            mock.patch.object(mediastore, "fetchRemoteImageAsync", new=fetch),
+            mock.patch.object(mediastore.MediaStoreUpload, "saveToBucket"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, data, key="import-1"):
+        return self.client.post(self.url, data, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_is_replayed(self):
+        response = self.post({"items": self.items})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", response)
+
+        retry = self.post({"items": self.items})
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.data, response.data)
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual(Resource.objects.filter(title="Remote").count(), 1)
+
+        # Another key does the work again
+        response = self.post({"items": self.items}, key="import-2")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Resource.objects.filter(title="Remote").count(), 2)
+
+    @override_settings(
+        ADMISSION_CONTROL_ENABLED=True,
+        ADMISSION_CONTROL={"ingest": {"rate": 1, "burst": 1, "concurrency": 1}},
+    )
+    @mock.patch.object(admission.ConcurrencyLimiter, "release")
+    @mock.patch.object(admission.ConcurrencyLimiter, "acquire", return_value="slot")
+    @mock.patch.object(admission.TokenBucket, "take", return_value=0)
+    def test_replay_is_not_admitted(self, take, acquire, release):
+        response = self.post({"items": self.items})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((take.call_count, acquire.call_count), (1, 1))
+        release.assert_called_once_with("slot")
+
+        # The bucket is empty, but the retry neither takes a token nor a slot
+        take.return_value = 2.5
+        retry = self.post({"items": self.items})
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual((take.call_count, acquire.call_count), (1, 1))
+
+        # Another key is admitted as usual
+        response = self.post({"items": self.items}, key="import-2")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertFalse(IdempotencyKey.objects.filter(key="import-2").exists())
+
+    def test_key_reused_for_different_request(self):
+        self.post({"items": self.items})
+        response = self.post({"items": self.items + self.items})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(len(self.fetched), 1)
+
+    def post_upload(self, content, boundary):
+        upload = SimpleUploadedFile("test.png", content, content_type="image/png")
+        return self.client.post(
+            self.url,
+            encode_multipart(boundary, {"file": upload, "title": "Upload"}),
+            content_type="multipart/form-data; boundary=%s" % boundary,
+            HTTP_IDEMPOTENCY_KEY="upload-1",
+        )
+
+    def test_upload_retry_with_new_boundary(self):
+        content = TEST_FILES["test.png"]["content"]
+        response = self.post_upload(content, "boundary-1")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Clients pick a new multipart boundary for each request
+        retry = self.post_upload(content, "boundary-2")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.data, response.data)
+
+        # A different file is a different request
+        response = self.post_upload(content + b"\0", "boundary-3")
+        self.assertEqual(response.status_code, 422)
+
+    @override_settings(IDEMPOTENCY_WAIT=0)
+    def test_request_in_progress(self):
+        self.post({"items": self.items})
+        IdempotencyKey.objects.update(state=IdempotencyKey.STATE_PENDING)
+        response = self.post({"items": self.items})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(len(self.fetched), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT=30)
+    def test_waits_on_event_loop(self):
+        response = self.post({"items": self.items})
+        IdempotencyKey.objects.update(state=IdempotencyKey.STATE_PENDING)
+
+        async def sleep(seconds):
+            # The first request completes while the retry waits
+            await sync_to_async(IdempotencyKey.objects.update)(
+                state=IdempotencyKey.STATE_COMPLETED
+            )
+
+        with mock.patch.object(
+            idempotency.asyncio, "sleep", new=sleep
+        ), mock.patch.object(idempotency.time, "sleep", side_effect=AssertionError):
+            retry = self.post({"items": self.items})
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.data, response.data)
+
+    def test_server_error_releases_key(self):
+        response = self.post({"items": []})
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_without_key(self):
+        for i in range(2):
+            response = self.client.post(self.url, {"items": self.items}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.fetched), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
@@ -3,9 +3,9 @@ import unittest
 from django.test import RequestFactory, TestCase
 from django.urls import reverse
 
-from media_management_api.media_service.iiif.objects import IIIFManifest
+from media_management_api.media_service.iiif.objects import IIIFImageInfo, IIIFManifest
 from media_management_api.media_service.iiif.views import IiifManifestView
-from media_management_api.media_service.models import Collection
+from media_management_api.media_service.models import Collection, MediaStore
 
 
 class IiifManifestViewTest(TestCase):
@@ -33,6 +33,68 @@ class IiifManifestViewTest(TestCase):
         self.assertEqual(response.data["@type"], "sc:Manifest")
 
 
+class IiifImageInfoViewTest(TestCase):
+    def test_image_info(self):
+        media_store = MediaStore.objects.create(
+            file_name="test.jpg",
+            file_size=1000,
+            file_md5hash="0" * 32,
+            img_width=3000,
+            img_height=1000,
+        )
+        url = reverse("api:iiif:image-info", kwargs={"pk": media_store.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("max-age=", response["Cache-Control"])
+        self.assertEqual(response.data["@id"], media_store.get_iiif_base_url())
+        self.assertEqual(response.data["width"], 3000)
+        self.assertEqual(response.data["height"], 1000)
+
+        url = reverse("api:iiif:image-info", kwargs={"pk": media_store.pk + 1})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class IIIFImageInfoTest(unittest.TestCase):
+    def test_info(self):
+        base_url = "http://localhost:8000/loris/foo.jpg"
+        info = IIIFImageInfo(base_url, 3000, 1001, tile_size=512).to_dict()
+        self.assertEqual(info["@id"], base_url)
+        self.assertEqual(info["@context"], "http://iiif.io/api/image/2/context.json")
+        self.assertEqual(info["tiles"], [{"width": 512, "scaleFactors": [1, 2, 4, 8]}])
+        self.assertEqual(
+            info["sizes"],
+            [
+                {"width": 375, "height": 126},
+                {"width": 750, "height": 251},
+                {"width": 1500, "height": 501},
+                {"width": 3000, "height": 1001},
+            ],
+        )
+
+    def test_info_with_sizes(self):
+        base_url = "http://localhost:8000/loris/foo.jpg"
+        sizes = [{"width": 200, "height": 100, "url": base_url + "/full/!200,200/0"}]
+        info = IIIFImageInfo(base_url, 2000, 1000, tile_size=512, sizes=sizes)
+        self.assertEqual(
+            info.to_dict()["sizes"],
+            [{"width": 200, "height": 100}, {"width": 2000, "height": 1000}],
+        )
+
+    def test_info_with_no_sizes(self):
+        base_url = "http://localhost:8000/loris/foo.jpg"
+        info = IIIFImageInfo(base_url, 3000, 1001, tile_size=512, sizes=[])
+        self.assertEqual(
+            info.to_dict()["sizes"],
+            IIIFImageInfo(base_url, 3000, 1001, tile_size=512).to_dict()["sizes"],
+        )
+
+    def test_small_image(self):
+        base_url = "http://localhost:8000/loris/foo.jpg"
+        info = IIIFImageInfo(base_url, 24, 24, tile_size=512).to_dict()
+        self.assertEqual(info["tiles"], [{"width": 512, "scaleFactors": [1]}])
+        self.assertEqual(info["sizes"], [{"width": 24, "height": 24}])
+
+
 class IIIFManifestTest(unittest.TestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -142,6 +204,25 @@ class IIIFManifestTest(unittest.TestCase):
             self.assertTrue(key in md, "manifest should have a %s attribute" % key)
             self.assertEqual(md[key], expected_attr[key])
 
+    def test_manifest_embeds_image_info(self):
+        images = self.get_images_list()
+        images[0].update({"width": 2000, "height": 1000})
+        request = self.factory.get(
+            reverse("api:iiif:manifest", kwargs={"manifest_id": 1})
+        )
+        md = self.create_manifest(request, 1, images=images).to_dict()
+        canvases = md["sequences"][0]["canvases"]
+
+        service = canvases[0]["images"][0]["resource"]["service"]
+        self.assertEqual(service["@id"], images[0]["url"])
+        self.assertEqual((service["width"], service["height"]), (2000, 1000))
+        self.assertIn("tiles", service)
+
+        # Without dimensions, viewers have to fetch the image information
+        service = canvases[1]["images"][0]["resource"]["service"]
+        self.assertEqual(service["@id"], images[1]["url"])
+        self.assertNotIn("tiles", service)
+
     def test_manifest_has_unique_canvas_ids(self):
         # create a new list of images with duplicates of first and last image
         images = self.get_images_list()
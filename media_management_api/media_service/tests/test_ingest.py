@@ -0,0 +1,166 @@
+import io
+import tempfile
+import zipfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from mock import patch
+from rest_framework import status
+
+from .. import mediastore
+from ..ingest import IngestRunner, claim_job
+from ..mediastore import MediaStoreUpload
+from ..models import ImageProjection, IngestJob, IngestJobItem
+from ..staging import LocalUploadStaging
+from .test_mediastore import TEST_FILES
+from .test_views import BaseApiTestCase
+
+
+class TestIngestJobs(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.client.force_authenticate(self._create_test_superuser())
+        self.staging_root = tempfile.TemporaryDirectory()
+        self.staging_settings = override_settings(
+            UPLOAD_STAGING_ROOT=self.staging_root.name
+        )
+        self.staging_settings.enable()
+        self.url = reverse("api:course-images", kwargs={"pk": 1})
+        self.content = TEST_FILES["test.png"]["content"]
+
+    def tearDown(self):
+        self.staging_settings.disable()
+        self.staging_root.cleanup()
+
+    def make_zip(self, files):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zip:
+            for name, content in files.items():
+                zip.writestr(name, content)
+        return SimpleUploadedFile("images.zip", buf.getvalue(), "application/zip")
+
+    def upload(self, files):
+        return self.client.post(
+            self.url, {"file": files}, format="multipart", HTTP_PREFER="respond-async"
+        )
+
+    def run_worker(self):
+        with patch.object(MediaStoreUpload, "saveToBucket", return_value=True):
+            call_command(
+                "ingest_worker",
+                once=True,
+                batch_size=2,
+                analysis_processes=0,
+                stdout=io.StringIO(),
+            )
+        self.addCleanup(mediastore.setAnalysisProcesses, None)
+
+    def test_upload_in_background(self):
+        files = [
+            self.make_zip(
+                {
+                    "a.png": self.content,
+                    "b.png": self.content,
+                    "__MACOSX/._a.png": b"resource fork",
+                    "notes.txt": b"not an image",
+                }
+            ),
+            SimpleUploadedFile("c.png", self.content, "image/png"),
+        ]
+        response = self.upload(files)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response["Location"], response.data["url"])
+        self.assertEqual(response.data["state"], IngestJob.STATE_QUEUED)
+        self.assertEqual(
+            [item["file_name"] for item in response.data["items"]],
+            ["a.png", "b.png", "notes.txt", "c.png"],
+        )
+        self.assertEqual(response.data["counts"]["pending"], 4)
+        job = IngestJob.objects.get(pk=response.data["id"])
+        self.assertFalse(ImageProjection.objects.filter(title="a.png").exists())
+
+        self.run_worker()
+
+        response = self.client.get(response["Location"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["state"], IngestJob.STATE_COMPLETED)
+        self.assertEqual(
+            response.data["counts"],
+            {"pending": 0, "completed": 3, "error": 1, "total": 4},
+        )
+        items = response.data["items"]
+        self.assertEqual(items[2]["state"], IngestJobItem.STATE_ERROR)
+        self.assertIn("not supported", items[2]["error"])
+
+        # The images were added to the end of the course, in the order of the upload
+        images = self.client.get(self.url).data
+        self.assertEqual(
+            [image["title"] for image in images[-3:]], ["a.png", "b.png", "c.png"]
+        )
+        self.assertEqual(
+            [image["id"] for image in images[-3:]],
+            [items[0]["resource_id"], items[1]["resource_id"], items[3]["resource_id"]],
+        )
+        media_store = job.items.get(index=0).resource.media_store
+        self.assertEqual(media_store.reference_count, 3)
+        # The spooled files are deleted from the staging area
+        staging = LocalUploadStaging()
+        for item in job.items.all():
+            self.assertIsNone(staging.get_size(item.get_staging_keyname()))
+
+    def test_upload_without_preference(self):
+        with patch.object(MediaStoreUpload, "saveToBucket", return_value=True):
+            response = self.client.post(
+                self.url,
+                {
+                    "file": SimpleUploadedFile("c.png", self.content, "image/png"),
+                    "title": "c.png",
+                },
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(IngestJob.objects.exists())
+
+    def test_empty_zip(self):
+        response = self.upload([self.make_zip({"__MACOSX/._a.png": b""})])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IngestJob.objects.exists())
+
+    def test_spooling_job_is_not_claimed(self):
+        job = IngestJob.objects.create(course_id=1, state=IngestJob.STATE_SPOOLING)
+        self.assertIsNone(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.state, IngestJob.STATE_SPOOLING)
+
+    def test_unexpected_error_is_recorded_per_item(self):
+        files = [
+            SimpleUploadedFile(name, self.content, "image/png")
+            for name in ("a.png", "b.png", "c.png")
+        ]
+        job = IngestJob.objects.get(pk=self.upload(files).data["id"])
+        store = IngestRunner.store
+
+        def store_or_fail(runner, item, f, analysis):
+            if item.file_name == "b.png":
+                raise OSError("No space left on device")
+            return store(runner, item, f, analysis)
+
+        with patch.object(IngestRunner, "store", new=store_or_fail):
+            self.run_worker()
+
+        job.refresh_from_db()
+        self.assertEqual(job.state, IngestJob.STATE_COMPLETED)
+        items = list(job.items.order_by("index"))
+        self.assertEqual(
+            [item.state for item in items],
+            [
+                IngestJobItem.STATE_COMPLETED,
+                IngestJobItem.STATE_ERROR,
+                IngestJobItem.STATE_COMPLETED,
+            ],
+        )
+        self.assertEqual(items[1].error, "No space left on device")
+        self.assertEqual(items[0].resource.media_store.reference_count, 2)
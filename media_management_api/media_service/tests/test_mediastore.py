@@ -1,14 +1,26 @@
+import asyncio
 import base64
+import io
+import itertools
 import re
 import tempfile
+import time
 import unittest
 
+import httpx
+from asgiref.sync import async_to_sync
+from django.core.files.base import File
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
 from mock import MagicMock, patch
+from PIL import Image, features
 
 from .. import mediastore
+from ..analysis import getImagePlaceholder, getResolutionCount, makePyramidalImage
 from ..mediastore import MediaStoreException, MediaStoreUpload
-from ..models import MediaStore
+from ..models import Course, ImageProjection, MediaStore, RemoteFetchCache, Resource
 
 TEST_FILES = {
     "test.png": {
@@ -295,6 +307,428 @@ class TestUrlImport(unittest.TestCase):
             else:
                 self.assertEqual(processed[url]["data"]["description"], "")
 
+    @patch("requests.get")
+    def testFetchRemoteImageSizeLimitWhileStreaming(self, mock_get):
+        response = MagicMock(status_code=200, headers={"content-type": "image/jpeg"})
+        response.iter_content.return_value = itertools.repeat(b"x" * 1024)
+        mock_get.return_value = response
+        with patch.object(mediastore, "REMOTE_IMAGE_MAX_SIZE", 10 * 1024):
+            with self.assertRaises(MediaStoreException):
+                mediastore.fetchRemoteImage("http://example.com/logo.jpg")
+        self.assertEqual(mock_get.call_args[1]["timeout"], (5, 15))
+        response.close.assert_called_once_with()
+
+    @patch("requests.get")
+    def testFetchRemoteImagePastDeadline(self, mock_get):
+        with self.assertRaises(MediaStoreException):
+            mediastore.fetchRemoteImage(
+                "http://example.com/logo.jpg", deadline=time.monotonic() - 1
+            )
+        mock_get.assert_not_called()
+
+
+class TestAsyncUrlImport(unittest.TestCase):
+    def mockClient(self, headers, content=b"image data"):
+        def handler(request):
+            return httpx.Response(200, headers=headers, content=content)
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def fetch(self, client, url="http://example.com/logo.jpg"):
+        async def fetch():
+            async with client:
+                return await mediastore.fetchRemoteImageAsync(url, client)
+
+        return async_to_sync(fetch)()
+
+    def testFetchRemoteImage(self):
+        client = self.mockClient({"content-type": "image/jpeg"})
+        f = self.fetch(client)
+        f.seek(0)
+        self.assertEqual(f.read(), b"image data")
+
+    def testFetchRemoteImageInvalidContentType(self):
+        client = self.mockClient({"content-type": "text/html"})
+        with self.assertRaises(MediaStoreException):
+            self.fetch(client)
+
+    def testFetchRemoteImageTooLarge(self):
+        size = mediastore.REMOTE_IMAGE_MAX_SIZE + 1
+        client = self.mockClient({"content-type": "image/jpeg"}, b"x" * size)
+        with self.assertRaises(MediaStoreException):
+            self.fetch(client)
+
+    def testFetchRemoteImageTooLargeWithoutContentLength(self):
+        async def stream():
+            while True:
+                yield b"x" * 1024
+
+        def handler(request):
+            return httpx.Response(
+                200, headers={"content-type": "image/jpeg"}, content=stream()
+            )
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with patch.object(mediastore, "REMOTE_IMAGE_MAX_SIZE", 10 * 1024):
+            with self.assertRaises(MediaStoreException):
+                self.fetch(client)
+
+    def testProcessRemoteImagesDeadline(self):
+        cancelled = []
+
+        async def mock_fetch(url, client, cache_entry=None):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(url)
+                raise
+
+        items = [
+            {"url": "http://example.com/logo.jpg"},
+            {"url": "http://example.com/logo2.png"},
+        ]
+        with patch.object(mediastore, "fetchRemoteImageAsync", new=mock_fetch):
+            with patch.object(mediastore, "REMOTE_IMAGE_DEADLINE", 0.01):
+                with self.assertRaises(MediaStoreException):
+                    async_to_sync(mediastore.processRemoteImagesAsync)(items)
+        self.assertEqual(sorted(cancelled), sorted(item["url"] for item in items))
+
+    def testFetchRemoteImageNotModified(self):
+        cache_entry = RemoteFetchCache(etag='"v1"', media_store=MediaStore(pk=1))
+
+        def handler(request):
+            if request.headers.get("if-none-match") == '"v1"':
+                return httpx.Response(304, headers={"etag": '"v1"'})
+            return httpx.Response(
+                200,
+                headers={"content-type": "image/jpeg", "etag": '"v2"'},
+                content=b"x",
+            )
+
+        url = "http://example.com/logo.jpg"
+
+        async def fetch(entry):
+            transport = httpx.MockTransport(handler)
+            async with httpx.AsyncClient(transport=transport) as client:
+                return await mediastore.fetchRemoteImageAsync(url, client, entry)
+
+        self.assertIsNone(async_to_sync(fetch)(cache_entry))
+
+        # A changed image is downloaded, and its new validators are returned
+        cache_entry.etag = '"v0"'
+        f = async_to_sync(fetch)(cache_entry)
+        self.assertEqual(f.cache_validators["etag"], '"v2"')
+
+        # Servers that ignore conditional requests are revalidated with the validators
+        cache_entry.etag = '"v2"'
+        self.assertIsNone(async_to_sync(fetch)(cache_entry))
+
+    def testProcessRemoteImages(self):
+        temp_image_file = tempfile.NamedTemporaryFile(mode="r")
+        fetched = []
+
+        async def mock_fetch(url, client, cache_entry=None):
+            fetched.append(url)
+            return File(temp_image_file)
+
+        items = [
+            {"url": "http://example.com/logo.jpg", "title": "Logo"},
+            {"url": "http://example.com/logo2.png"},
+        ]
+        with patch(
+            "media_management_api.media_service.mediastore.fetchRemoteImageAsync",
+            new=mock_fetch,
+        ):
+            processed = async_to_sync(mediastore.processRemoteImagesAsync)(items)
+        self.assertEqual(sorted(fetched), sorted(item["url"] for item in items))
+        self.assertEqual(processed[items[0]["url"]]["data"]["title"], "Logo")
+        self.assertEqual(processed[items[1]["url"]]["data"]["title"], "Untitled")
+
+        with self.assertRaises(MediaStoreException):
+            async_to_sync(mediastore.processRemoteImagesAsync)([{"title": "No URL"}])
+
+
+class TestImageAnalysis(unittest.TestCase):
+    def createUploadedFile(self):
+        return SimpleUploadedFile(
+            "test.png", TEST_FILES["test.png"]["content"], "image/png"
+        )
+
+    def testAnalysisMatchesUpload(self):
+        uploaded_file = self.createUploadedFile()
+        analysis = mediastore.analyzeImages([uploaded_file])[0]
+        self.assertIsNone(analysis["open_error"])
+
+        upload = MediaStoreUpload(self.createUploadedFile())
+        analyzed_upload = MediaStoreUpload(uploaded_file, analysis=analysis)
+        self.assertEqual(analyzed_upload.getFileType(), upload.getFileType())
+        self.assertEqual(analyzed_upload.getFileExtension(), "png")
+        self.assertEqual(analyzed_upload.getFileSize(), upload.getFileSize())
+        self.assertEqual(analyzed_upload.getFileHash(), upload.getFileHash())
+        self.assertEqual(
+            analyzed_upload.getImageDimensions(), upload.getImageDimensions()
+        )
+        self.assertTrue(analyzed_upload.isValid())
+
+    def testAnalysisOfInvalidImage(self):
+        f = SimpleUploadedFile("test.jpg", b"not an image", "image/jpeg")
+        analysis = mediastore.analyzeImages([f])[0]
+        self.assertIsNotNone(analysis["open_error"])
+        media_store_upload = MediaStoreUpload(f, analysis=analysis)
+        media_store_upload.raise_for_error()
+        with self.assertRaises(MediaStoreException):
+            media_store_upload.validateImageOpens()
+
+    def testAnalyzeImagesInProcessPool(self):
+        content = TEST_FILES["test.png"]["content"]
+        with tempfile.NamedTemporaryFile(suffix=".png") as on_disk:
+            on_disk.write(content)
+            on_disk.flush()
+            files = [
+                self.createUploadedFile(),
+                File(open(on_disk.name, "rb"), name="on_disk.png"),
+            ]
+            self.assertEqual(
+                mediastore.getAnalysisArgs(files[1]),
+                {"path": on_disk.name, "file_name": "on_disk.png"},
+            )
+            with override_settings(IMAGE_ANALYSIS_PROCESSES=2):
+                self.addCleanup(mediastore.shutdownAnalysisExecutor)
+                analyses = mediastore.analyzeImages(files)
+            files[1].close()
+        self.assertEqual(len(analyses), 2)
+        for analysis in analyses:
+            self.assertEqual(analysis["file_type"], "image/png")
+            self.assertEqual((analysis["img_width"], analysis["img_height"]), (24, 24))
+            self.assertEqual(analysis["file_size"], len(content))
+
+    def testSetAnalysisProcesses(self):
+        self.addCleanup(mediastore.setAnalysisProcesses, None)
+        self.assertIsNone(mediastore.getAnalysisExecutor())
+        mediastore.setAnalysisProcesses(2)
+        self.assertIsNotNone(mediastore.getAnalysisExecutor())
+        with override_settings(IMAGE_ANALYSIS_PROCESSES=2):
+            mediastore.setAnalysisProcesses(0)
+            self.assertIsNone(mediastore.getAnalysisExecutor())
+
+
+class TestImagePlaceholders(TestCase):
+    def createUploadedFile(self, color, size=(60, 40), name="test.png"):
+        content = io.BytesIO()
+        Image.new("RGB", size, color).save(content, "PNG")
+        return SimpleUploadedFile(name, content.getvalue(), "image/png")
+
+    def testPlaceholder(self):
+        blurhash, dominant_color = getImagePlaceholder(
+            Image.new("RGB", (60, 40), "red")
+        )
+        # 4x3 components: size flag, maximum AC value, DC (4) and 11 AC values (2 each)
+        self.assertEqual(len(blurhash), 28)
+        self.assertEqual(blurhash[0], "L")
+        self.assertEqual(dominant_color, "#ff0000")
+
+        blurhash, dominant_color = getImagePlaceholder(
+            Image.new("RGBA", (40, 60), (0, 0, 255, 0))
+        )
+        # 3x4 components for portrait images, and transparent areas are white
+        self.assertEqual(blurhash[0], "T")
+        self.assertEqual(dominant_color, "#ffffff")
+
+    def testPlaceholderSavedWithUpload(self):
+        uploaded_file = self.createUploadedFile("blue")
+        analysis = mediastore.analyzeImages([uploaded_file])[0]
+        self.assertEqual(analysis["dominant_color"], "#0000ff")
+        self.assertEqual(
+            MediaStoreUpload(self.createUploadedFile("blue")).getPlaceholder(),
+            (analysis["placeholder"], analysis["dominant_color"]),
+        )
+
+        media_store_upload = MediaStoreUpload(uploaded_file, analysis=analysis)
+        media_store_upload.saveToBucket = MagicMock(return_value=True)
+        media_store = media_store_upload.save()
+        self.assertEqual(media_store.placeholder, analysis["placeholder"])
+        self.assertEqual(media_store.dominant_color, "#0000ff")
+
+        course = Course.objects.create(title="Placeholders")
+        resource = Resource.objects.create(
+            course=course, title="Blue", media_store=media_store
+        )
+        representation = ImageProjection.objects.get(
+            resource=resource
+        ).get_representation()
+        self.assertEqual(representation["placeholder"], analysis["placeholder"])
+        self.assertEqual(representation["dominant_color"], "#0000ff")
+
+    def testGenerateCommand(self):
+        f = self.createUploadedFile("green")
+        with patch.object(
+            MediaStoreUpload, "getPlaceholder", return_value=(None, None)
+        ):
+            media_store_upload = MediaStoreUpload(f)
+            media_store_upload.saveToBucket = MagicMock(return_value=True)
+            media_store = media_store_upload.save()
+        self.assertEqual(media_store.placeholder, "")
+        course = Course.objects.create(title="Placeholders")
+        resource = Resource.objects.create(
+            course=course, title="Green", media_store=media_store
+        )
+
+        def load(key_name, path):
+            self.assertEqual(key_name, media_store.get_s3_keyname())
+            with open(path, "wb") as dest:
+                f.seek(0)
+                dest.write(f.read())
+
+        with patch.object(mediastore, "loadFileFromBucket", side_effect=load):
+            call_command(
+                "generate_image_placeholders",
+                analysis_processes=0,
+                stdout=io.StringIO(),
+            )
+        self.addCleanup(mediastore.setAnalysisProcesses, None)
+        media_store.refresh_from_db()
+        self.assertTrue(media_store.placeholder)
+        self.assertEqual(media_store.dominant_color, "#008000")
+        projection = ImageProjection.objects.get(resource=resource)
+        self.assertEqual(projection.placeholder, media_store.placeholder)
+
+
+@override_settings(IIIF_DERIVATIVE_MIN_SIZE=1000, IIIF_DERIVATIVE_TILE_SIZE=256)
+@unittest.skipUnless(
+    features.check("jpg_2000"), "Pillow was built without JPEG2000 support"
+)
+class TestIiifDerivatives(TestCase):
+    def createUploadedFile(self, size, name="large.png"):
+        content = io.BytesIO()
+        Image.new("RGB", size).save(content, "PNG")
+        return SimpleUploadedFile(name, content.getvalue(), "image/png")
+
+    def save(self, uploaded_file, save_derivative=True):
+        media_store_upload = MediaStoreUpload(
+            uploaded_file, save_derivative=save_derivative
+        )
+        media_store_upload.saveToBucket = MagicMock(return_value=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            return media_store_upload.save()
+
+    def testResolutionCount(self):
+        self.assertEqual(getResolutionCount(200, 100, 256), 1)
+        self.assertEqual(getResolutionCount(1000, 3000, 256), 5)
+        self.assertEqual(getResolutionCount(10**6, 10, 256), 9)
+
+    def testMakePyramidalImage(self):
+        f = self.createUploadedFile((1200, 500))
+        with tempfile.NamedTemporaryFile(suffix=".jp2") as dest:
+            levels = makePyramidalImage(
+                dest.name, 256, content=f.read(), file_name=f.name
+            )
+            self.assertEqual(levels, 4)
+            with Image.open(dest.name) as im:
+                self.assertEqual(im.format, "JPEG2000")
+                self.assertEqual(im.size, (1200, 500))
+                # Reduced sizes are decoded from the lower resolutions
+                im.reduce = 3
+                im.load()
+                self.assertEqual(im.size, (150, 63))
+
+    @patch.object(mediastore, "saveFileToBucket")
+    def testSaveLargeImage(self, saveFileToBucket):
+        media_store = self.save(self.createUploadedFile((1200, 500)))
+        media_store.refresh_from_db()
+        self.assertEqual(
+            media_store.derivative_file_name, "%s.jp2" % media_store.file_md5hash
+        )
+        key_name, path, content_type = saveFileToBucket.call_args[0]
+        self.assertEqual(key_name, media_store.get_derivative_s3_keyname())
+        self.assertIn("/images/%d/derivatives/" % media_store.pk, key_name)
+        self.assertEqual(content_type, "image/jp2")
+        self.assertIn(
+            "derivatives%2F" + media_store.derivative_file_name,
+            media_store.get_iiif_base_url(),
+        )
+        self.assertIn("derivatives%2F", media_store.get_iiif_full_url()["url"])
+
+    @patch.object(mediastore, "saveFileToBucket")
+    def testSaveLargeImageAfterCommit(self, saveFileToBucket):
+        media_store_upload = MediaStoreUpload(
+            self.createUploadedFile((1200, 500)), save_derivative=True
+        )
+        media_store_upload.saveToBucket = MagicMock(return_value=True)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                media_store = media_store_upload.save()
+            saveFileToBucket.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(
+            media_store.derivative_file_name, "%s.jp2" % media_store.file_md5hash
+        )
+
+    @patch.object(mediastore, "saveFileToBucket")
+    def testSaveLargeImageInRequest(self, saveFileToBucket):
+        # Left to generate_iiif_derivatives
+        media_store = self.save(
+            self.createUploadedFile((1200, 500)), save_derivative=False
+        )
+        self.assertEqual(media_store.derivative_file_name, "")
+        saveFileToBucket.assert_not_called()
+        self.assertTrue(mediastore.needsIiifDerivative(media_store))
+
+    @patch.object(mediastore, "saveFileToBucket")
+    def testSaveSmallImage(self, saveFileToBucket):
+        media_store = self.save(self.createUploadedFile((800, 500)))
+        self.assertEqual(media_store.derivative_file_name, "")
+        self.assertNotIn("derivatives", media_store.get_iiif_base_url())
+        saveFileToBucket.assert_not_called()
+        with override_settings(IIIF_DERIVATIVES=False):
+            self.save(self.createUploadedFile((1200, 500)))
+        saveFileToBucket.assert_not_called()
+
+    @patch.object(
+        mediastore, "saveFileToBucket", side_effect=MediaStoreException("S3 error")
+    )
+    def testDerivativeErrorKeepsOriginal(self, saveFileToBucket):
+        media_store = self.save(self.createUploadedFile((1200, 500)))
+        self.assertIsNotNone(media_store.pk)
+        self.assertEqual(media_store.derivative_file_name, "")
+        self.assertIn(media_store.file_name, media_store.get_iiif_base_url())
+
+    @patch.object(mediastore, "saveFileToBucket")
+    def testWithoutJpeg2000Support(self, saveFileToBucket):
+        self.addCleanup(mediastore.canSaveIiifDerivatives.cache_clear)
+        mediastore.canSaveIiifDerivatives.cache_clear()
+        with patch.object(mediastore.features, "check", return_value=False):
+            with self.assertLogs(mediastore.logger, "WARNING"):
+                media_store = self.save(self.createUploadedFile((1200, 500)))
+            self.assertEqual(media_store.derivative_file_name, "")
+            saveFileToBucket.assert_not_called()
+            with self.assertRaises(CommandError):
+                call_command("generate_iiif_derivatives", stdout=io.StringIO())
+
+    @patch.object(mediastore, "saveFileToBucket")
+    def testGenerateCommand(self, saveFileToBucket):
+        f = self.createUploadedFile((1200, 500))
+        with override_settings(IIIF_DERIVATIVES=False):
+            media_store = self.save(f)
+        self.save(self.createUploadedFile((800, 500), name="small.png"))
+
+        def load(key_name, path):
+            self.assertEqual(key_name, media_store.get_s3_keyname())
+            with open(path, "wb") as dest:
+                f.seek(0)
+                dest.write(f.read())
+
+        with patch.object(mediastore, "loadFileFromBucket", side_effect=load):
+            call_command(
+                "generate_iiif_derivatives", analysis_processes=0, stdout=io.StringIO()
+            )
+        self.addCleanup(mediastore.setAnalysisProcesses, None)
+        media_store.refresh_from_db()
+        self.assertEqual(
+            media_store.derivative_file_name, "%s.jp2" % media_store.file_md5hash
+        )
+        self.assertEqual(saveFileToBucket.call_count, 1)
+
 
 class TestZipUpload(unittest.TestCase):
 
@@ -1,7 +1,8 @@
 # -*- coding: UTF-8 -*-
-import json
 import unittest
 
+from django.test import override_settings
+
 from media_management_api.media_service import models
 
 
@@ -56,6 +57,20 @@ class TestMediaStore(unittest.TestCase):
             self.assertEqual(thumb_actual["height"], thumb_h)
             self.assertTrue(thumb_actual["url"])
 
+    @override_settings(IIIF_IMAGE_SIZES=[800, 100, 200, 400])
+    def test_get_iiif_sizes(self):
+        foo = models.MediaStore.objects.get(pk=self.test_items[0]["pk"])
+        sizes = foo.get_iiif_sizes()
+        self.assertEqual(
+            [(size["width"], size["height"]) for size in sizes], [(100, 75), (200, 150)]
+        )
+        self.assertTrue(sizes[0]["url"].endswith("/full/!100,100/0/default.jpg"))
+        self.assertTrue(sizes[1]["url"].startswith(foo.get_iiif_base_url()))
+
+        # Images aren't scaled up
+        bar = models.MediaStore.objects.get(pk=self.test_items[1]["pk"])
+        self.assertEqual(bar.get_iiif_sizes(), [])
+
 
 class TestResource(unittest.TestCase):
     test_course = None
@@ -72,26 +87,25 @@ class TestResource(unittest.TestCase):
     def test_save_with_metadata(self):
         title = "Test Resource"
         course = TestResource.test_course
-        default_metadata = models.metadata_default()
         missing_metadata = ("", None)
-        invalid_metadata = (None, True, False, 123, {})
+        invalid_metadata = ("null", "[]", True, False, 123, {})
         valid_metadata = ([], [{"label": "X", "value": "Y"}])
 
         # check that missing or invalid metadata values are saved using the default value
-        # for example the string "null" is not a valid value, so it should be overwritten with "[]"
+        # for example the string "[]" is not a list, so it should be overwritten with []
         for metadata in missing_metadata + invalid_metadata:
             instance = models.Resource(course=course, title=title, metadata=metadata)
             instance.save()
-            self.assertNotEqual(metadata, instance.metadata)
-            self.assertEqual(default_metadata, instance.metadata)
+            instance.refresh_from_db()
+            self.assertEqual([], instance.metadata)
 
         # check that valid metadata is saved unchanged
         for metadata in valid_metadata:
-            instance = models.Resource(
-                course=course, title=title, metadata=json.dumps(metadata)
-            )
+            instance = models.Resource(course=course, title=title, metadata=metadata)
             instance.save()
-            self.assertEqual(json.dumps(metadata), instance.metadata)
+            instance.refresh_from_db()
+            self.assertEqual(metadata, instance.metadata)
+            self.assertEqual(metadata, instance.load_metadata())
 
 
 class TestUnicodeInput(unittest.TestCase):
@@ -320,3 +334,94 @@ class TestCourseCopy(unittest.TestCase):
             self.assertIn(str(cr.pk), data["collection_resources"])
         for src_pk, dest_pk in data["collection_resources"].items():
             self.assertNotEqual(src_pk, dest_pk)
+
+
+class TestImageProjection(unittest.TestCase):
+    def setUp(self):
+        self.course = models.Course(title="TestProjectionCourse")
+        self.course.save()
+        self.media_store = models.MediaStore(
+            file_name="foo.jpg",
+            file_size=51200,
+            file_md5hash="5603090cae0c1ad78285207ffe9fb574",
+            file_extension="jpg",
+            file_type="image/jpeg",
+            img_width=400,
+            img_height=300,
+        )
+        self.media_store.save()
+
+    def tearDown(self):
+        self.course.delete()
+        self.media_store.delete()
+
+    def test_projection_created_on_save(self):
+        resource = models.Resource(
+            course=self.course,
+            title="Image",
+            media_store=self.media_store,
+            metadata=[{"label": "X", "value": "Y"}],
+        )
+        resource.save()
+
+        projection = models.ImageProjection.objects.get(resource=resource)
+        self.assertEqual(resource.get_representation(), projection.get_representation())
+        self.assertEqual(resource.load_metadata(), projection.metadata)
+        self.assertEqual(self.course.pk, projection.course_id)
+        self.assertEqual(resource.sort_order, projection.sort_order)
+
+        resource.title = "Renamed"
+        resource.save()
+        projection.refresh_from_db()
+        self.assertEqual("Renamed", projection.title)
+
+    def test_projection_collection_ids(self):
+        resource = models.Resource(course=self.course, title="Image")
+        resource.save()
+        collection = models.Collection(course=self.course, title="Collection")
+        collection.save()
+
+        collection_resource = models.CollectionResource(
+            collection=collection, resource=resource
+        )
+        collection_resource.save()
+        projection = models.ImageProjection.objects.get(resource=resource)
+        self.assertEqual([collection.pk], projection.collection_ids)
+
+        collection_resource.delete()
+        projection.refresh_from_db()
+        self.assertEqual([], projection.collection_ids)
+
+    def test_projection_deleted_with_resource(self):
+        resource = models.Resource(course=self.course, title="Image")
+        resource.save()
+        collection = models.Collection(course=self.course, title="Collection")
+        collection.save()
+        models.CollectionResource(collection=collection, resource=resource).save()
+
+        resource_pk = resource.pk
+        resource.delete()
+        self.assertFalse(
+            models.ImageProjection.objects.filter(resource_id=resource_pk).exists()
+        )
+
+    def test_rebuild(self):
+        resources = []
+        for n in range(3):
+            resource = models.Resource(course=self.course, title="Image%d" % n)
+            resource.save()
+            resources.append(resource)
+        models.ImageProjection.objects.filter(course=self.course).delete()
+
+        total = models.ImageProjection.rebuild(
+            course_ids=[self.course.pk], batch_size=2
+        )
+        self.assertEqual(len(resources), total)
+        self.assertEqual(
+            sorted(r.pk for r in resources),
+            sorted(
+                models.ImageProjection.objects.filter(course=self.course).values_list(
+                    "resource_id", flat=True
+                )
+            ),
+        )
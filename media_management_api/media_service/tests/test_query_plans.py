@@ -0,0 +1,108 @@
+import json
+import unittest
+
+from django.db import connection
+from django.test import TestCase
+
+from ..models import (
+    Collection,
+    CollectionResource,
+    Course,
+    ImageProjection,
+    MediaStore,
+    Resource,
+)
+
+# The hot queries, as issued by the list views and the media store, with the only table
+# each one should touch and the index that should answer it.
+HOT_QUERIES = {
+    "course images": (
+        lambda: ImageProjection.objects.filter(course__pk=1).order_by("sort_order"),
+        ImageProjection,
+        "media_servi_course__d800b2_idx",
+    ),
+    "course resources": (
+        lambda: Resource.objects.filter(course__pk=1).order_by("sort_order"),
+        Resource,
+        "resource_course_sort_idx",
+    ),
+    "course collections": (
+        lambda: Collection.objects.filter(course__pk=1).order_by("sort_order"),
+        Collection,
+        "collection_course_sort_idx",
+    ),
+    "collection images": (
+        lambda: CollectionResource.objects.filter(collection__pk=1).order_by(
+            "sort_order"
+        ),
+        CollectionResource,
+        "collectionres_coll_sort_idx",
+    ),
+    "collection images (default ordering)": (
+        lambda: CollectionResource.objects.filter(collection__pk=1),
+        CollectionResource,
+        "collectionres_coll_sort_idx",
+    ),
+    "media store by hash": (
+        lambda: MediaStore.objects.filter(file_md5hash="0" * 32),
+        MediaStore,
+        "mediastore_md5hash_idx",
+    ),
+    "course by canvas id": (
+        lambda: Course.objects.filter(canvas_course_id=1),
+        Course,
+        "course_canvas_course_id_idx",
+    ),
+}
+
+
+def iter_plan_nodes(plan):
+    yield plan
+    for subplan in plan.get("Plans", []):
+        yield from iter_plan_nodes(subplan)
+
+
+class TestHotQueryJoins(TestCase):
+    def test_no_joins(self):
+        for name, (get_queryset, model, index_name) in HOT_QUERIES.items():
+            with self.subTest(name):
+                sql = str(get_queryset().query)
+                self.assertNotIn(" JOIN ", sql)
+
+    def test_indexes_declared(self):
+        for name, (get_queryset, model, index_name) in HOT_QUERIES.items():
+            with self.subTest(name):
+                self.assertIn(index_name, [i.name for i in model._meta.indexes])
+
+
+@unittest.skipUnless(
+    connection.vendor == "postgresql", "EXPLAIN plans are checked on PostgreSQL only"
+)
+class TestHotQueryPlans(TestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        # The fixtures are far too small for the planner to prefer an index on its own,
+        # so sequential scans are disabled for the duration of each test's transaction.
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def get_plan_nodes(self, queryset):
+        plan = json.loads(queryset.explain(format="json"))
+        return list(iter_plan_nodes(plan[0]["Plan"]))
+
+    def test_index_usage(self):
+        for name, (get_queryset, model, index_name) in HOT_QUERIES.items():
+            with self.subTest(name):
+                nodes = self.get_plan_nodes(get_queryset())
+                self.assertIn(index_name, [node.get("Index Name") for node in nodes])
+
+    def test_single_relation(self):
+        for name, (get_queryset, model, index_name) in HOT_QUERIES.items():
+            with self.subTest(name):
+                nodes = self.get_plan_nodes(get_queryset())
+                relations = {
+                    node["Relation Name"] for node in nodes if "Relation Name" in node
+                }
+                self.assertEqual({model._meta.db_table}, relations)
+                self.assertNotIn("Seq Scan", [node["Node Type"] for node in nodes])
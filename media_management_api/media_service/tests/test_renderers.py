@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+import decimal
+import json
+
+import msgpack
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+from django.utils import timezone
+from mock import patch
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .. import aio
+from ..renderers import MessagePackRenderer, ORJSONRenderer
+from ..views import CourseImagesListView
+from .test_views import BaseApiTestCase
+
+
+class TestORJSONRenderer(BaseApiTestCase):
+    def get_data(self):
+        return {
+            "id": 1,
+            "title": "Über image",
+            "created": datetime.datetime(
+                2015, 12, 15, 15, 42, 33, 443434, tzinfo=timezone.utc
+            ),
+            "price": decimal.Decimal("1.50"),
+            "metadata": [{"label": "X", "value": "Y"}],
+            "nothing": None,
+        }
+
+    def test_matches_json_renderer(self):
+        data = self.get_data()
+        self.assertEqual(JSONRenderer().render(data), ORJSONRenderer().render(data))
+
+    def test_render_none(self):
+        self.assertEqual(b"", ORJSONRenderer().render(None))
+
+    def test_render_iter(self):
+        renderer = ORJSONRenderer()
+        for items in ([], [{"id": 1}], [{"id": n} for n in range(7)]):
+            output = b"".join(renderer.render_iter(items, chunk_size=3))
+            self.assertEqual(items, json.loads(output))
+
+    def test_msgpack(self):
+        data = self.get_data()
+        expected = json.loads(JSONRenderer().render(data))
+        actual = msgpack.unpackb(MessagePackRenderer().render(data), raw=False)
+        self.assertEqual(expected, actual)
+
+
+class TestImageListRendering(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.superuser = self._create_test_superuser()
+        self.client.force_authenticate(self.superuser)
+
+    def test_msgpack_accept_header(self):
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        response = self.client.get(url, HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["content-type"], "application/msgpack")
+        data = msgpack.unpackb(response.content, raw=False)
+        self.assertEqual(data[0]["url"], "http://testserver/api/images/1")
+
+    def test_streamed_list(self):
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        expected = self.client.get(url).json()
+        with patch(
+            "media_management_api.media_service.views.STREAMING_LIST_THRESHOLD", 2
+        ):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content)
+        self.assertEqual(expected, json.loads(content))
+
+    def test_list_not_streamed_from_database_pool(self):
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        expected = self.client.get(url).json()
+        # The pool's threads close their connection when the handler returns
+        with patch(
+            "media_management_api.media_service.views.STREAMING_LIST_THRESHOLD", 2
+        ), patch(
+            "media_management_api.media_service.views.in_database_pool",
+            return_value=True,
+        ):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.streaming)
+        self.assertEqual(expected, response.json())
+
+    def test_in_database_pool(self):
+        self.assertFalse(aio.in_database_pool())
+        with patch.object(aio, "ASYNC_DB_THREADS", 1), patch.object(
+            aio, "_executor", None
+        ):
+            executor = aio.get_executor()
+            try:
+                self.assertTrue(executor.submit(aio.in_database_pool).result())
+            finally:
+                executor.shutdown()
+
+    def test_sync_handler_dispatched_without_event_loop(self):
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        with patch.object(aio, "async_to_sync", side_effect=AssertionError):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_asgi_view(self):
+        self.assertFalse(asyncio.iscoroutinefunction(CourseImagesListView.as_view()))
+        with patch.object(aio, "SERVE_ASGI", True):
+            view = CourseImagesListView.as_view()
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, self.superuser)
+        response = async_to_sync(view)(request, pk=1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response.render()
+        self.assertEqual(self.client.get(url).json(), json.loads(response.content))
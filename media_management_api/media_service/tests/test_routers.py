@@ -0,0 +1,87 @@
+import time
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from media_management_api.middleware import ReadYourWritesMiddleware
+from media_management_api.routers import (
+    PrimaryReplicaRouter,
+    is_pinned_to_primary,
+    pin_to_primary,
+    use_primary,
+)
+
+from ..models import Resource
+
+
+@override_settings(DATABASE_REPLICAS=["replica0"])
+class TestPrimaryReplicaRouter(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        pin_to_primary(False)
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual("replica0", self.router.db_for_read(Resource))
+        self.assertEqual("default", self.router.db_for_write(Resource))
+
+    def test_reads_go_to_primary_when_pinned(self):
+        with use_primary():
+            self.assertEqual("default", self.router.db_for_read(Resource))
+        self.assertEqual("replica0", self.router.db_for_read(Resource))
+
+        pin_to_primary()
+        self.assertEqual("default", self.router.db_for_read(Resource))
+        pin_to_primary(False)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_reads_go_to_primary_without_replicas(self):
+        self.assertEqual("default", self.router.db_for_read(Resource))
+
+    def test_migrations_only_on_primary(self):
+        self.assertTrue(self.router.allow_migrate("default", "media_service"))
+        self.assertFalse(self.router.allow_migrate("replica0", "media_service"))
+
+
+@override_settings(READ_YOUR_WRITES_SECONDS=10)
+class TestReadYourWritesMiddleware(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.pinned = None
+
+        def get_response(request):
+            self.pinned = is_pinned_to_primary()
+            return HttpResponse()
+
+        self.middleware = ReadYourWritesMiddleware(get_response)
+
+    def test_write_pins_client(self):
+        response = self.middleware(self.factory.post("/api/courses"))
+        self.assertTrue(self.pinned)
+        self.assertFalse(is_pinned_to_primary())
+
+        pinned_until = response[ReadYourWritesMiddleware.header_name]
+        self.assertAlmostEqual(int(pinned_until), time.time() + 10, delta=2)
+        cookie = response.cookies[ReadYourWritesMiddleware.cookie_name]
+        self.assertEqual(pinned_until, cookie.value)
+
+        request = self.factory.get("/api/courses")
+        request.COOKIES[ReadYourWritesMiddleware.cookie_name] = pinned_until
+        response = self.middleware(request)
+        self.assertTrue(self.pinned)
+        self.assertNotIn(ReadYourWritesMiddleware.header_name, response)
+
+    def test_pin_header(self):
+        header = "HTTP_X_PRIMARY_DB_UNTIL"
+        self.middleware(self.factory.get("/api/courses"))
+        self.assertFalse(self.pinned)
+
+        self.middleware(self.factory.get("/api/courses", **{header: "invalid"}))
+        self.assertFalse(self.pinned)
+
+        expired = str(int(time.time()) - 1)
+        self.middleware(self.factory.get("/api/courses", **{header: expired}))
+        self.assertFalse(self.pinned)
+
+        pinned_until = str(int(time.time()) + 10)
+        self.middleware(self.factory.get("/api/courses", **{header: pinned_until}))
+        self.assertTrue(self.pinned)
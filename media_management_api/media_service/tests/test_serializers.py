@@ -0,0 +1,56 @@
+from django.test import RequestFactory, TestCase
+from rest_framework.renderers import JSONRenderer
+
+from ..models import CollectionResource, ImageProjection, MediaStore, Resource
+from ..serializers import (
+    CollectionImageListSerializer,
+    CollectionResourceSerializer,
+    ImageListSerializer,
+    ResourceSerializer,
+)
+
+
+class TestValuesListSerializers(TestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.request = RequestFactory().get("/")
+        media_store = MediaStore(
+            file_name="foo.jpg",
+            file_size=51200,
+            file_md5hash="7603090cae0c1ad78285207ffe9fb574",
+            file_extension="jpg",
+            file_type="image/jpeg",
+            img_width=400,
+            img_height=300,
+        )
+        media_store.save()
+        resource = Resource.objects.get(pk=1)
+        resource.media_store = media_store
+        resource.save()
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_image_list_matches_resource_serializer(self):
+        context = {"request": self.request}
+        resources = Resource.objects.filter(course__pk=1).order_by("sort_order")
+        projections = ImageProjection.objects.filter(course__pk=1).order_by(
+            "sort_order"
+        )
+        expected = ResourceSerializer(resources, many=True, context=context).data
+        actual = ImageListSerializer(projections, context=context).data
+        self.assertTrue(len(actual) > 0)
+        self.assertEqual(self.render(expected), self.render(actual))
+
+    def test_collection_image_list_matches_collection_resource_serializer(self):
+        context = {"request": self.request}
+        queryset = CollectionResource.objects.filter(collection__pk=1).order_by(
+            "sort_order"
+        )
+        expected = CollectionResourceSerializer(
+            queryset, many=True, context=context
+        ).data
+        actual = CollectionImageListSerializer(queryset, context=context).data
+        self.assertTrue(len(actual) > 0)
+        self.assertEqual(self.render(expected), self.render(actual))
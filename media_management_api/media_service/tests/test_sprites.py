@@ -0,0 +1,157 @@
+import io
+
+from django.test import override_settings
+from django.urls import reverse
+from mock import patch
+from PIL import Image
+from rest_framework import status
+
+from .. import sprites
+from ..models import Course, MediaStore, Resource
+from .test_views import BaseApiTestCase
+
+
+def make_thumbnail(size, color):
+    content = io.BytesIO()
+    Image.new("RGB", size, color).save(content, "JPEG")
+    return content.getvalue()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    SPRITE_CELL_SIZE=50,
+)
+class TestCourseSprites(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.client.force_authenticate(self._create_test_superuser())
+        self.course = Course.objects.create(title="Sprites")
+        self.resources = []
+        for n in range(5):
+            media_store = MediaStore.objects.create(
+                file_name="%d.jpg" % n,
+                file_size=1000,
+                file_md5hash="%032d" % n,
+                img_width=400,
+                img_height=200,
+                dominant_color="#00ff00",
+            )
+            self.resources.append(
+                Resource.objects.create(
+                    course=self.course, title="Image %d" % n, media_store=media_store
+                )
+            )
+        self.url = reverse("api:course-images-sprite", kwargs={"pk": self.course.pk})
+        self.fetched = []
+
+        async def fetch_thumbnails(urls):
+            self.fetched.append(urls)
+            # The thumbnail of the last image is missing
+            return [make_thumbnail((50, 25), "red") for url in urls[:-1]] + [None]
+
+        patcher = patch.object(sprites, "fetch_thumbnails", new=fetch_thumbnails)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        sprites.cache.clear()
+
+    def test_sprite(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 5)
+        self.assertEqual(response.data["cell_size"], 50)
+        # 5 images are laid out in 3 columns and 2 rows
+        self.assertEqual((response.data["width"], response.data["height"]), (150, 100))
+        images = response.data["images"]
+        self.assertEqual(
+            [image["id"] for image in images], [r.pk for r in self.resources]
+        )
+        self.assertEqual(
+            [(image["x"], image["y"]) for image in images],
+            [(0, 0), (50, 0), (100, 0), (0, 50), (50, 50)],
+        )
+        self.assertTrue(images[0]["loaded"])
+        self.assertEqual((images[0]["width"], images[0]["height"]), (50, 25))
+        self.assertTrue(self.fetched[0][0].endswith("/full/!50,50/0/default.jpg"))
+
+        # The missing thumbnail is drawn in the image's dominant colour
+        self.assertFalse(images[4]["loaded"])
+        self.assertEqual((images[4]["width"], images[4]["height"]), (50, 25))
+
+        # The JPEG is served without credentials
+        self.client.force_authenticate(None)
+        image_response = self.client.get(response.data["url"])
+        self.assertEqual(image_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(image_response["Content-Type"], "image/jpeg")
+        # The sprite is missing a thumbnail, so it's only cached briefly
+        self.assertEqual(
+            image_response["Cache-Control"],
+            "public, max-age=%d" % sprites.SPRITE_INCOMPLETE_TIMEOUT,
+        )
+        with Image.open(io.BytesIO(image_response.content)) as im:
+            self.assertEqual(im.size, (150, 100))
+            r, g, b = im.getpixel((60, 60))
+            self.assertTrue(g > 200 and r < 50)
+
+    def test_complete_sprite_is_immutable(self):
+        async def fetch_thumbnails(urls):
+            return [make_thumbnail((50, 25), "red") for url in urls]
+
+        with patch.object(sprites, "fetch_thumbnails", new=fetch_thumbnails):
+            response = self.client.get(self.url)
+        self.assertTrue(all(image["loaded"] for image in response.data["images"]))
+        image_response = self.client.get(response.data["url"])
+        self.assertEqual(
+            image_response["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+
+    def test_evicted_sprite_is_made_again(self):
+        response = self.client.get(self.url, {"page": 2, "page_size": 2})
+        url = response.data["url"]
+        sprites.cache.clear()
+        image_response = self.client.get(url)
+        self.assertEqual(image_response.status_code, status.HTTP_200_OK)
+        with Image.open(io.BytesIO(image_response.content)) as im:
+            self.assertEqual(im.size, (100, 50))
+        self.assertEqual(len(self.fetched), 2)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.fetched), 2)
+
+        # Once the page's images have changed, the old sprite is gone for good
+        sprites.cache.clear()
+        self.resources[2].delete()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_sprite_is_cached_by_members(self):
+        first = self.client.get(self.url).data
+        self.assertEqual(self.client.get(self.url).data["url"], first["url"])
+        self.assertEqual(len(self.fetched), 1)
+
+        # Reordering the images gives the page a new sprite
+        resource = self.resources[0]
+        resource.sort_order = 100
+        resource.save()
+        second = self.client.get(self.url).data
+        self.assertNotEqual(second["url"], first["url"])
+        self.assertEqual(second["images"][-1]["id"], resource.pk)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_sprite_pages(self):
+        response = self.client.get(self.url, {"page": 2, "page_size": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [image["id"] for image in response.data["images"]],
+            [r.pk for r in self.resources[2:4]],
+        )
+        response = self.client.get(self.url, {"page": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unknown_sprite(self):
+        url = reverse(
+            "api:course-images-sprite-image",
+            kwargs={"pk": self.course.pk, "key": "0" * 64},
+        )
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
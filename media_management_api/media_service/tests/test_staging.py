@@ -0,0 +1,260 @@
+import base64
+import hashlib
+import os
+import tempfile
+
+from django.test import override_settings
+from django.urls import reverse
+from mock import patch
+from rest_framework import status
+
+from ..mediastore import MediaStoreUpload
+from ..models import MediaStore, Resource, UploadSession
+from ..staging import ChunkedUpload, LocalUploadStaging
+from .test_mediastore import TEST_FILES
+from .test_views import BaseApiTestCase
+
+
+class TestUploadSessions(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.superuser = self._create_test_superuser()
+        self.client.force_authenticate(self.superuser)
+        self.staging_root = tempfile.TemporaryDirectory()
+        self.staging_settings = override_settings(
+            UPLOAD_STAGING_BACKEND="local", UPLOAD_STAGING_ROOT=self.staging_root.name
+        )
+        self.staging_settings.enable()
+        self.content = TEST_FILES["test.png"]["content"]
+        self.md5hash = hashlib.md5(self.content).hexdigest()
+
+    def tearDown(self):
+        self.staging_settings.disable()
+        self.staging_root.cleanup()
+
+    def start_session(self, **kwargs):
+        url = reverse("api:course-upload-sessions", kwargs={"pk": 1})
+        file_data = {
+            "file_name": "test.png",
+            "file_size": len(self.content),
+            "file_md5hash": self.md5hash,
+            "file_type": "image/png",
+        }
+        file_data.update(kwargs)
+        return self.client.post(url, {"files": [file_data]}, format="json")
+
+    def upload(self, session_data, content):
+        upload = session_data["upload"]
+        self.assertEqual(upload["method"], "PUT")
+        return self.client.put(
+            upload["url"], content, content_type=upload["headers"]["Content-Type"]
+        )
+
+    def finalize(self, session_data):
+        url = reverse("api:upload-session-finalize", kwargs={"pk": session_data["id"]})
+        return self.client.post(url)
+
+    @patch.object(LocalUploadStaging, "promote")
+    def test_upload_and_finalize(self, promote):
+        response = self.start_session()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        session_data = response.data[0]
+        self.assertEqual(session_data["state"], UploadSession.STATE_PENDING)
+
+        response = self.upload(session_data, self.content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["ETag"], '"%s"' % self.md5hash)
+
+        response = self.finalize(session_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["title"], "test.png")
+        self.assertEqual(response.data["image_width"], 24)
+        self.assertEqual(response.data["image_height"], 24)
+
+        media_store = MediaStore.objects.get(file_md5hash=self.md5hash)
+        self.assertEqual(media_store.file_type, "image/png")
+        self.assertEqual(media_store.file_size, len(self.content))
+        session = UploadSession.objects.get(pk=session_data["id"])
+        promote.assert_called_once_with(
+            session.get_staging_keyname(), media_store.get_s3_keyname(), "image/png"
+        )
+        self.assertEqual(session.state, UploadSession.STATE_COMPLETED)
+        self.assertEqual(session.resource.media_store, media_store)
+        self.assertEqual(session.resource.original_file_name, "test.png")
+
+        # Finalizing again doesn't add another image
+        response = self.finalize(session_data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], session.resource.pk)
+        self.assertEqual(Resource.objects.filter(media_store=media_store).count(), 1)
+
+    @patch.object(LocalUploadStaging, "promote")
+    def test_finalize_existing_media(self, promote):
+        media_store = MediaStore.objects.create(
+            file_name="%s.png" % self.md5hash,
+            file_size=len(self.content),
+            file_md5hash=self.md5hash,
+            file_type="image/png",
+            file_extension="png",
+            img_width=24,
+            img_height=24,
+        )
+        session_data = self.start_session().data[0]
+        self.upload(session_data, self.content)
+        response = self.finalize(session_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        promote.assert_not_called()
+        session = UploadSession.objects.get(pk=session_data["id"])
+        self.assertEqual(session.resource.media_store, media_store)
+        self.assertFalse(
+            os.path.exists(LocalUploadStaging().get_path(session.get_staging_keyname()))
+        )
+
+    @patch.object(LocalUploadStaging, "promote")
+    def test_concurrent_finalize(self, promote):
+        session_data = self.start_session().data[0]
+        self.upload(session_data, self.content)
+        stale = UploadSession.objects.get(pk=session_data["id"])
+        response = self.finalize(session_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # A request that read the session before the first one completed it
+        with patch(
+            "media_management_api.media_service.views.get_object_or_404",
+            return_value=stale,
+        ):
+            retry = self.finalize(session_data)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data["id"], response.data["id"])
+        self.assertEqual(Resource.objects.filter(title="test.png").count(), 1)
+
+    def test_upload_must_match_session(self):
+        session_data = self.start_session().data[0]
+        response = self.upload(session_data, self.content[:-1] + b"x")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.upload(session_data, self.content + b"x")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.finalize(session_data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        session = UploadSession.objects.get(pk=session_data["id"])
+        self.assertEqual(session.state, UploadSession.STATE_ERROR)
+        self.assertEqual(session.error, "The file has not been uploaded.")
+
+    def test_finalize_rejects_invalid_image(self):
+        content = b"not an image" * 10
+        self.md5hash = hashlib.md5(content).hexdigest()
+        session_data = self.start_session(file_size=len(content)).data[0]
+        self.upload(session_data, content)
+        response = self.finalize(session_data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(MediaStore.objects.filter(file_md5hash=self.md5hash).exists())
+
+    def test_start_session_is_validated(self):
+        for kwargs in (
+            {"file_type": "text/html"},
+            {"file_md5hash": "not a hash"},
+            {"file_size": 0},
+        ):
+            response = self.start_session(**kwargs)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadSession.objects.exists())
+
+
+class TestChunkedUploadSessions(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.client.force_authenticate(self._create_test_superuser())
+        self.staging_root = tempfile.TemporaryDirectory()
+        self.staging_settings = override_settings(
+            UPLOAD_STAGING_ROOT=self.staging_root.name
+        )
+        self.staging_settings.enable()
+        self.content = TEST_FILES["test.png"]["content"]
+        url = reverse("api:course-upload-sessions", kwargs={"pk": 1})
+        file_data = {
+            "file_name": "test.png",
+            "file_size": len(self.content),
+            "file_md5hash": hashlib.md5(self.content).hexdigest(),
+            "file_type": "image/png",
+            "chunked": True,
+        }
+        response = self.client.post(url, {"files": [file_data]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.session_data = response.data[0]
+
+    def tearDown(self):
+        self.staging_settings.disable()
+        self.staging_root.cleanup()
+
+    def send_chunk(self, offset, chunk, checksum=None):
+        upload = self.session_data["upload"]
+        self.assertEqual(upload["method"], "PATCH")
+        headers = {"HTTP_UPLOAD_OFFSET": str(offset)}
+        if checksum is None:
+            checksum = base64.b64encode(hashlib.sha1(chunk).digest()).decode()
+        if checksum:
+            headers["HTTP_UPLOAD_CHECKSUM"] = "sha1 %s" % checksum
+        return self.client.patch(
+            upload["url"],
+            chunk,
+            content_type=upload["headers"]["Content-Type"],
+            **headers
+        )
+
+    def get_offset(self):
+        response = self.client.head(self.session_data["upload"]["url"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Upload-Length"], str(len(self.content)))
+        return int(response["Upload-Offset"])
+
+    def finalize(self):
+        url = reverse(
+            "api:upload-session-finalize", kwargs={"pk": self.session_data["id"]}
+        )
+        return self.client.post(url)
+
+    @patch.object(MediaStoreUpload, "saveToBucket", return_value=True)
+    def test_resumable_upload(self, saveToBucket):
+        first, second = self.content[:100], self.content[100:]
+        response = self.send_chunk(0, first)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(response["Upload-Offset"], "100")
+
+        # Finalizing before the upload is complete fails, but the upload can go on
+        response = self.finalize()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # A chunk that was cut off or is sent again is rejected
+        response = self.send_chunk(100, second[:10], checksum="eA==")
+        self.assertEqual(response.status_code, 460)
+        response = self.send_chunk(0, first)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response["Upload-Offset"], "100")
+
+        # Resume from where the upload stopped
+        offset = self.get_offset()
+        self.assertEqual(offset, 100)
+        response = self.send_chunk(offset, second, checksum="")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.get_offset(), len(self.content))
+
+        response = self.finalize()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["title"], "test.png")
+        self.assertEqual(response.data["image_width"], 24)
+        saveToBucket.assert_called_once_with()
+        session = UploadSession.objects.get(pk=self.session_data["id"])
+        self.assertEqual(session.state, UploadSession.STATE_COMPLETED)
+        self.assertEqual(
+            session.resource.media_store.file_md5hash,
+            hashlib.md5(self.content).hexdigest(),
+        )
+        self.assertFalse(os.path.exists(ChunkedUpload(session).get_path()))
+
+    def test_chunk_past_end_of_file(self):
+        response = self.send_chunk(0, self.content + b"x")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_offset(), 0)
@@ -1,11 +1,23 @@
 import csv
 import io
 
+import mock
+from django.core.files.base import File
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from ..models import Collection, Course, CourseUser, UserProfile
+from .. import mediastore
+from ..models import (
+    Collection,
+    Course,
+    CourseUser,
+    MediaStore,
+    RemoteFetchCache,
+    Resource,
+    UserProfile,
+)
+from .test_mediastore import TEST_FILES
 
 
 class BaseApiTestCase(APITestCase):
@@ -74,6 +86,9 @@ class TestCourseEndpoint(BaseApiTestCase):
                             "image_url": None,
                             "thumb_url": None,
                             "iiif_base_url": None,
+                            "image_sizes": [],
+                            "placeholder": None,
+                            "dominant_color": None,
                         },
                     ],
                     "collections": [
@@ -243,6 +258,132 @@ class TestCourseEndpoint(BaseApiTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.json()[0]["url"], "http://testserver/api/images/1")
 
+    def test_course_images_import_errors(self):
+        pk = 1
+        url = reverse("api:course-images", kwargs={"pk": pk})
+        response = self.client.post(url, {"items": []}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(self.superuser)
+        for data, error in (
+            ({}, "Error: missing 'items' parameter for JSON upload"),
+            ({"items": []}, "Error: empty image items"),
+        ):
+            response = self.client.post(url, data, format="json")
+            self.assertEqual(
+                response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+            self.assertEqual(response.data["detail"], error)
+
+        for items in (["http://example.com/a.jpg"], [{"md5": "f" * 32}, 1]):
+            response = self.client.post(url, {"items": items}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_course_images_link_by_hash(self):
+        self.client.force_authenticate(self.superuser)
+        media_store = MediaStore.objects.create(
+            file_name="a.jpg",
+            file_size=100,
+            file_md5hash="0123456789abcdef0123456789abcdef",
+            file_type="image/jpeg",
+            file_extension="jpg",
+            img_width=800,
+            img_height=600,
+        )
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        items = [{"md5": media_store.file_md5hash, "title": "Linked"}]
+        response = self.client.post(url, {"items": items}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data[0]["title"], "Linked")
+        self.assertEqual(response.data[0]["image_width"], 800)
+
+        resource = Resource.objects.get(pk=response.data[0]["id"])
+        self.assertEqual(resource.media_store, media_store)
+        media_store.refresh_from_db()
+        self.assertEqual(media_store.reference_count, 1)
+
+        items = [{"md5": "f" * 32, "title": "Missing"}]
+        response = self.client.post(url, {"items": items}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_course_images_import_revalidates_cached_urls(self):
+        self.client.force_authenticate(self.superuser)
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        image_url = "http://example.com/test.png"
+        items = [{"url": image_url, "title": "Remote"}]
+
+        async def fetch(url, client, cache_entry=None):
+            self.assertIsNone(cache_entry)
+            f = File(io.BytesIO(TEST_FILES["test.png"]["content"]), name="test.png")
+            f.cache_validators = {"etag": '"v1"', "content_length": 150}
+            return f
+
+        with mock.patch.object(
+            mediastore, "fetchRemoteImageAsync", new=fetch
+        ), mock.patch.object(mediastore.MediaStoreUpload, "saveToBucket"):
+            response = self.client.post(url, {"items": items}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        media_store = Resource.objects.get(pk=response.data[0]["id"]).media_store
+        cache_entry = RemoteFetchCache.objects.get(url=image_url)
+        self.assertEqual(cache_entry.etag, '"v1"')
+        self.assertEqual(cache_entry.media_store, media_store)
+
+        async def revalidate(url, client, cache_entry=None):
+            self.assertEqual(cache_entry.etag, '"v1"')
+            return None
+
+        with mock.patch.object(mediastore, "fetchRemoteImageAsync", new=revalidate):
+            response = self.client.post(url, {"items": items}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        resource = Resource.objects.get(pk=response.data[0]["id"])
+        self.assertEqual(resource.media_store, media_store)
+        self.assertEqual(resource.original_file_name, image_url)
+
+    def test_course_images_bulk_update(self):
+        self.client.force_authenticate(self.superuser)
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        items = [
+            {
+                "id": 2,
+                "title": "Renamed",
+                "metadata": [{"label": "Artist", "value": "Seuss"}],
+                "sort_order": 100,
+            },
+            {"id": 1, "description": "Updated", "metadata": None},
+        ]
+        response = self.client.put(url, {"items": items}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["id"] for item in response.data], [1, 2])
+        self.assertEqual(response.data[1]["title"], "Renamed")
+        self.assertEqual(response.data[1]["metadata"], items[0]["metadata"])
+
+        resource = Resource.objects.get(pk=2)
+        self.assertEqual(resource.title, "Renamed")
+        self.assertEqual(resource.sort_order, 100)
+        self.assertEqual(resource.metadata, items[0]["metadata"])
+        resource = Resource.objects.get(pk=1)
+        self.assertEqual(resource.description, "Updated")
+        self.assertEqual(resource.metadata, [])
+        self.assertEqual(resource.projection.description, "Updated")
+
+    def test_course_images_bulk_update_is_validated_up_front(self):
+        self.client.force_authenticate(self.superuser)
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        title = Resource.objects.get(pk=1).title
+        invalid_requests = (
+            {"items": [{"id": 1, "title": "Renamed"}, {"id": 2, "metadata": "X"}]},
+            {"items": [{"id": 1, "title": "Renamed"}, {"id": 1, "title": "Again"}]},
+            {"items": [{"id": 1, "title": "Renamed"}, {"title": "No ID"}]},
+        )
+        for data in invalid_requests:
+            response = self.client.put(url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(
+            url, {"items": [{"id": 1, "title": "Renamed"}, {"id": 999}]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(Resource.objects.get(pk=1).title, title)
+
     def test_course_images_csv(self):
         self.client.force_authenticate(self.superuser)
 
@@ -259,6 +400,75 @@ class TestCourseEndpoint(BaseApiTestCase):
         self.assertEqual(response["content-type"], "text/csv; charset=utf-8")
         self.assertEqual(body[0][index_of_url], "http://testserver/api/images/1")
 
+    def test_course_library_import(self):
+        self.client.force_authenticate(self.superuser)
+        export_url = reverse("api:course-images-csv", kwargs={"pk": 1})
+        import_url = reverse("api:course-library-import", kwargs={"pk": 1})
+
+        # Edit an exported library
+        response = self.client.get(export_url)
+        rows = list(csv.DictReader(io.StringIO(response.content.decode("utf-8"))))
+        rows[0]["title"] = "Renamed"
+        rows[1]["metadata"] = '[{"label": "Artist", "value": "Seuss, Dr."}]'
+        rows[2]["metadata"] = '[{"label": "Artist"}]'
+        rows[3]["id"] = "999"
+        rows.append(dict(rows[0]))
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+        csv_file = io.BytesIO(output.getvalue().encode("utf-8"))
+        csv_file.name = "library.csv"
+
+        response = self.client.post(import_url, {"file": csv_file}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["updated"], 2)
+        self.assertEqual(response.data["unchanged"], 1)
+        self.assertEqual(response.data["error"], 3)
+        statuses = [(row["row"], row["status"]) for row in response.data["rows"]]
+        self.assertEqual(
+            statuses,
+            [
+                (2, "updated"),
+                (3, "updated"),
+                (4, "error"),
+                (5, "error"),
+                (6, "unchanged"),
+                (7, "error"),
+            ],
+        )
+
+        self.assertEqual(Resource.objects.get(pk=1).title, "Renamed")
+        resource = Resource.objects.get(pk=2)
+        self.assertEqual(
+            resource.metadata, [{"label": "Artist", "value": "Seuss, Dr."}]
+        )
+        self.assertEqual(resource.projection.metadata, resource.metadata)
+        self.assertEqual(Resource.objects.get(pk=3).metadata, [])
+
+    def test_course_library_import_requires_id_column(self):
+        self.client.force_authenticate(self.superuser)
+        url = reverse("api:course-library-import", kwargs={"pk": 1})
+        csv_file = io.BytesIO(b"title,description\nRenamed,\n")
+        csv_file.name = "library.csv"
+        response = self.client.post(url, {"file": csv_file}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_course_library_import_unreadable_row(self):
+        self.client.force_authenticate(self.superuser)
+        url = reverse("api:course-library-import", kwargs={"pk": 1})
+        csv_file = io.BytesIO(b"id,title\n1,Renamed\n2,Caf\xe9\n3,Unread\n")
+        csv_file.name = "library.csv"
+        response = self.client.post(url, {"file": csv_file}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("row 3", response.data["detail"])
+        # The rows before the one that couldn't be read are applied
+        self.assertEqual(response.data["updated"], 1)
+        statuses = [(row["row"], row["status"]) for row in response.data["rows"]]
+        self.assertEqual(statuses, [(2, "updated"), (3, "error")])
+        self.assertEqual(Resource.objects.get(pk=1).title, "Renamed")
+        self.assertNotEqual(Resource.objects.get(pk=3).title, "Unread")
+
     def test_add_collection_to_course(self):
         self.client.force_authenticate(self.superuser)
 
@@ -461,3 +671,191 @@ class TestCollectionEndpoint(BaseApiTestCase):
             "resource__pk", flat=True
         )
         self.assertSequenceEqual(response.data["course_image_ids"], course_image_ids)
+
+
+class TestImageSearchEndpoint(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.superuser = self._create_test_superuser()
+        self.nonsuperuser = self._create_test_nonsuperuser()
+        resource = Resource.objects.get(pk=2)
+        resource.description = "A drawing of a moose"
+        resource.metadata = [{"label": "Artist", "value": "Seuss"}]
+        resource.save()
+
+    def test_course_images_search(self):
+        self.client.force_authenticate(self.superuser)
+        url = reverse("api:course-images-search", kwargs={"pk": 1})
+        for q in ("moose", "seuss", "artist"):
+            response = self.client.get(url, {"q": q})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data["count"], 1)
+            self.assertEqual(response.data["results"][0]["id"], 2)
+
+        response = self.client.get(url, {"q": "nothing matches this"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 0)
+
+    def test_course_images_search_requires_query(self):
+        self.client.force_authenticate(self.superuser)
+        url = reverse("api:course-images-search", kwargs={"pk": 1})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_image_search_staff_only(self):
+        url = reverse("api:image-search")
+        self.client.force_authenticate(self.nonsuperuser)
+        response = self.client.get(url, {"q": "moose"})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(self.superuser)
+        response = self.client.get(url, {"q": "moose"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["id"] for r in response.data["results"]], [2])
+
+
+class TestImageMetadataFilter(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.superuser = self._create_test_superuser()
+        metadata = {
+            2: [{"label": "Artist", "value": "Seuss"}],
+            3: [
+                {"label": "Artist", "value": "Seuss"},
+                {"label": "Year", "value": "1957"},
+            ],
+            4: [{"label": "Artist", "value": "Someone Else"}],
+        }
+        for resource in Resource.objects.filter(pk__in=metadata):
+            resource.metadata = metadata[resource.pk]
+            resource.save()
+
+    def get_ids(self, url, params, key="id"):
+        self.client.force_authenticate(self.superuser)
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item[key] for item in response.data]
+
+    def test_course_images_filter(self):
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        self.assertEqual(self.get_ids(url, {"metadata.Artist": "Seuss"}), [2, 3])
+        self.assertEqual(
+            self.get_ids(url, {"metadata.Artist": "Seuss", "metadata.Year": "1957"}),
+            [3],
+        )
+        self.assertEqual(self.get_ids(url, {"metadata.Artist": "Seu"}), [])
+
+    def test_images_filter(self):
+        url = reverse("api:image-list")
+        self.assertEqual(self.get_ids(url, {"metadata.Artist": "Someone Else"}), [4])
+
+    def test_collection_images_filter(self):
+        url = reverse("api:collectionimages-list", kwargs={"pk": 2})
+        self.assertEqual(
+            self.get_ids(url, {"metadata.Year": "1957"}, key="course_image_id"), [3]
+        )
+
+    def test_filter_requires_label(self):
+        self.client.force_authenticate(self.superuser)
+        url = reverse("api:course-images", kwargs={"pk": 1})
+        response = self.client.get(url, {"metadata.": "Seuss"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestCourseSearchEndpoint(BaseApiTestCase):
+    fixtures = ["test.json"]
+
+    def setUp(self):
+        self.superuser = self._create_test_superuser()
+        self.client.force_authenticate(self.superuser)
+
+    def test_search_results(self):
+        Course.objects.create(title="Intro to Moose Studies", sis_course_id="MS101")
+        Course.objects.create(title="Advanced Moose Studies", sis_course_id="MS201")
+        Course.objects.create(title="Moose", sis_course_id="ABC")
+
+        url = reverse("api:course-search")
+        response = self.client.get(url, {"q": "Moose"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 3)
+        results = response.data["results"]
+        self.assertEqual(
+            sorted(results[0].keys()),
+            sorted(
+                [
+                    "id",
+                    "title",
+                    "sis_course_id",
+                    "lti_context_title",
+                    "lti_context_label",
+                    "url",
+                ]
+            ),
+        )
+        # Prefix matches are ranked first
+        self.assertEqual(results[0]["title"], "Moose")
+        self.assertEqual(
+            sorted(r["title"] for r in results[1:]),
+            ["Advanced Moose Studies", "Intro to Moose Studies"],
+        )
+
+        response = self.client.get(url, {"q": "MS2"})
+        self.assertEqual(
+            [r["sis_course_id"] for r in response.data["results"]], ["MS201"]
+        )
+
+    def test_search_is_capped_and_paginated(self):
+        for n in range(120):
+            Course.objects.create(title="Capped %03d" % n)
+
+        url = reverse("api:course-search")
+        response = self.client.get(url, {"q": "Capped", "limit": 10, "offset": 95})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 100)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_search_without_query(self):
+        url = reverse("api:course-search")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 0)
+
+
+class TestMediaStoreEndpoint(BaseApiTestCase):
+    def setUp(self):
+        self.client.force_authenticate(self._create_test_nonsuperuser())
+        self.media_store = MediaStore.objects.create(
+            file_name="a.jpg",
+            file_size=100,
+            file_md5hash="0123456789abcdef0123456789abcdef",
+            file_type="image/jpeg",
+            file_extension="jpg",
+            img_width=800,
+            img_height=600,
+        )
+
+    def test_media_exists(self):
+        url = reverse("api:media-detail", kwargs={"md5": self.media_store.file_md5hash})
+        response = self.client.head(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(url)
+        self.assertEqual(response.data["file_size"], 100)
+        self.assertEqual(response.data["img_width"], 800)
+
+        url = reverse("api:media-detail", kwargs={"md5": "f" * 32})
+        response = self.client.head(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_media_lookup(self):
+        url = reverse("api:media-lookup")
+        hashes = [self.media_store.file_md5hash, "f" * 32]
+        response = self.client.post(url, {"hashes": hashes}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data["existing"]), [hashes[0]])
+        self.assertEqual(response.data["missing"], [hashes[1]])
+
+        for data in ({}, {"hashes": ["not a hash"]}):
+            response = self.client.post(url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,4 +1,4 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework.urlpatterns import format_suffix_patterns
 
 from . import views
@@ -70,11 +70,36 @@ urlpatterns = [
         views.CourseImagesListView.as_view(),
         name="course-images",
     ),
+    path(
+        "courses/<int:pk>/images/search",
+        views.CourseImagesSearchView.as_view(),
+        name="course-images-search",
+    ),
+    path(
+        "courses/<int:pk>/images/sprite",
+        views.CourseImagesSpriteView.as_view(),
+        name="course-images-sprite",
+    ),
+    path(
+        "courses/<int:pk>/sprites/<slug:key>.jpg",
+        views.CourseSpriteImageView.as_view(),
+        name="course-images-sprite-image",
+    ),
     path(
         "courses/<int:pk>/library_export",
         views.CourseImagesListCsvExportView.as_view(),
         name="course-images-csv",
     ),
+    path(
+        "courses/<int:pk>/library_import",
+        views.CourseLibraryImportView.as_view(),
+        name="course-library-import",
+    ),
+    path(
+        "courses/<int:pk>/upload_sessions",
+        views.CourseUploadSessionsView.as_view(),
+        name="course-upload-sessions",
+    ),
     path("collections", collection_list, name="collection-list"),
     path("collections/<int:pk>", collection_detail, name="collection-detail"),
     path(
@@ -88,7 +113,32 @@ urlpatterns = [
         name="collectionimages-detail",
     ),
     path("images", image_list, name="image-list"),
+    path("images/search", views.ImageSearchView.as_view(), name="image-search"),
     path("images/<int:pk>", image_detail, name="image-detail"),
+    path(
+        "ingest_jobs/<int:pk>", views.IngestJobView.as_view(), name="ingest-job-detail"
+    ),
+    path("media/lookup", views.MediaStoreLookupView.as_view(), name="media-lookup"),
+    re_path(
+        r"^media/(?P<md5>[0-9a-fA-F]{32})$",
+        views.MediaStoreView.as_view(),
+        name="media-detail",
+    ),
+    path(
+        "upload_sessions/<int:pk>/chunks",
+        views.UploadSessionChunksView.as_view(),
+        name="upload-session-chunks",
+    ),
+    path(
+        "upload_sessions/<int:pk>/finalize",
+        views.UploadSessionFinalizeView.as_view(),
+        name="upload-session-finalize",
+    ),
+    path(
+        "upload_sessions/staging/<str:token>",
+        views.StagingUploadView.as_view(),
+        name="upload-staging",
+    ),
     path("iiif/", include("media_management_api.media_service.iiif.urls")),
 ]
 
@@ -1,39 +1,154 @@
+import itertools
 import logging
+import zipfile
 
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
-from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import exceptions, status, viewsets
+from django.utils import timezone
+from django.utils.http import urlencode
+from rest_framework import exceptions, pagination, status, viewsets
 from rest_framework.generics import GenericAPIView
 from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 from rest_framework_csv.renderers import CSVRenderer
 
+from media_management_api.routers import use_primary
+
+from .admission import AdmissionControlMixin
+from .aio import AsyncAPIView, database_sync_to_async, in_database_pool
 from .filters import IsCourseUserFilterBackend
-from .mediastore import processFileUploads, processRemoteImages
+from .idempotency import IdempotencyMixin
+from .ingest import IngestException, create_job
+from .library_import import LibraryImport, LibraryImportException
+from .mediastore import (
+    MediaStoreException,
+    analyzeImages,
+    getMediaStoresByHash,
+    processFileUploads,
+    processRemoteImagesAsync,
+)
 from .models import (
     Collection,
     CollectionResource,
     Course,
     CourseCopy,
     CourseUser,
+    ImageProjection,
+    IngestJob,
+    RemoteFetchCache,
     Resource,
+    UploadSession,
 )
 from .permissions import IsCourseUserAuthenticated
 from .serializers import (
+    CollectionImageListSerializer,
     CollectionResourceSerializer,
     CollectionSerializer,
     CourseCopySerializer,
+    CourseSearchResultSerializer,
     CourseSerializer,
     CsvExportResourceSerializer,
+    ImageListSerializer,
+    IngestJobSerializer,
+    MediaStoreSerializer,
+    ResourceBulkUpdateSerializer,
     ResourceSerializer,
+    UploadSessionSerializer,
+)
+from .sprites import (
+    SPRITE_INCOMPLETE_TIMEOUT,
+    SpriteException,
+    get_cached_sprite,
+    get_members,
+    get_sprite,
+    is_complete,
+)
+from .staging import (
+    ChunkChecksumException,
+    ChunkedUpload,
+    ChunkOffsetException,
+    LocalUploadStaging,
+    StagedUpload,
+    get_upload_staging,
 )
 
 logger = logging.getLogger(__name__)
 
+STREAMING_LIST_THRESHOLD = settings.STREAMING_LIST_THRESHOLD
+
+
+def list_response(request, serializer):
+    """
+    Returns the response for a list serialized with a ValuesListSerializer.
+
+    Small lists get a regular Response. Once a list reaches STREAMING_LIST_THRESHOLD items
+    and the accepted renderer can render incrementally, the list is streamed to the client
+    as a chunked JSON array instead of being rendered in memory.
+    """
+    items = serializer.iter_data()
+    renderer = getattr(request, "accepted_renderer", None)
+    if not hasattr(renderer, "render_iter"):
+        return Response(list(items))
+    # Under ASGI, Django 3.2 consumes streaming content on the event loop, where the
+    # database can't be queried. On the async views' database pool, the connection is
+    # closed once the handler returns, and the response is consumed on another thread.
+    # In both cases the list is rendered in memory instead.
+    if isinstance(request._request, ASGIRequest) or in_database_pool():
+        return Response(list(items))
+    head = list(itertools.islice(items, STREAMING_LIST_THRESHOLD))
+    if len(head) < STREAMING_LIST_THRESHOLD:
+        return Response(head)
+    return StreamingHttpResponse(
+        renderer.render_iter(itertools.chain(head, items)),
+        content_type=renderer.media_type,
+    )
+
+
+def filter_images_by_metadata(request, queryset):
+    """
+    Filters a queryset of image projections by any "metadata.<label>=<value>" query
+    parameters. Multiple parameters must all match.
+    """
+    for param, values in request.GET.lists():
+        if not param.startswith("metadata."):
+            continue
+        label = param[len("metadata.") :]
+        if not label:
+            raise exceptions.ValidationError(
+                "Metadata filter '%s' is missing a label." % param
+            )
+        for value in values:
+            queryset = ImageProjection.filter_metadata(label, value, queryset=queryset)
+    return queryset
+
+
+class ImageSearchPagination(pagination.PageNumberPagination):
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+def image_search_response(request, queryset):
+    """
+    Returns a page of image search results for the "q" query parameter.
+    """
+    searchtext = request.GET.get("q", "").strip()
+    if not searchtext:
+        raise exceptions.ValidationError("Must provide a search query 'q'.")
+    queryset = ImageProjection.search(searchtext, queryset=queryset)
+    paginator = ImageSearchPagination()
+    page = paginator.paginate_queryset(
+        queryset.values(*ImageListSerializer.values), request
+    )
+    serializer = ImageListSerializer(page, context={"request": request})
+    return paginator.get_paginated_response(serializer.data)
+
 
 class APIRoot(APIView):
     def get(self, request, format=None):
@@ -62,6 +177,8 @@ class CourseViewSet(viewsets.ModelViewSet):
     - `/courses/{pk}/course_copy` Lists a course's copy records
     - `/courses/{pk}/collections` Lists a course's collections
     - `/courses/{pk}/images`  Lists a course's images
+    - `/courses/{pk}/images/search?q=text` Searches a course's images
+    - `/courses/{pk}/images/sprite` Sprite of a page of a course's images
     - `/courses/{pk}/library_export` Exports a course's images data to CSV
 
     Querying the list of courses
@@ -151,10 +268,15 @@ class CourseViewSet(viewsets.ModelViewSet):
         )
 
 
+class CourseSearchPagination(pagination.LimitOffsetPagination):
+    default_limit = 20
+    max_limit = 50
+
+
 class CourseSearchView(GenericAPIView):
 
     """
-    Search courses by title or SIS ID.
+    Search courses by title, LTI context title/label or SIS ID.
 
     Endpoints
     ---------
@@ -166,27 +288,51 @@ class CourseSearchView(GenericAPIView):
 
     - `GET /courses/search?q=title|sis_course_id`
 
+    Details
+    -------
+
+    Intended for typeahead use: results are ranked (title and SIS ID prefix matches first),
+    capped at 100 matches, paginated with `limit` and `offset`, and use a lightweight
+    representation of the course:
+
+        {
+            "count": 1,
+            "next": null,
+            "previous": null,
+            "results": [{
+                "id": 1,
+                "title": "Test",
+                "sis_course_id": "sis123",
+                "lti_context_title": "Test",
+                "lti_context_label": "Test",
+                "url": "http://localhost:8000/courses/1"
+            }]
+        }
+
     """
 
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
+    pagination_class = CourseSearchPagination
     permission_classes = (IsAuthenticated,)
+    max_results = 100
 
     def get(self, request, format=None):
-        queryset = self.get_queryset()
-        if "q" not in self.request.GET:
-            return Response([])
-        searchtext = self.request.GET["q"]
-        queryset = queryset.filter(
-            Q(title__startswith=searchtext) | Q(sis_course_id__startswith=searchtext)
-        )
-        serializer = self.get_serializer(
-            queryset, many=True, context={"request": request}
-        )
-        return Response(serializer.data)
+        searchtext = self.request.GET.get("q", "").strip()
+        rows = []
+        if searchtext:
+            queryset = Course.search(searchtext, queryset=self.get_queryset())
+            rows = list(
+                queryset.values(*CourseSearchResultSerializer.values)[
+                    : self.max_results
+                ]
+            )
+        page = self.paginate_queryset(rows)
+        serializer = CourseSearchResultSerializer(page, context={"request": request})
+        return self.get_paginated_response(serializer.data)
 
 
-class CourseCopyView(GenericAPIView):
+class CourseCopyView(AdmissionControlMixin, IdempotencyMixin, GenericAPIView):
     """
     A **course copy** resource is used tocopy of another course's collections and image resources.
 
@@ -204,11 +350,15 @@ class CourseCopyView(GenericAPIView):
 
     You must specify `{source_id: "<pk>"}` when submitting a POST request. The value of the `source_id` should be
     the primary key of the course being copied.
+
+    A POST may be sent with an `Idempotency-Key` header, so that it can be retried
+    safely: retries with the same key get the response to the first request.
     """
 
     queryset = CourseCopy.objects.all()
     serializer_class = CourseCopySerializer
     permission_classes = (IsCourseUserAuthenticated,)
+    admission_classes = {"POST": "copy"}
 
     def get(self, request, pk, format=None):
         course_pk = pk
@@ -420,6 +570,7 @@ class CourseCollectionsView(GenericAPIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @use_primary()
     def put(self, request, pk=None, format=None):
         course_pk = pk
         course = get_object_or_404(Course, pk=course_pk)
@@ -501,7 +652,9 @@ class CourseCollectionsView(GenericAPIView):
         return Response({"message": msg})
 
 
-class CourseImagesListView(GenericAPIView):
+class CourseImagesListView(
+    AdmissionControlMixin, IdempotencyMixin, AsyncAPIView, GenericAPIView
+):
     """
     A **course images** resource is a set of *images* that belong to a *course*.
     This is also referred to as the course's image library.
@@ -515,9 +668,21 @@ class CourseImagesListView(GenericAPIView):
     -------
 
     - `GET /courses/{pk}/images`  Lists images that belong to the course
+    - `GET /courses/{pk}/images?metadata.<label>=<value>`  Lists images with a matching metadata pair
     - `POST /courses/{pk}/images` Uploads an image to the course
+    - `PUT /courses/{pk}/images` Updates a batch of images that belong to the course
     - `DELETE /courses/{pk}/images` Deletes images that belong to the course
 
+    To import images by URL, POST `{items: [{url: "<url>", title: "<title>"}, ...]}`. Items
+    may give the `md5` hash of an image that is already in the media store (see
+    `HEAD /media/{md5}`) instead of a `url`, which links the image without uploading it.
+
+    A POST may be sent with an `Idempotency-Key` header, so that it can be retried
+    safely: retries with the same key get the response to the first request.
+
+    Uploads sent with a `Prefer: respond-async` header are added to the course in the
+    background. The response is a 202 with the *ingest job* (see `GET /ingest_jobs/{pk}`)
+    in its body and `Location` header.
     """
 
     serializer_class = ResourceSerializer
@@ -526,6 +691,7 @@ class CourseImagesListView(GenericAPIView):
     permission_classes = (IsCourseUserAuthenticated,)
     filter_backends = (IsCourseUserFilterBackend,)
     course_user_filter_key = "course__pk__in"
+    admission_classes = {"POST": "ingest"}
 
     def get_queryset(self):
         queryset = super(CourseImagesListView, self).get_queryset()
@@ -533,76 +699,213 @@ class CourseImagesListView(GenericAPIView):
 
     def get(self, request, pk=None, format=None):
         course_pk = pk
-        queryset = self.get_queryset()
+        queryset = self.filter_queryset(ImageProjection.objects.all())
+        queryset = filter_images_by_metadata(request, queryset)
         queryset = queryset.filter(course__pk=course_pk).order_by("sort_order")
-        serializer = self.get_serializer(
-            queryset, many=True, context={"request": request}
-        )
-        return Response(serializer.data)
+        serializer = ImageListSerializer(queryset, context={"request": request})
+        return list_response(request, serializer)
 
-    def post(self, request, pk=None, format=None):
+    async def post(self, request, pk=None, format=None):
         logger.debug(
             "request content_type=%s data=%s" % (request.content_type, request.data)
         )
-        request_data = request.data
+        course = await database_sync_to_async(self.get_course)(request, pk)
+        request.data["course_id"] = course.pk
+
+        # Handle images uploaded directly, in the background if the client prefers
+        is_upload = request.content_type.startswith("multipart/form-data")
+        if is_upload and self.prefers_async(request):
+            return await database_sync_to_async(self.create_ingest_job)(request, course)
+        elif is_upload:
+            serializers = await database_sync_to_async(self.get_upload_serializers)(
+                request, course
+            )
+        # Handle import of images by URL, provided in a JSON message
+        elif request.content_type.startswith("application/json"):
+            serializers = await self.get_import_serializers(request, course)
+        else:
+            raise exceptions.APIException(
+                "Error: content type '%s' not supported" % request.content_type
+            )
+
+        # Complete the process by serializing the resources
+        return await database_sync_to_async(self.save_serializers)(serializers)
+
+    @use_primary()
+    def put(self, request, pk=None, format=None):
         course_pk = pk
         course = get_object_or_404(Course, pk=course_pk)
         self.check_object_permissions(request, course)
 
-        request_data["course_id"] = course.pk
-        response_data = []
-        serializers = []
+        data = request.data
+        if not isinstance(data, dict) or not isinstance(data.get("items"), list):
+            raise exceptions.APIException(
+                "Must specify 'items' to update a batch of images for course %s."
+                % course_pk
+            )
 
-        # Handle images uploaded directly
-        if request.content_type.startswith("multipart/form-data"):
-            file_param = "file"
-            if file_param not in request.FILES:
-                raise exceptions.APIException(
-                    "Error: missing '%s' parameter in upload" % file_param
-                )
-            elif len(request.FILES) == 0:
-                raise exceptions.APIException("Error: no files uploaded")
-            logger.debug("File uploads: %s" % request.FILES.getlist(file_param))
-            processed_uploads = processFileUploads(request.FILES.getlist(file_param))
-            for index, f in processed_uploads.items():
-                data = request_data
-                logger.debug("Processing file upload: %s" % f.name)
-                serializer = self.get_serializer(
-                    data=data,
-                    context={"request": request},
-                    is_upload=True,
-                    file_object=f,
-                )
-                serializers.append(serializer)
+        # Validate all of the items before anything is changed
+        serializer = ResourceBulkUpdateSerializer(data=data["items"], many=True)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data
+        item_ids = [item["id"] for item in items]
+        if len(set(item_ids)) != len(item_ids):
+            raise exceptions.ValidationError(
+                "Error updating images. Each image may only be given once."
+            )
+        resources = Resource.objects.filter(course=course).in_bulk(item_ids)
+        if len(resources) != len(item_ids):
+            missing = sorted(set(item_ids) - set(resources))
+            raise exceptions.APIException(
+                "Error updating images. Given image items MUST be a subset of the course images. Not found: %s"
+                % missing
+            )
 
-        # Handle import of images by URL, provided in a JSON message
-        elif request.content_type.startswith("application/json"):
-            logger.debug("Request data: %s" % request_data)
-            MAX_IMAGE_ITEMS = (
-                10  # max number of item urls that we will import at a time
+        now = timezone.now()
+        fields = {"updated"}
+        for item in items:
+            resource = resources[item["id"]]
+            for field, value in item.items():
+                if field == "id":
+                    continue
+                if field == "metadata" and value is None:
+                    value = []
+                setattr(resource, field, value)
+                fields.add(field)
+            resource.updated = now
+
+        logger.debug("Updating images: %s fields: %s" % (item_ids, sorted(fields)))
+        with transaction.atomic():
+            Resource.objects.bulk_update(
+                resources.values(), sorted(fields), batch_size=500
             )
-            if "items" not in request_data or not isinstance(
-                request_data["items"], list
-            ):
-                raise exceptions.APIException(
-                    "Error: missing 'items' parameter for JSON upload"
-                )
-            elif len(request_data["items"]) == 0:
-                raise exceptions.APIException("Error: empty image items")
-            elif len(request_data["items"]) > MAX_IMAGE_ITEMS:
-                raise exceptions.APIException(
-                    "Error: exceeded maximum number of image items (max=%d)."
-                    % MAX_IMAGE_ITEMS
+            # bulk_update() doesn't send post_save, so refresh the projections here
+            ImageProjection.refresh(item_ids)
+
+        queryset = ImageProjection.objects.filter(resource__in=item_ids).order_by(
+            "sort_order"
+        )
+        serializer = ImageListSerializer(queryset, context={"request": request})
+        return Response(serializer.data)
+
+    def get_course(self, request, pk):
+        course = get_object_or_404(Course, pk=pk)
+        self.check_object_permissions(request, course)
+        return course
+
+    def prefers_async(self, request):
+        prefer = request.headers.get("Prefer", "")
+        return "respond-async" in [p.strip() for p in prefer.lower().split(",")]
+
+    def get_upload_files(self, request):
+        file_param = "file"
+        if file_param not in request.FILES:
+            raise exceptions.APIException(
+                "Error: missing '%s' parameter in upload" % file_param
+            )
+        elif len(request.FILES) == 0:
+            raise exceptions.APIException("Error: no files uploaded")
+        logger.debug("File uploads: %s" % request.FILES.getlist(file_param))
+        return request.FILES.getlist(file_param)
+
+    @use_primary()
+    def create_ingest_job(self, request, course):
+        try:
+            job = create_job(
+                course, request.user.profile, self.get_upload_files(request)
+            )
+        except (IngestException, zipfile.BadZipFile) as e:
+            raise exceptions.ValidationError(str(e))
+        job = IngestJob.objects.prefetch_related("items").get(pk=job.pk)
+        serializer = IngestJobSerializer(job, context={"request": request})
+        return Response(
+            serializer.data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": serializer.data["url"]},
+        )
+
+    def get_upload_serializers(self, request, course):
+        processed_uploads = processFileUploads(self.get_upload_files(request))
+        files = list(processed_uploads.values())
+        # Analyze the files in the process pool up front, rather than one at a time
+        analyses = analyzeImages(files)
+        serializers = []
+        for f, analysis in zip(files, analyses):
+            logger.debug("Processing file upload: %s" % f.name)
+            serializer = self.get_serializer(
+                data=request.data,
+                context={"request": request},
+                is_upload=True,
+                file_object=f,
+                file_analysis=analysis,
+            )
+            serializers.append(serializer)
+        return serializers
+
+    async def get_import_serializers(self, request, course):
+        request_data = request.data
+        logger.debug("Request data: %s" % request_data)
+        MAX_IMAGE_ITEMS = 10  # max number of item urls that we will import at a time
+        MAX_LINK_ITEMS = 1000  # max number of item hashes that we will link at a time
+        if "items" not in request_data or not isinstance(request_data["items"], list):
+            raise exceptions.APIException(
+                "Error: missing 'items' parameter for JSON upload"
+            )
+        elif len(request_data["items"]) == 0:
+            raise exceptions.APIException("Error: empty image items")
+        elif not all(isinstance(item, dict) for item in request_data["items"]):
+            raise exceptions.ValidationError("Error: image items must be objects")
+
+        # Items given by "md5" link to media that is already in the store, so nothing
+        # has to be fetched for them
+        url_items = [item for item in request_data["items"] if "md5" not in item]
+        link_items = [item for item in request_data["items"] if "md5" in item]
+        if len(url_items) > MAX_IMAGE_ITEMS:
+            raise exceptions.APIException(
+                "Error: exceeded maximum number of image items (max=%d)."
+                % MAX_IMAGE_ITEMS
+            )
+        elif len(link_items) > MAX_LINK_ITEMS:
+            raise exceptions.APIException(
+                "Error: exceeded maximum number of linked image items (max=%d)."
+                % MAX_LINK_ITEMS
+            )
+
+        serializers = []
+        if link_items:
+            serializers.extend(
+                await database_sync_to_async(self.get_link_serializers)(
+                    request, course, link_items
                 )
+            )
+        if url_items:
+            # URLs that were imported before are revalidated instead of downloaded
+            urls = [item["url"] for item in url_items if item.get("url")]
+            cache = await database_sync_to_async(RemoteFetchCache.get_for_urls)(urls)
             try:
-                processed_items = processRemoteImages(request_data["items"])
+                processed_items = await processRemoteImagesAsync(url_items, cache)
             except Exception as e:
                 raise exceptions.APIException(str(e))
+        else:
+            processed_items = {}
 
-            for url, item in processed_items.items():
-                f = item["file"]
-                data = item["data"].copy()
-                data["course_id"] = course.pk
+        for url, item in processed_items.items():
+            f = item["file"]
+            data = item["data"].copy()
+            data["course_id"] = course.pk
+            if f is None:
+                logger.debug(
+                    "Linking unchanged image url=%s media_store=%s data=%s"
+                    % (url, item["media_store"].pk, data)
+                )
+                serializer = self.get_serializer(
+                    data=data,
+                    context={"request": request},
+                    is_upload=False,
+                    file_url=url,
+                    media_store=item["media_store"],
+                )
+            else:
                 logger.debug(
                     "Processing image url=%s file=%s data=%s" % (url, f.name, data)
                 )
@@ -613,13 +916,43 @@ class CourseImagesListView(GenericAPIView):
                     file_object=f,
                     file_url=url,
                 )
-                serializers.append(serializer)
-        else:
-            raise exceptions.APIException(
-                "Error: content type '%s' not supported" % request.content_type
+            serializers.append(serializer)
+        return serializers
+
+    def get_link_serializers(self, request, course, items):
+        try:
+            media_stores = getMediaStoresByHash([str(item["md5"]) for item in items])
+        except MediaStoreException as e:
+            raise exceptions.ValidationError(str(e))
+
+        serializers = []
+        for item in items:
+            media_store = media_stores.get(str(item["md5"]).lower())
+            if media_store is None:
+                raise exceptions.ValidationError(
+                    "Error: no media with hash %s. Upload the image instead."
+                    % item["md5"]
+                )
+            data = {
+                "course_id": course.pk,
+                "title": item.get("title", "Untitled") or "Untitled",
+                "description": item.get("description", ""),
+            }
+            logger.debug(
+                "Linking image md5=%s media_store=%s data=%s"
+                % (item["md5"], media_store.pk, data)
+            )
+            serializer = self.get_serializer(
+                data=data,
+                context={"request": request},
+                is_upload=False,
+                media_store=media_store,
             )
+            serializers.append(serializer)
+        return serializers
 
-        # Complete the process by serializing the resources
+    def save_serializers(self, serializers):
+        response_data = []
         for serializer in serializers:
             if serializer.is_valid():
                 serializer.save()
@@ -647,6 +980,575 @@ class CourseImagesListView(GenericAPIView):
         return Response({"message": msg})
 
 
+class IngestJobView(GenericAPIView):
+    """
+    An **ingest job** adds a batch of uploaded images to a course in the background (see
+    `POST /courses/{pk}/images`).
+
+    Endpoints
+    ---------
+
+    - `/ingest_jobs/{pk}`
+
+    Methods
+    -------
+
+    - `GET /ingest_jobs/{pk}` Retrieves the state of the job and the outcome of each file
+
+    The job is `queued` until a worker picks it up, then `running` until every file has
+    been processed. Each item is `completed`, with the id of the new image, or has an
+    `error`.
+    """
+
+    queryset = IngestJob.objects.select_related("course").prefetch_related("items")
+    serializer_class = IngestJobSerializer
+    permission_classes = (IsCourseUserAuthenticated,)
+
+    def get(self, request, pk=None, format=None):
+        job = get_object_or_404(self.get_queryset(), pk=pk)
+        self.check_object_permissions(request, job.course)
+        serializer = self.get_serializer(job, context={"request": request})
+        return Response(serializer.data)
+
+
+class MediaStoreView(APIView):
+    """
+    Reports whether content with a given MD5 hash is already in the media store, so that
+    clients can skip uploading it and link to it instead (see `POST /courses/{pk}/images`).
+
+    Endpoints
+    ---------
+
+    - `/media/{md5}`
+
+    Methods
+    -------
+
+    - `HEAD /media/{md5}` Responds 200 if the content exists, 404 otherwise
+    - `GET /media/{md5}` Retrieves the type, size and dimensions of the content
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, md5=None, format=None):
+        media_store = getMediaStoresByHash([md5]).get(md5.lower())
+        if media_store is None:
+            raise exceptions.NotFound("No media with hash %s" % md5)
+        return Response(MediaStoreSerializer(media_store).data)
+
+
+class MediaStoreLookupView(APIView):
+    """
+    Checks a batch of MD5 hashes against the media store.
+
+    Endpoints
+    ---------
+
+    - `/media/lookup`
+
+    Methods
+    -------
+
+    - `POST /media/lookup` Checks the hashes given as `{hashes: ["<md5>", ...]}`
+
+    Returns `{existing: {"<md5>": {...}}, missing: ["<md5>", ...]}`.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    MAX_LOOKUP_HASHES = 1000
+
+    def post(self, request, format=None):
+        hashes = request.data.get("hashes") if isinstance(request.data, dict) else None
+        if not isinstance(hashes, list):
+            raise exceptions.ValidationError("Error: missing 'hashes' parameter")
+        elif len(hashes) > self.MAX_LOOKUP_HASHES:
+            raise exceptions.ValidationError(
+                "Error: exceeded maximum number of hashes (max=%d)."
+                % self.MAX_LOOKUP_HASHES
+            )
+        try:
+            media_stores = getMediaStoresByHash([str(h) for h in hashes])
+        except MediaStoreException as e:
+            raise exceptions.ValidationError(str(e))
+
+        existing = {}
+        missing = []
+        for h in hashes:
+            media_store = media_stores.get(str(h).lower())
+            if media_store is None:
+                missing.append(h)
+            else:
+                existing[h] = MediaStoreSerializer(media_store).data
+        return Response({"existing": existing, "missing": missing})
+
+
+class CourseUploadSessionsView(GenericAPIView):
+    """
+    An **upload session** lets a client upload an image straight to storage with a
+    presigned URL instead of through the API, which is preferred for large images.
+
+    Endpoints
+    ---------
+
+    - `/courses/{pk}/upload_sessions`
+    - `/upload_sessions/{pk}/chunks`
+    - `/upload_sessions/{pk}/finalize`
+
+    Methods
+    -------
+
+    - `GET /courses/{pk}/upload_sessions` Lists the course's upload sessions
+    - `POST /courses/{pk}/upload_sessions` Starts upload sessions for a batch of images
+    - `HEAD /upload_sessions/{pk}/chunks` Gets the offset of a chunked upload
+    - `PATCH /upload_sessions/{pk}/chunks` Uploads the next chunk of a chunked upload
+    - `POST /upload_sessions/{pk}/finalize` Adds the uploaded image to the course
+
+    To start the sessions, POST `{files: [{file_name, file_size, file_md5hash, file_type},
+    ...]}`. Each session in the response has an `upload` with the `url`, `method` and
+    `headers` of the request that uploads the file. Once the file has been uploaded,
+    finalizing the session checks it and returns the new course image.
+
+    Files given with `chunked: true` are instead uploaded to the API in chunks, which lets
+    an interrupted upload be resumed. See `UploadSessionChunksView`.
+    """
+
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = (IsCourseUserAuthenticated,)
+    MAX_UPLOAD_SESSIONS = 100
+
+    def get(self, request, pk=None, format=None):
+        course = get_object_or_404(Course, pk=pk)
+        self.check_object_permissions(request, course)
+        queryset = self.get_queryset().filter(course=course)
+        if "state" in request.GET:
+            queryset = queryset.filter(state=request.GET["state"])
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    @use_primary()
+    def post(self, request, pk=None, format=None):
+        course = get_object_or_404(Course, pk=pk)
+        self.check_object_permissions(request, course)
+
+        files = request.data.get("files") if isinstance(request.data, dict) else None
+        if not isinstance(files, list) or len(files) == 0:
+            raise exceptions.ValidationError("Error: missing 'files' parameter")
+        elif len(files) > self.MAX_UPLOAD_SESSIONS:
+            raise exceptions.ValidationError(
+                "Error: exceeded maximum number of files (max=%d)."
+                % self.MAX_UPLOAD_SESSIONS
+            )
+        serializer = self.get_serializer(data=files, many=True)
+        serializer.is_valid(raise_exception=True)
+        sessions = serializer.save(course=course, owner=request.user.profile)
+
+        staging = get_upload_staging()
+        response_data = []
+        for session, data in zip(sessions, serializer.data):
+            if session.chunked:
+                data["upload"] = self.get_chunked_upload(request, session)
+            else:
+                data["upload"] = staging.get_upload(request, session)
+            response_data.append(data)
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+    def get_chunked_upload(self, request, session):
+        url = reverse(
+            "api:upload-session-chunks", kwargs={"pk": session.pk}, request=request
+        )
+        headers = {
+            "Content-Type": UploadSessionChunksView.content_type,
+            "Upload-Offset": str(session.offset),
+        }
+        return {"url": url, "method": "PATCH", "headers": headers}
+
+
+class UploadSessionChunksView(GenericAPIView):
+    """
+    Receives the file of a chunked *upload session* one chunk at a time, in the style of
+    the tus resumable upload protocol.
+
+    Endpoints
+    ---------
+
+    - `/upload_sessions/{pk}/chunks`
+
+    Methods
+    -------
+
+    - `HEAD /upload_sessions/{pk}/chunks` Gets the offset to resume the upload from
+    - `PATCH /upload_sessions/{pk}/chunks` Uploads the next chunk
+
+    Each chunk is sent as the body of a PATCH with the `Content-Type` set to
+    `application/offset+octet-stream` and the `Upload-Offset` header set to the offset
+    the chunk starts at. An `Upload-Checksum: <algorithm> <base64 digest>` header (md5,
+    sha1 or sha256) is checked against the chunk. The response gives the new offset in
+    the `Upload-Offset` header. A chunk at the wrong offset is rejected with 409, and a
+    chunk that doesn't match its checksum with 460. After an interruption, get the offset
+    with HEAD and resume from there.
+    """
+
+    queryset = UploadSession.objects.select_related("course")
+    permission_classes = (IsCourseUserAuthenticated,)
+    content_type = "application/offset+octet-stream"
+    CHECKSUM_MISMATCH = 460
+
+    def get_session(self, request, pk):
+        session = get_object_or_404(self.get_queryset(), pk=pk, chunked=True)
+        self.check_object_permissions(request, session.course)
+        return session
+
+    def get_offset_headers(self, session):
+        return {
+            "Upload-Offset": str(session.offset),
+            "Upload-Length": str(session.file_size),
+            "Cache-Control": "no-store",
+        }
+
+    def get(self, request, pk=None, format=None):
+        session = self.get_session(request, pk)
+        return Response(headers=self.get_offset_headers(session))
+
+    @use_primary()
+    def patch(self, request, pk=None, format=None):
+        session = self.get_session(request, pk)
+        if session.state != UploadSession.STATE_PENDING:
+            raise exceptions.ValidationError(
+                "Error: upload session %s is %s." % (session.pk, session.state)
+            )
+        if request.content_type != self.content_type:
+            raise exceptions.UnsupportedMediaType(request.content_type)
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            raise exceptions.ValidationError("Error: missing 'Upload-Offset' header")
+
+        try:
+            ChunkedUpload(session).append(
+                offset, request._request, request.headers.get("Upload-Checksum")
+            )
+        except ChunkOffsetException as e:
+            session.offset = e.offset
+            return Response(
+                {"detail": str(e)},
+                status=status.HTTP_409_CONFLICT,
+                headers=self.get_offset_headers(session),
+            )
+        except ChunkChecksumException as e:
+            return Response({"detail": str(e)}, status=self.CHECKSUM_MISMATCH)
+        except MediaStoreException as e:
+            raise exceptions.ValidationError(str(e))
+        return Response(
+            status=status.HTTP_204_NO_CONTENT,
+            headers=self.get_offset_headers(session),
+        )
+
+
+class UploadSessionFinalizeView(GenericAPIView):
+    """
+    Finalizes an *upload session*, adding the uploaded image to the course.
+
+    Endpoints
+    ---------
+
+    - `/upload_sessions/{pk}/finalize`
+
+    Methods
+    -------
+
+    - `POST /upload_sessions/{pk}/finalize` Adds the uploaded image to the course
+
+    Finalizing a session that has already completed returns the same image.
+    """
+
+    queryset = UploadSession.objects.select_related("course")
+    serializer_class = ResourceSerializer
+    permission_classes = (IsCourseUserAuthenticated,)
+
+    @use_primary()
+    def post(self, request, pk=None, format=None):
+        session = get_object_or_404(self.get_queryset(), pk=pk)
+        self.check_object_permissions(request, session.course)
+
+        # The session is locked while it is finalized, so a concurrent request waits
+        # for it and then finds it completed, rather than adding the image again
+        self.session_error = None
+        try:
+            with transaction.atomic():
+                session = (
+                    UploadSession.objects.select_for_update()
+                    .select_related("course", "resource")
+                    .get(pk=session.pk)
+                )
+                if session.state == UploadSession.STATE_COMPLETED and session.resource:
+                    serializer = self.get_serializer(
+                        session.resource, context={"request": request}
+                    )
+                    return Response(serializer.data)
+                if session.chunked:
+                    return self.finalize_chunked(request, session)
+                return self.finalize_staged(request, session)
+        finally:
+            # Recorded once the transaction has been rolled back
+            if self.session_error is not None:
+                session.fail(self.session_error)
+
+    def finalize_staged(self, request, session):
+        try:
+            media_store = StagedUpload(session).finalize()
+        except MediaStoreException as e:
+            self.session_error = str(e)
+            raise exceptions.ValidationError(str(e))
+
+        serializer = self.get_serializer(
+            data={"course_id": session.course.pk, "title": session.file_name},
+            context={"request": request},
+            is_upload=True,
+            media_store=media_store,
+        )
+        serializer.is_valid(raise_exception=True)
+        resource = serializer.save(original_file_name=session.file_name)
+        session.complete(resource)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def finalize_chunked(self, request, session):
+        """
+        Hands the assembled file of a chunked upload to the MediaStoreUpload pipeline,
+        like a file uploaded to `POST /courses/{pk}/images`.
+        """
+        chunked_upload = ChunkedUpload(session)
+        try:
+            f = chunked_upload.open()
+        except MediaStoreException as e:
+            raise exceptions.ValidationError(str(e))
+
+        try:
+            serializer = self.get_serializer(
+                data={"course_id": session.course.pk, "title": session.file_name},
+                context={"request": request},
+                is_upload=True,
+                file_object=f,
+            )
+            serializer.is_valid(raise_exception=True)
+            resource = serializer.save()
+        except exceptions.APIException as e:
+            self.session_error = str(e.detail)
+            raise
+        finally:
+            f.close()
+        chunked_upload.delete()
+        session.complete(resource)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class StagingUploadView(APIView):
+    """
+    Receives the files of upload sessions when the "local" staging backend stands in
+    for S3 (see staging.py). The signed token in the URL authorizes the upload.
+    """
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def put(self, request, token=None, format=None):
+        staging = get_upload_staging()
+        if not isinstance(staging, LocalUploadStaging):
+            raise exceptions.NotFound()
+        try:
+            md5hash = staging.save(token, request._request)
+        except MediaStoreException as e:
+            raise exceptions.ValidationError(str(e))
+        return Response(headers={"ETag": '"%s"' % md5hash})
+
+
+class CourseImagesSearchView(GenericAPIView):
+    """
+    Search the images that belong to a *course*.
+
+    Endpoints
+    ---------
+
+    - `/courses/{pk}/images/search`
+
+    Methods
+    -------
+
+    - `GET /courses/{pk}/images/search?q=text` Searches the course's images
+
+    The text is matched against the image title, description and metadata labels and values.
+    Results are ranked by relevance and paginated (`page`, `page_size`).
+    """
+
+    serializer_class = ResourceSerializer
+    queryset = ImageProjection.objects.all()
+    permission_classes = (IsCourseUserAuthenticated,)
+    filter_backends = (IsCourseUserFilterBackend,)
+    course_user_filter_key = "course__pk__in"
+
+    def get(self, request, pk=None, format=None):
+        course = get_object_or_404(Course, pk=pk)
+        self.check_object_permissions(request, course)
+        queryset = self.filter_queryset(self.get_queryset()).filter(course=course)
+        return image_search_response(request, queryset)
+
+
+class ImageSearchView(GenericAPIView):
+    """
+    Search images across all courses (staff only).
+
+    Endpoints
+    ---------
+
+    - `/images/search`
+
+    Methods
+    -------
+
+    - `GET /images/search?q=text` Searches all images
+    - `GET /images/search?q=text&course_id=<pk>` Searches the images of one course
+
+    Results are ranked by relevance and paginated (`page`, `page_size`).
+    """
+
+    serializer_class = ResourceSerializer
+    queryset = ImageProjection.objects.all()
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, format=None):
+        if not (request.user.is_staff or request.user.is_superuser):
+            raise exceptions.PermissionDenied(
+                "You do not have permission to search all images"
+            )
+        queryset = self.get_queryset()
+        if "course_id" in request.GET:
+            queryset = queryset.filter(course_id=request.GET["course_id"])
+        return image_search_response(request, queryset)
+
+
+class CourseImagesSpriteView(AsyncAPIView):
+    """
+    A **sprite** combines the thumbnails of a page of a course's images into one JPEG,
+    so that a grid of the images can be shown with a single request (see sprites.py).
+
+    Endpoints
+    ---------
+
+    - `/courses/{pk}/images/sprite`
+
+    Methods
+    -------
+
+    - `GET /courses/{pk}/images/sprite?page=1&page_size=100` Retrieves the map of the
+      sprite of a page of the course's images, in sort order
+
+    The map gives the `url` of the sprite's JPEG and the box (`x`, `y`, `width`,
+    `height`) of each image on it. Images whose thumbnail couldn't be made are not
+    `loaded`, and are shown in their dominant colour. A sprite's URL changes whenever
+    its images do, so the JPEG of a sprite whose images are all loaded can be cached
+    for good.
+    """
+
+    permission_classes = (IsCourseUserAuthenticated,)
+
+    async def get(self, request, pk=None, format=None):
+        page = self.get_int_param(request, "page", 1)
+        page_size = min(
+            self.get_int_param(request, "page_size", settings.SPRITE_PAGE_SIZE),
+            settings.SPRITE_MAX_PAGE_SIZE,
+        )
+        course, members, count = await database_sync_to_async(self.get_members)(
+            request, pk, page, page_size
+        )
+        try:
+            sprite = await get_sprite(course.pk, members)
+        except SpriteException as e:
+            exc = exceptions.APIException(str(e))
+            exc.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+            raise exc
+
+        # The page lets the JPEG be made again if it's evicted from the cache
+        url = "%s?%s" % (
+            reverse(
+                "api:course-images-sprite-image",
+                kwargs={"pk": course.pk, "key": sprite["key"]},
+            ),
+            urlencode({"page": page, "page_size": page_size}),
+        )
+        data = {
+            "url": request.build_absolute_uri(url),
+            "page": page,
+            "page_size": page_size,
+            "count": count,
+        }
+        data.update(sprite["map"])
+        return Response(data)
+
+    def get_int_param(self, request, name, default):
+        try:
+            value = int(request.GET.get(name, default))
+        except ValueError:
+            value = 0
+        if value < 1:
+            raise exceptions.ValidationError(
+                "Invalid %s. Expected a positive integer." % name
+            )
+        return value
+
+    def get_members(self, request, pk, page, page_size):
+        course = get_object_or_404(Course, pk=pk)
+        self.check_object_permissions(request, course)
+        members = get_members(course.pk, page, page_size)
+        count = ImageProjection.objects.filter(course_id=course.pk).count()
+        return course, members, count
+
+
+class CourseSpriteImageView(AsyncAPIView):
+    """
+    Serves the JPEG of a sprite (see `/courses/{pk}/images/sprite`). The key of a sprite
+    can't be guessed without knowing its images, so it authorizes the request, like the
+    image server's URLs do, and the JPEG can be loaded by an `img` element.
+
+    A sprite that is no longer cached is made again from the `page` and `page_size` in
+    its URL, as long as the page's images haven't changed. A sprite that is missing
+    thumbnails is only cached briefly, since it's made again with them.
+    """
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    async def get(self, request, pk=None, key=None, format=None):
+        page, page_size = self.get_page(request)
+        try:
+            sprite = await get_cached_sprite(pk, key, page, page_size)
+        except SpriteException as e:
+            exc = exceptions.APIException(str(e))
+            exc.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+            raise exc
+        if sprite is None:
+            raise exceptions.NotFound()
+        response = HttpResponse(sprite["content"], content_type="image/jpeg")
+        if is_complete(sprite):
+            response["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response["Cache-Control"] = "public, max-age=%d" % SPRITE_INCOMPLETE_TIMEOUT
+        return response
+
+    def get_page(self, request):
+        """
+        Returns the page and page size given in the sprite's URL, or None if they're
+        missing or out of range.
+        """
+        try:
+            page = int(request.GET["page"])
+            page_size = int(request.GET["page_size"])
+        except (KeyError, ValueError):
+            return None, None
+        if page < 1 or not 1 <= page_size <= settings.SPRITE_MAX_PAGE_SIZE:
+            return None, None
+        return page, page_size
+
+
 class CourseImagesListCsvExportView(GenericAPIView):
     """
     A **course images** resource is a set of *images* that belong to a *course*.
@@ -660,7 +1562,7 @@ class CourseImagesListCsvExportView(GenericAPIView):
     Methods
     -------
 
-    - `GET /courses/{pk}/library_export`  Exports images that belong to the course
+    - `GET /courses/{pk}/library_export`  Exports images that belong to the course (see `library_import`)
 
     """
 
@@ -688,6 +1590,58 @@ class CourseImagesListCsvExportView(GenericAPIView):
         return Response(serializer.data)
 
 
+class CourseLibraryImportView(AdmissionControlMixin, GenericAPIView):
+    """
+    Imports a CSV file in the library export format, updating the title, description and
+    metadata of the images that belong to a *course*. The `url` and `iiif_url` columns are
+    ignored. Returns a report with the outcome of every row.
+
+    The rows are applied a chunk at a time. If a row can't be read (it isn't valid UTF-8
+    or CSV), the import stops at that row and the response is a 400 whose body is the
+    report of the rows before it, which were applied, with a `detail` message.
+
+    Endpoints
+    ----------------
+
+    - `/courses/{pk}/library_import`
+
+    Methods
+    -------
+
+    - `POST /courses/{pk}/library_import`  Imports the CSV file uploaded as `file`
+
+    """
+
+    queryset = Course.objects.all()
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = (IsCourseUserAuthenticated,)
+    admission_classes = {"POST": "ingest"}
+
+    @use_primary()
+    def post(self, request, pk=None, format=None):
+        course = get_object_or_404(Course, pk=pk)
+        self.check_object_permissions(request, course)
+
+        file_param = "file"
+        if file_param not in request.FILES:
+            raise exceptions.APIException(
+                "Error: missing '%s' parameter in upload" % file_param
+            )
+        library_import = LibraryImport(course, request.FILES[file_param])
+        try:
+            report = library_import.run()
+        except LibraryImportException as e:
+            raise exceptions.ValidationError(str(e))
+        logger.info(
+            "Library import for course %s: %s updated, %s unchanged, %s errors"
+            % (course.pk, report["updated"], report["unchanged"], report["error"])
+        )
+        if library_import.read_error:
+            report["detail"] = library_import.read_error
+            return Response(report, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
+
 class CollectionImagesListView(GenericAPIView):
     """
     A **collection images** resource is a set of *images* that are associated with a *collection*.
@@ -701,12 +1655,11 @@ class CollectionImagesListView(GenericAPIView):
     -------
 
     - `GET /collections/{pk}/images`  Lists images that belong to the course
+    - `GET /collections/{pk}/images?metadata.<label>=<value>`  Lists images with a matching metadata pair
     - `POST /collections/{pk}/images` Adds images to the collection that already exist in the course library.
     """
 
-    queryset = CollectionResource.objects.select_related(
-        "collection", "resource"
-    ).prefetch_related("resource__media_store")
+    queryset = CollectionResource.objects.all()
     serializer_class = CollectionResourceSerializer
     permission_classes = (IsCourseUserAuthenticated,)
     filter_backends = (IsCourseUserFilterBackend,)
@@ -719,10 +1672,18 @@ class CollectionImagesListView(GenericAPIView):
     def get(self, request, pk=None, format=None):
         queryset = self.get_queryset()
         queryset = queryset.filter(collection__pk=pk).order_by("sort_order")
-        serializer = self.get_serializer(
-            queryset, many=True, context={"request": request}
+        if any(param.startswith("metadata.") for param in request.GET):
+            projections = ImageProjection.objects.filter(
+                resource__in=queryset.values("resource")
+            )
+            resource_ids = filter_images_by_metadata(request, projections).values_list(
+                "resource", flat=True
+            )
+            queryset = queryset.filter(resource__in=list(resource_ids))
+        serializer = CollectionImageListSerializer(
+            queryset, context={"request": request}
         )
-        return Response(serializer.data)
+        return list_response(request, serializer)
 
     def post(self, request, pk=None, format=None):
         collection = get_object_or_404(Collection, pk=pk)
@@ -800,6 +1761,7 @@ class CourseImageViewSet(viewsets.ModelViewSet):
     -------
 
     - `GET /images`  Lists images
+    - `GET /images?metadata.<label>=<value>`  Lists images with a matching metadata pair
     - `GET /images/{pk}` Retrieves details of an image
     """
 
@@ -815,3 +1777,10 @@ class CourseImageViewSet(viewsets.ModelViewSet):
 
     def check_object_permissions(self, request, obj):
         super(CourseImageViewSet, self).check_object_permissions(request, obj.course)
+
+    def list(self, request, format=None):
+        queryset = self.filter_queryset(ImageProjection.objects.all())
+        queryset = filter_images_by_metadata(request, queryset)
+        queryset = queryset.order_by("course_id", "sort_order", "title")
+        serializer = ImageListSerializer(queryset, context={"request": request})
+        return list_response(request, serializer)
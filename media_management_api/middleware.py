@@ -1,10 +1,16 @@
 import logging
+import time
 
+from django.conf import settings
 from django.db import connection
 from django.utils.deprecation import MiddlewareMixin
 
+from .routers import pin_to_primary
+
 logger = logging.getLogger(__name__)
 
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
 
 class QueryCountDebugMiddleware(MiddlewareMixin):
     def process_response(self, request, response):
@@ -33,3 +39,47 @@ class ExceptionLoggingMiddleware(MiddlewareMixin):
             "Exception logged for request: %s message: %s"
             % (request.path, str(exception))
         )
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+    """
+    Pins a client's reads to the primary database for READ_YOUR_WRITES_SECONDS after the
+    client writes, so that it doesn't read stale data from a replica that hasn't caught up.
+
+    Requests with unsafe methods always use the primary. Their responses carry the time
+    until which the client stays pinned, both in a cookie and in a response header that
+    API clients can send back. Since the pin travels with the client, it holds whichever
+    node serves the next request.
+    """
+
+    cookie_name = "primary_db_until"
+    header_name = "X-Primary-DB-Until"
+
+    def get_pinned_until(self, request):
+        value = request.headers.get(self.header_name) or request.COOKIES.get(
+            self.cookie_name
+        )
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return 0
+
+    def process_request(self, request):
+        pinned = request.method not in SAFE_METHODS
+        pinned = pinned or self.get_pinned_until(request) > time.time()
+        pin_to_primary(pinned)
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS:
+            window = settings.READ_YOUR_WRITES_SECONDS
+            pinned_until = str(int(time.time()) + window)
+            response.set_cookie(
+                self.cookie_name,
+                pinned_until,
+                max_age=window,
+                secure=request.is_secure(),
+                httponly=True,
+            )
+            response[self.header_name] = pinned_until
+        pin_to_primary(False)
+        return response
@@ -0,0 +1,63 @@
+import contextlib
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_primary_pinned = contextvars.ContextVar("primary_pinned", default=False)
+
+
+def pin_to_primary(pinned=True):
+    """
+    Pins (or unpins) reads in the current context to the primary database.
+    """
+    _primary_pinned.set(pinned)
+
+
+def is_pinned_to_primary():
+    return _primary_pinned.get()
+
+
+@contextlib.contextmanager
+def use_primary():
+    """
+    Sends all reads in the block to the primary database. May also be used as a decorator.
+    """
+    token = _primary_pinned.set(True)
+    try:
+        yield
+    finally:
+        _primary_pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends writes to the primary ("default") database and reads to one of the replicas
+    listed in DATABASE_REPLICAS.
+
+    Reads go to the primary when there are no replicas, when the current context has been
+    pinned to the primary (see ReadYourWritesMiddleware), or when a transaction is open on
+    the primary, so that a transaction never reads data that a replica hasn't caught up to.
+    """
+
+    def get_replicas(self):
+        return getattr(settings, "DATABASE_REPLICAS", [])
+
+    def db_for_read(self, model, **hints):
+        replicas = self.get_replicas()
+        if not replicas or is_pinned_to_primary():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -10,6 +10,7 @@ https://docs.djangoproject.com/en/{{ docs_version }}/ref/settings/
 import logging
 import os
 import sys
+import tempfile
 
 from .secure import SECURE_SETTINGS
 
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "media_management_api.middleware.ReadYourWritesMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -98,6 +100,18 @@ DATABASES = {
     },
 }
 
+# Read replicas
+# Reads are spread across the replicas listed in "db_replica_hosts", which share the other
+# connection settings of the default (primary) database. A client that writes is pinned to
+# the primary for READ_YOUR_WRITES_SECONDS (see ReadYourWritesMiddleware).
+for _index, _host in enumerate(SECURE_SETTINGS.get("db_replica_hosts", [])):
+    DATABASES["replica%d" % _index] = dict(
+        DATABASES["default"], HOST=_host, TEST={"MIRROR": "default"}
+    )
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["media_management_api.routers.PrimaryReplicaRouter"]
+READ_YOUR_WRITES_SECONDS = SECURE_SETTINGS.get("read_your_writes_seconds", 10)
+
 # File uploads
 FILE_UPLOAD_HANDLERS = [
     "django.core.files.uploadhandler.MemoryFileUploadHandler",
@@ -226,7 +240,8 @@ LOGGING = {
 # Other project specific settings
 REST_FRAMEWORK = {
     "DEFAULT_RENDERER_CLASSES": (
-        "rest_framework.renderers.JSONRenderer",
+        "media_management_api.media_service.renderers.ORJSONRenderer",
+        "media_management_api.media_service.renderers.MessagePackRenderer",
         "rest_framework.renderers.BrowsableAPIRenderer",
     ),
     "DEFAULT_PARSER_CLASSES": (
@@ -241,11 +256,110 @@ REST_FRAMEWORK = {
     "TEST_REQUEST_DEFAULT_FORMAT": "json",
 }
 
+# List responses with at least this many items are streamed to the client as a chunked
+# JSON array rather than rendered in memory.
+STREAMING_LIST_THRESHOLD = SECURE_SETTINGS.get("streaming_list_threshold", 1000)
+
+# Async views (see asgi.py) run database and storage access on a thread pool of this
+# size. Each thread holds its own database connection. Set to 0 to run it on the request
+# thread instead (Django's thread sensitive mode).
+ASYNC_DB_THREADS = SECURE_SETTINGS.get("async_db_threads", 20)
+
+# Uploads of many images (zips, multiple files) identify, measure and hash them in a
+# pool of this many processes (see media_service/analysis.py). 0 analyzes them in the
+# request's process. Every web process would start its own pool, so this is off by
+# default; the ingest worker and the backfill commands start a pool sized for the host
+# instead (see their --analysis-processes option).
+IMAGE_ANALYSIS_PROCESSES = SECURE_SETTINGS.get("image_analysis_processes", 0)
+
+# Admission control for expensive endpoints (see media_service/admission.py). Each class
+# limits every user to "rate" requests per second with bursts of up to "burst" requests,
+# serves at most "concurrency" requests at once across all hosts, and cancels database
+# statements that run for longer than "statement_timeout" milliseconds (PostgreSQL).
+# Requests over the limits get a 429 response with a Retry-After header.
+ADMISSION_CONTROL_ENABLED = SECURE_SETTINGS.get("admission_control_enabled", True)
+ADMISSION_CONTROL = {
+    # Remote image imports, file and zip uploads, and library imports
+    "ingest": {"rate": 0.2, "burst": 10, "concurrency": 8, "statement_timeout": 60000},
+    "copy": {"rate": 0.02, "burst": 3, "concurrency": 2, "statement_timeout": 300000},
+    "iiif_collections": {
+        "rate": 0.1,
+        "burst": 2,
+        "concurrency": 2,
+        "statement_timeout": 30000,
+    },
+}
+ADMISSION_CONTROL.update(SECURE_SETTINGS.get("admission_control", {}))
+
+# Background ingestion (see media_service/ingest.py). Uploads sent with a
+# "Prefer: respond-async" header are spooled to the upload staging area (see
+# UPLOAD_STAGING_BACKEND below) and added to the course by the ingest worker (manage.py
+# ingest_worker), INGEST_BATCH_SIZE images at a time. A job that hasn't made progress for
+# INGEST_JOB_TIMEOUT seconds is taken over by another worker.
+INGEST_BATCH_SIZE = SECURE_SETTINGS.get("ingest_batch_size", 50)
+INGEST_JOB_TIMEOUT = SECURE_SETTINGS.get("ingest_job_timeout", 600)
+
+# Idempotency keys (see media_service/idempotency.py). The response to a request made with
+# an Idempotency-Key header is replayed for retries with the same key for
+# IDEMPOTENCY_KEY_EXPIRES seconds. A retry made while the first request is in progress
+# waits up to IDEMPOTENCY_WAIT seconds for it before getting a 409, and a request that
+# hasn't completed after IDEMPOTENCY_LOCK_TIMEOUT seconds is assumed to have died.
+IDEMPOTENCY_KEY_EXPIRES = SECURE_SETTINGS.get("idempotency_key_expires", 86400)
+IDEMPOTENCY_WAIT = SECURE_SETTINGS.get("idempotency_wait", 30)
+IDEMPOTENCY_LOCK_TIMEOUT = SECURE_SETTINGS.get("idempotency_lock_timeout", 3600)
+
 # IIIF settings
 IIIF_IMAGE_SERVER_URL = SECURE_SETTINGS.get(
     "iiif_image_server_url", "http://localhost:8000/loris/"
 )
 
+# Images larger than IIIF_DERIVATIVE_MIN_SIZE pixels on a side get a pyramidal copy (a
+# tiled, multi-resolution JPEG2000 with IIIF_DERIVATIVE_TILE_SIZE tiles), which the
+# image server reads instead of the original (see media_service/analysis.py). The
+# ingest worker makes them for background uploads. Run manage.py
+# generate_iiif_derivatives periodically to make them for images uploaded in a web
+# request, and for images stored before. Pillow must be built with OpenJPEG to make
+# them; without it they're skipped with a warning.
+IIIF_DERIVATIVES = SECURE_SETTINGS.get("iiif_derivatives", True)
+IIIF_DERIVATIVE_MIN_SIZE = SECURE_SETTINGS.get("iiif_derivative_min_size", 2048)
+IIIF_DERIVATIVE_TILE_SIZE = SECURE_SETTINGS.get("iiif_derivative_tile_size", 512)
+
+# Smaller copies of each image are offered to clients for responsive images (srcset), one
+# for each of these sizes (bounding boxes, in pixels) that is smaller than the image.
+IIIF_IMAGE_SIZES = SECURE_SETTINGS.get("iiif_image_sizes", [200, 400, 800, 1600])
+
+# Sprites of course images (see media_service/sprites.py) combine the thumbnails of a page
+# of SPRITE_PAGE_SIZE images (at most SPRITE_MAX_PAGE_SIZE), each fit in a square of
+# SPRITE_CELL_SIZE pixels. Thumbnails are fetched from the image server
+# SPRITE_FETCH_CONCURRENCY at a time, and sprites are cached for SPRITE_CACHE_TIMEOUT
+# seconds.
+SPRITE_PAGE_SIZE = SECURE_SETTINGS.get("sprite_page_size", 100)
+SPRITE_MAX_PAGE_SIZE = SECURE_SETTINGS.get("sprite_max_page_size", 400)
+SPRITE_CELL_SIZE = SECURE_SETTINGS.get("sprite_cell_size", 100)
+SPRITE_FETCH_CONCURRENCY = SECURE_SETTINGS.get("sprite_fetch_concurrency", 16)
+SPRITE_CACHE_TIMEOUT = SECURE_SETTINGS.get("sprite_cache_timeout", 7 * 86400)
+
+# Image information (info.json) documents served by the API (api/iiif/image/<id>/info.json)
+# are cached, and may be cached by clients, for this many seconds.
+IIIF_INFO_MAX_AGE = SECURE_SETTINGS.get("iiif_info_max_age", 86400)
+
+# Direct uploads (see media_service/staging.py). Clients PUT files straight to a staging
+# area with presigned URLs that expire after UPLOAD_URL_EXPIRES seconds. The "s3" backend
+# stages files under AWS_S3_KEY_PREFIX/staging in the bucket, and the "local" backend
+# stands in for it in development and tests by storing them in UPLOAD_STAGING_ROOT.
+# Chunked uploads are always assembled in UPLOAD_STAGING_ROOT, which must be shared by all
+# of the hosts that serve the API. Chunks may be at most UPLOAD_CHUNK_MAX_SIZE bytes.
+UPLOAD_STAGING_BACKEND = SECURE_SETTINGS.get("upload_staging_backend", "s3")
+UPLOAD_STAGING_ROOT = SECURE_SETTINGS.get(
+    "upload_staging_root",
+    os.path.join(tempfile.gettempdir(), "media_management_api", "staging"),
+)
+UPLOAD_URL_EXPIRES = SECURE_SETTINGS.get("upload_url_expires", 3600)
+UPLOAD_MAX_SIZE = SECURE_SETTINGS.get("upload_max_size", 5 * pow(2, 30))  # 5 GB
+UPLOAD_CHUNK_MAX_SIZE = SECURE_SETTINGS.get(
+    "upload_chunk_max_size", 100 * pow(2, 20)
+)  # 100 MB
+
 # AWS Settings
 # Used to store media files in an S3 bucket.
 #   - AWS_ACCESS_KEY_ID: AWS access credentials: the access key
@@ -267,6 +381,24 @@ CORS_ALLOW_HEADERS = (
     "origin",
     "authorization",
     "x-csrftoken",
+    # Pins reads to the primary database (see ReadYourWritesMiddleware)
+    "X-Primary-DB-Until",
+    # Chunks of resumable uploads (see UploadSessionChunksView)
+    "Upload-Offset",
+    "Upload-Checksum",
+    # Retries of uploads and imports (see media_service/idempotency.py)
+    "Idempotency-Key",
+    # Background uploads (Prefer: respond-async)
+    "Prefer",
+)
+# Response headers that browser clients may read
+CORS_EXPOSE_HEADERS = (
+    "X-Primary-DB-Until",
+    "Upload-Offset",
+    "Upload-Length",
+    "Idempotent-Replayed",
+    "Retry-After",
+    "Location",
 )
 
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
@@ -9,6 +9,8 @@ ALLOWED_HOSTS = ["127.0.0.1", "[::1]", "localhost", ".localhost"]
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
+UPLOAD_STAGING_BACKEND = "local"
+
 # INSTALLED_APPS += ('debug_toolbar',)
 # MIDDLEWARE += ('debug_toolbar.middleware.DebugToolbarMiddleware',)
 
@@ -0,0 +1,12 @@
+# The secure.py file stores environment specific settings and secrets.
+SECURE_SETTINGS = {
+    "enable_debug": True,
+    "django_secret_key": "abcd1234",
+    "db_default_name": "media_management_api",
+    "db_default_user": "media_management_api",
+    "db_default_password": "media_management_api",
+    "aws_access_key_id": "",
+    "aws_access_secret_key": "",
+    "aws_s3_bucket": "",
+    "aws_s3_key_prefix": "travis",
+}
@@ -11,6 +11,18 @@ DATABASES = {
     },
 }
 
+DATABASE_REPLICAS = []
+
 CACHES = {
     "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
 }
+
+# Test cases wrap each test in a transaction on the main thread's connection, which
+# other threads can't see.
+ASYNC_DB_THREADS = 0
+
+# Don't spawn a process pool for every upload test
+IMAGE_ANALYSIS_PROCESSES = 0
+
+# There is no Redis to keep the token buckets in
+ADMISSION_CONTROL_ENABLED = False